@@ -1,7 +1,16 @@
+import os
+import json
 import argparse
+from pathvalidate import sanitize_filename
 
 from otacon.data_types import comment_regex, sample_float, valid_date, dir_path, pos_tuple
 from otacon.prep_input import fetch_data_timeframe
+from otacon.prefilter import compile_prefilter
+from otacon.pushshift_handling import available_json_backends, READ_AHEAD
+from otacon.indexing import default_index_dir
+from otacon import columnar, writers
+from otacon.writers import OUTPUT_FORMATS
+from otacon.result_cache import default_cache_dir
 
 import re
 import logging
@@ -50,6 +59,10 @@ def define_parser() -> argparse.ArgumentParser:
                         help="Supply a token with expected POS tag to search how often this token is found with that POS-tag. Requires language specification")
     parser.add_argument('--language', '-L', required=False,
                         help="Language to be used for spacy search.")
+    parser.add_argument('--spacy_batch_size', type=int, default=64, required=False,
+                        help="How many texts spacy tags at once for the spacy search. Larger batches are faster, especially with a transformer model, but need more memory.")
+    parser.add_argument('--spacy_processes', type=int, default=1, required=False,
+                        help="Number of processes that tag the texts for the spacy search. Cannot be combined with --workers or --line_workers.")
     
     # special
     parser.add_argument('--count', '-C', action='store_true',
@@ -58,10 +71,14 @@ def define_parser() -> argparse.ArgumentParser:
                         help="Include regex matches that are inside Reddit quotes (lines starting with >, often but not exclusively used to quote other Reddit users)")
     parser.add_argument('--sample', '-SMP', type=sample_float, required=False,
                         help="Retrieve a sample of results fitting the other parameters. Sample size is given as float between 0.0 and 1.0 where 1.0 returns 100% of results")
+    parser.add_argument('--sample_method', choices=['fixed', 'bernoulli'], default='fixed', required=False,
+                        help="How the sample is drawn: 'fixed' samples exactly the given share of each month's lines, which requires the file monthly-counts.txt in the input directory, 'bernoulli' looks at each line with the given probability and needs no counts.")
     parser.add_argument('--reservoir_size', '-RS', type=int, required=False,
                         help="When performing a reservoir sample, sets the reservoir size to the given integer value. Only use without --sample.")
     parser.add_argument('--return_all', action='store_true', required=False,
                         help="Will return every search hit in its original and complete JSON form.")
+    parser.add_argument('--output_format', choices=OUTPUT_FORMATS, required=False,
+                        help="The format of the output files: CSV, JSON lines (both optionally compressed with zstd) or Parquet. Defaults to 'csv', with --return_all to 'jsonl'.")
     parser.add_argument('--dont_filter', action='store_true', required=False,
                         help="Skip any filtering.")
     parser.add_argument('--reverse_order', action='store_true', required=False,
@@ -70,31 +87,82 @@ def define_parser() -> argparse.ArgumentParser:
                         help="Will skip the cleanup (amassing results in a single file) at the end.")
     parser.add_argument('--no_stats', action="store_true", required=False,
                         help="Removes per-subreddit statistics. Might improve efficiency.")
+    parser.add_argument('--chunk_size', type=int, default=16, required=False,
+                        help="How many MiB of compressed data are decompressed at once. Larger chunks need more memory.")
+    parser.add_argument('--json_backend', choices=['auto', 'msgspec', 'orjson', 'json'], default='auto', required=False,
+                        help="The library used to decode the data. By default, the fastest one installed is used. orjson decodes integers beyond 64 bits as floats, so they lose precision.")
+    parser.add_argument('--dedupe', choices=['exact', 'bloom'], default='exact', required=False,
+                        help="How duplicates are detected: 'exact' keeps every ID (8 bytes each, moved to disk beyond --dedupe_memory), 'bloom' uses a fixed-size Bloom filter that may wrongly discard a small share of entries.")
+    parser.add_argument('--dedupe_memory', type=int, default=1024, required=False,
+                        help="With exact duplicate detection, the MiB of IDs kept in memory before they are moved to disk.")
+    parser.add_argument('--bloom_capacity', type=int, default=100_000_000, required=False,
+                        help="With Bloom filter duplicate detection, the expected number of relevant entries.")
+    parser.add_argument('--bloom_error_rate', type=float, default=0.001, required=False,
+                        help="With Bloom filter duplicate detection, the accepted rate of entries wrongly discarded as duplicates.")
+    parser.add_argument('--index_dir', type=str, required=False,
+                        help="The directory containing the indexes built with the index command. Defaults to the directory 'otacon_index' inside the input directory.")
+    parser.add_argument('--no_index', action="store_true", required=False,
+                        help="Do not use the indexes even if they are present.")
+    parser.add_argument('--no_prefilter', action="store_true", required=False,
+                        help="Decode every line of the data instead of skipping lines that cannot match the search parameters. Only useful for debugging.")
+    parser.add_argument('--cache', action="store_true", required=False,
+                        help="Keep the results of each month in a persistent cache, so that searching unchanged months again with the same parameters does not scan them.")
+    parser.add_argument('--cache_dir', type=str, required=False,
+                        help="The directory of the result cache. Defaults to the directory 'otacon_cache' inside the input directory.")
+    parser.add_argument('--cache_counts_only', action="store_true", required=False,
+                        help="Keep only the counts and statistics of each month in the result cache, not the extracted rows, so that it stays small. Searching again with --count is answered by the cache, extracting is not. Implies --cache.")
+    parser.add_argument('--checkpoint', action="store_true", required=False,
+                        help="Regularly save the progress of the search in the output directory, so that it can be continued with --resume if it is interrupted.")
+    parser.add_argument('--checkpoint_interval', type=float, default=10, required=False,
+                        help="Minutes between the checkpoints written within a month. A checkpoint is also written after each month.")
+    parser.add_argument('--resume', action="store_true", required=False,
+                        help="Continue an interrupted search with the same parameters from its last checkpoint. Implies --checkpoint.")
+    parser.add_argument('--queries', '-Q', type=str, required=False,
+                        help="A JSON file with several searches that are run in a single pass over the data, as an object mapping the name of each search to its search parameters, e.g. {\"brexit\": {\"commentregex\": \"brexit\", \"toplevel\": true}}. Each search gets its own subdirectory of the output directory.")
+    parser.add_argument('--progress_interval', type=float, default=60, required=False,
+                        help="Seconds between the reports of the progress, throughput, ETA and the time spent in each stage of the search. 0 turns them off. Defaults to 60.")
+    parser.add_argument('--metrics_file', type=str, required=False,
+                        help="The file the reports are appended to as JSON lines. Defaults to otacon_metrics.jsonl in the output directory.")
+    parser.add_argument('--read_ahead', type=int, default=READ_AHEAD, required=False,
+                        help=f"Number of chunks of a zstd dump that are decompressed ahead in a background thread while the lines before them are searched. The next month's dump is also opened and its start read ahead of time. 0 decompresses the chunks in between the lines instead. Defaults to {READ_AHEAD}.")
+    parser.add_argument('--profile', type=int, nargs='?', const=0, required=False, metavar='LINES',
+                        help="Profile the search and write the functions it spends its time in, a stack dump for a flamegraph and the rejections by each search criterion to the output directory. Only the first LINES lines of the data are searched if given, otherwise the whole timeframe.")
+    parser.add_argument('--workers', '-W', type=int, default=1, required=False,
+                        help="Number of processes the months are distributed over. Results are merged into exactly what a run with a single process returns.")
+    parser.add_argument('--line_workers', '-LW', type=int, default=1, required=False,
+                        help="Number of processes that decode and search the lines of each file while it is being decompressed. Useful for very large months.")
 
     return parser
 
 
-def handle_args() -> argparse.Namespace:
-    """Handle argument-related edge cases by throwing meaningful errors."""
+# the arguments that can be set per search in a --queries file
+QUERY_PARAMETERS = ('src', 'name', 'commentregex', 'flairregex', 'postregex', 'titleregex', 'userregex', 'firstmatch', 'case_sensitive',
+                    'popularity', 'toplevel', 'spacy_search', 'language', 'include_quoted', 'sample', 'sample_method', 'reservoir_size', 'return_all', 'dont_filter')
+
+
+def too_broad(args: argparse.Namespace, timeframe_given: bool) -> bool:
+    """
+    Test if a search has none of the parameters that limit its results.
+    This ignores the popularity and toplevel arguments because they alone would still lead to overflow.
+    """
+    return not timeframe_given and args.src is None and args.commentregex is None and args.flairregex is None and args.userregex is None
+
+
+def handle_args(argv: list = None) -> argparse.Namespace:
+    """Handle argument-related edge cases by throwing meaningful errors. The arguments are those of the command line unless given."""
     parser = define_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    given = argparse.Namespace(**vars(args)) # the arguments as given, for the searches of a --queries file
 
     if args.output is None and not args.count:
         parser.error("Since you're not just counting, you need to supply an output directory.")
 
     # all search parameters are optional to allow for different types of searches
     # should they all be missing, it would lead to data overflow as every comment would be extracted
-    # this ignores the popularity and toplevel arguments because they alone would still lead to overflow
-    if args.time_from is None and args.time_to is None and args.src is None and args.commentregex is None and args.flairregex is None and args.userregex is None:
+    timeframe_given = args.time_from is not None or args.time_to is not None
+    if args.queries is None and too_broad(args, timeframe_given):
         parser.error("Not enough parameters supplied. Search would return too many comments.")
 
-    # the 'src' argument is required if 'name' is given, however both are optional
-    if args.name is not None and args.src is None:
-        parser.error("argument --name requires argument --src also be given.")
-    # the 'name' argument is required if 'src' is given, however both are optional
-    elif args.src is not None and args.name is None:
-        parser.error("argument --src requires argument --name also be given.")
-
     # ensure that the timeframe makes sense (either the from-year is later than to-year, or the from-month is later than to-month in the same year)
     # only necessary if both endpoints are given
     if args.time_from is not None and args.time_to is not None:
@@ -105,6 +173,96 @@ def handle_args() -> argparse.Namespace:
         logging.info("No timeframe supplied. Searching all months found in the input directory.")
         args.time_from, args.time_to = fetch_data_timeframe(args.input)
     
+    if args.workers < 1 or args.line_workers < 1 or args.chunk_size < 1 or args.spacy_batch_size < 1 or args.spacy_processes < 1:
+        parser.error("arguments --workers, --line_workers, --chunk_size, --spacy_batch_size and --spacy_processes must be at least 1.")
+    if args.progress_interval < 0 or args.read_ahead < 0:
+        parser.error("--progress_interval and --read_ahead cannot be negative.")
+    if args.dedupe_memory < 1 or args.bloom_capacity < 1 or not 0 < args.bloom_error_rate < 1:
+        parser.error("--dedupe_memory and --bloom_capacity must be positive and --bloom_error_rate must be between 0 and 1.")
+    args.query_name = None # only set for the searches of a --queries file
+    # worker processes cannot start pools of their own
+    if args.workers > 1 and args.line_workers > 1:
+        parser.error("You cannot set both --workers and --line_workers.")
+    if args.spacy_processes > 1 and (args.workers > 1 or args.line_workers > 1):
+        parser.error("--spacy_processes cannot be combined with --workers or --line_workers.")
+
+    if 'submissions' in args.input:
+        args.searchmode = 'subs'
+    elif 'comments' in args.input:
+        args.searchmode = 'comms'
+    else:
+        args.searchmode = 'comms' # at least for now, no third search mode implemented, defaults to comments
+
+    if args.json_backend == 'auto':
+        args.json_backend = available_json_backends()[0]
+    elif args.json_backend not in available_json_backends():
+        parser.error(f"The JSON backend {args.json_backend} is not installed.")
+    logging.info(f"Decoding the data with {args.json_backend}.")
+
+    if args.index_dir is None:
+        args.index_dir = default_index_dir(args.input)
+
+    if args.resume:
+        args.checkpoint = True
+    if args.checkpoint and args.output is None:
+        parser.error("Checkpoints are saved in the output directory, so --checkpoint and --resume need --output.")
+    handle_output_format(parser, args)
+
+    if args.cache_counts_only:
+        args.cache = True
+    if args.cache_dir is None:
+        args.cache_dir = default_cache_dir(args.input)
+
+    # the input directory can also be a columnar store written by the store command
+    args.store = columnar.is_store(args.input)
+    if args.store:
+        if columnar.pa is None:
+            parser.error("The input directory is a columnar store, which requires pyarrow to be installed.")
+        if args.line_workers > 1:
+            parser.error("--line_workers cannot be used with a columnar store.")
+        logging.info("Searching the columnar store in the input directory.")
+
+    if args.profile is not None:
+        if args.profile < 0:
+            parser.error("--profile cannot be given a negative number of lines.")
+        # the profile only sees this process, and a slice of the search must not be cached or checkpointed as if it were complete
+        if args.workers > 1 or args.line_workers > 1 or args.spacy_processes > 1 or args.queries is not None or args.cache or args.checkpoint:
+            parser.error("--profile cannot be combined with --workers, --line_workers, --spacy_processes, --queries, --cache or --checkpoint.")
+        if args.profile and args.store:
+            parser.error("A columnar store can only be profiled as a whole, without a number of lines for --profile.")
+
+    if args.queries is not None:
+        if args.workers > 1 or args.line_workers > 1 or args.cache or args.checkpoint or args.store:
+            parser.error("--queries cannot be combined with --workers, --line_workers, --cache, --checkpoint or a columnar store.")
+        args.queries = load_queries(parser, args, given, timeframe_given)
+    else:
+        handle_search_args(parser, args)
+
+    return args
+
+
+def handle_output_format(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    """Choose the output format if none was given and check that it can be used."""
+    if args.output_format is None:
+        args.output_format = 'jsonl' if args.return_all else 'csv'
+    if args.return_all and not args.output_format.startswith('jsonl'):
+        parser.error("--return_all writes the entries as JSON lines, so the output format has to be 'jsonl' or 'jsonl.zst'.")
+    if args.output_format == 'parquet':
+        if writers.pa is None:
+            parser.error("Parquet output requires pyarrow to be installed.")
+        if args.checkpoint:
+            parser.error("A Parquet file cannot be cut back to a checkpoint, so --checkpoint and --resume need another output format.")
+
+
+def handle_search_args(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    """Check and prepare the arguments that define what is searched for."""
+    # the 'src' argument is required if 'name' is given, however both are optional
+    if args.name is not None and args.src is None:
+        parser.error("argument --name requires argument --src also be given.")
+    # the 'name' argument is required if 'src' is given, however both are optional
+    elif args.src is not None and args.name is None:
+        parser.error("argument --src requires argument --name also be given.")
+
     if args.spacy_search and not args.language:
         parser.error("You did not supply a language for the SpaCy search.")
 
@@ -117,19 +275,63 @@ def handle_args() -> argparse.Namespace:
     # avoid both sampling and reservoir size being set
     if args.sample is not None and args.reservoir_size is not None:
         parser.error("You cannot set both a sample size and a reservoir size.")
-    
+
     # compile regexes if given
     regex_attrs = ['commentregex', 'flairregex', 'userregex', 'postregex', 'titleregex']
     for attr in regex_attrs:
         if getattr(args, attr):
             flags = re.IGNORECASE if not args.case_sensitive else 0
             setattr(args, attr, re.compile(getattr(args, attr), flags))
-    
-    if 'submissions' in args.input:
-        args.searchmode = 'subs'
-    elif 'comments' in args.input:
-        args.searchmode = 'comms'
-    else:
-        args.searchmode = 'comms' # at least for now, no third search mode implemented, defaults to comments
 
-    return args
\ No newline at end of file
+    # cheap tests on the raw lines to avoid decoding lines that cannot be relevant (a store is filtered by its columns instead)
+    args.prefilter = compile_prefilter(args) if not args.no_prefilter and not args.store else None
+
+
+def load_queries(parser: argparse.ArgumentParser, args: argparse.Namespace, given: argparse.Namespace, timeframe_given: bool) -> dict:
+    """
+    Read the searches of a --queries file into a dict of name to arguments. Each search starts from the command line as given
+    (args holds the checked global arguments), with the search parameters of the file replacing those of the command line.
+    """
+    try:
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            queries = json.load(f)
+    except (OSError, ValueError) as e:
+        parser.error(f"The queries file {args.queries} could not be read: {e}")
+    if not isinstance(queries, dict) or not queries:
+        parser.error("The queries file must hold a JSON object mapping the name of each search to its parameters.")
+
+    actions = {action.dest: action for action in parser._actions}
+    query_args = {}
+    for name, parameters in queries.items():
+        if not isinstance(parameters, dict):
+            parser.error(f"The parameters of the search {name} must be a JSON object.")
+        search = argparse.Namespace(**vars(args))
+        for dest in QUERY_PARAMETERS:
+            setattr(search, dest, getattr(given, dest))
+        for dest, value in parameters.items():
+            dest = dest.lstrip('-').replace('-', '_')
+            if dest not in QUERY_PARAMETERS:
+                parser.error(f"{dest} cannot be set per search in the queries file (search {name}).")
+            action = actions[dest]
+            if isinstance(action, argparse._StoreTrueAction) or value is None:
+                setattr(search, dest, value)
+            elif isinstance(action, argparse._AppendAction):
+                setattr(search, dest, [str(elem) for elem in (value if isinstance(value, list) else [value])])
+            else:
+                try:
+                    value = action.type(str(value)) if action.type is not None else value
+                except (TypeError, ValueError) as e:
+                    parser.error(f"invalid value for {dest} in the search {name}: {e}")
+                if action.choices is not None and value not in action.choices:
+                    parser.error(f"invalid choice for {dest} in the search {name}: {value}")
+                setattr(search, dest, value)
+        if too_broad(search, timeframe_given):
+            parser.error(f"Not enough parameters supplied for the search {name}. Search would return too many comments.")
+        handle_search_args(parser, search)
+        search.output_format = given.output_format # the default depends on --return_all, which can differ per search
+        handle_output_format(parser, search)
+        search.queries, search.query_name = None, name
+        search.output = os.path.join(args.output, sanitize_filename(name)) if args.output is not None else None
+        query_args[name] = search
+    logging.info(f"Running {len(query_args)} searches in a single pass: {', '.join(query_args)}.")
+    return query_args
\ No newline at end of file
@@ -0,0 +1,253 @@
+'''
+benchmark: Time the stages of a search and whole searches on a directory of dumps, e.g. synthetic ones (see synthetic),
+and compare the throughput and peak memory with a stored baseline. Every stage and search runs in a process of its own,
+so its peak memory is its own. The stages include reading the dumps (e.g. parse is decompress plus decoding each line in full),
+like in a search, so the cost of a stage itself is the difference to the one before it.
+
+Usage: python otacon/main.py benchmark --input <directory with the dumps> [--repeat N] [--baseline <file>] [--save_baseline]
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from multiprocessing import Pool
+
+from otacon.data_types import dir_path
+from otacon.counts import read_counts, COUNTS_FILE
+from otacon.pushshift_handling import read_lines_with_offsets, parse_line
+
+# the peak memory of a process is only known on POSIX systems, elsewhere it is reported as unavailable
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import logging
+logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+
+
+BASELINE_FILE = 'benchmark-baseline.json'
+# the search of the stages
+STAGE_QUERY = ['-CR', r'\bthey\b']
+# the searches that are run as a whole, with the arguments that make them up
+QUERIES = {
+    'regex': ['-CR', r'\bthey\b'],
+    'regex_firstmatch': ['-CR', r'\bthey\b', '--firstmatch'],
+    'regex_quoted': ['-CR', r'\bthemself\b', '--include_quoted'],
+    'subreddit': ['--src', 'subreddit', '--name', 'NonBinary', '--no_index'],
+    'flair': ['-FR', r'they/them'],
+    'count': ['-CR', r'\bthey\b', '--count'],
+    'return_all': ['-CR', r'\bthemself\b', '--return_all'],
+}
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_rss(usage) -> float:
+    """The peak resident set size in a resource usage, in MiB (ru_maxrss is in KiB on Linux), or None without one."""
+    return usage.ru_maxrss / 1024 if usage is not None else None
+
+
+def dumps(input_dir: str) -> list:
+    return [os.path.join(input_dir, name) for name in sorted(os.listdir(input_dir)) if name.startswith(("RC", "RS"))]
+
+
+def stage_decompress(search, args, files: list, tmp: str):
+    def run():
+        return sum(1 for infile in files for _ in read_lines_with_offsets(infile, args.chunk_size * 2**20))
+    return run
+
+
+def stage_parse(search, args, files: list, tmp: str):
+    def run():
+        return sum(1 for infile in files for line, _ in read_lines_with_offsets(infile, args.chunk_size * 2**20) if parse_line(line, infile, backend=args.json_backend) is not None)
+    return run
+
+
+def stage_relevance(search, args, files: list, tmp: str):
+    def run():
+        lines = 0
+        for infile in files:
+            for line, _ in read_lines_with_offsets(infile, args.chunk_size * 2**20):
+                lines += 1
+                search.decode_if_relevant(line, infile, args)
+        return lines
+    return run
+
+
+def relevant_entries(search, args, files: list) -> list:
+    """The relevant entries of each file with their weights."""
+    search.seen_ids = search.make_dedupe(args)
+    return [[(entry, search.entry_weight(entry, args)) for line, _ in read_lines_with_offsets(infile, args.chunk_size * 2**20)
+             if (entry := search.decode_if_relevant(line, infile, args)) is not None] for infile in files]
+
+
+def extract_entries(search, args, entries: list, outfile: str, reviewfile: str) -> int:
+    """Write the rows of the relevant entries to the output files, returning their number."""
+    outf, reviewf = search.open_output(outfile, args), search.open_output(reviewfile, args, review=True)
+    for entry, weight in entries:
+        for i in range(weight):
+            search.filter_then_extract({'entry': entry, 'index': i}, args.commentregex, args, args.include_quoted, outf, reviewf)
+    rows = outf.rows + reviewf.rows
+    search.close_writer(outfile)
+    search.close_writer(reviewfile)
+    return rows
+
+
+def stage_extraction(search, args, files: list, tmp: str):
+    entries = [entry for month in relevant_entries(search, args, files) for entry in month]
+    def run():
+        outfile, reviewfile = search.open_files(args, os.path.basename(files[0]))
+        return extract_entries(search, args, entries, outfile, reviewfile)
+    return run
+
+
+def stage_cleanup(search, args, files: list, tmp: str):
+    rows = 0
+    for infile, entries in zip(files, relevant_entries(search, args, files)):
+        outfile, reviewfile = search.open_files(args, os.path.basename(infile))
+        rows += extract_entries(search, args, entries, outfile, reviewfile)
+    def run():
+        search.cleanup(tmp, extraction_name=search.assemble_outfile_name(args, month=None), workers=args.workers)
+        return rows
+    return run
+
+
+# the stages, with the unit of their throughput
+STAGES = {
+    'decompress': (stage_decompress, 'lines'),
+    'parse': (stage_parse, 'lines'),
+    'relevance': (stage_relevance, 'lines'),
+    'extraction': (stage_extraction, 'rows'),
+    'cleanup': (stage_cleanup, 'rows'),
+}
+
+
+def stage_task(task: tuple) -> tuple:
+    """Run a stage in a worker process of its own (used as pool task). Returns the number of lines or rows, the seconds and the peak memory."""
+    name, input_dir = task
+    import otacon.main as search # not at the top, as main imports this module
+    logging.disable(logging.INFO) # of the arguments, which are the same for every stage
+    with tempfile.TemporaryDirectory() as tmp:
+        args = search.handle_args(['-I', input_dir, '-O', tmp] + STAGE_QUERY)
+        args.fields = search.relevance_fields(args)
+        args.criteria = search.compile_criteria(args)
+        search.seen_ids = search.make_dedupe(args)
+        run = STAGES[name][0](search, args, dumps(input_dir), tmp)
+        start = time.perf_counter()
+        units = run()
+        seconds = time.perf_counter() - start
+    return units, seconds, peak_rss(resource.getrusage(resource.RUSAGE_SELF) if resource is not None else None)
+
+
+def run_stage(name: str, input_dir: str) -> tuple:
+    with Pool(1) as pool:
+        return pool.apply(stage_task, ((name, input_dir),))
+
+
+def run_query(name: str, input_dir: str, lines: int) -> tuple:
+    """Run a search as a whole with otacon's command line. Returns the number of lines of the dumps, the seconds and the peak memory."""
+    with tempfile.TemporaryDirectory() as tmp:
+        command = [sys.executable, '-m', 'otacon.main', '-I', input_dir, '-O', tmp] + QUERIES[name]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([PACKAGE_DIR] + [path for path in [os.environ.get('PYTHONPATH')] if path]))
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=PACKAGE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        else:
+            usage = None
+            process.wait()
+        seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"The search {name} failed: {' '.join(command)}")
+    return lines, seconds, peak_rss(usage)
+
+
+def count_dump_lines(input_dir: str) -> int:
+    """The number of lines of the dumps, from the counts file if it has all of them."""
+    counts = read_counts(os.path.join(input_dir, COUNTS_FILE))
+    files = dumps(input_dir)
+    if len(counts) >= len(files):
+        return sum(counts.values())
+    return run_stage('decompress', input_dir)[0]
+
+
+def benchmark(input_dir: str, stages: list, queries: list, repeat: int = 1) -> dict:
+    """
+    Run the stages and searches, each repeat times, and return their results by name: the throughput of the fastest run
+    in lines or rows per second, the unit, the seconds and the highest peak memory in MiB.
+    """
+    results = {}
+    lines = count_dump_lines(input_dir)
+    runs = [(name, lambda name=name: run_stage(name, input_dir), STAGES[name][1]) for name in stages]
+    runs += [(f'query:{name}', lambda name=name: run_query(name, input_dir, lines), 'lines') for name in queries]
+    for name, run, unit in runs:
+        logging.info(f"Running {name}…")
+        measurements = [run() for _ in range(repeat)]
+        units, seconds = min(((units, seconds) for units, seconds, _ in measurements), key=lambda measurement: measurement[1])
+        results[name] = {'rate': units / seconds if seconds > 0 else 0.0, 'unit': unit, 'units': units, 'seconds': seconds,
+                         'peak_rss': max((rss for _, _, rss in measurements if rss is not None), default=None)}
+    results['corpus'] = {'lines': lines, 'dumps': len(dumps(input_dir))}
+    return results
+
+
+def report(results: dict, baseline: dict = None):
+    """Log the results, with the change of the throughput and peak memory relative to the baseline if given."""
+    if baseline is not None and baseline.get('corpus') != results['corpus']:
+        logging.warning("The baseline was measured on other dumps, so the results cannot be compared to it.")
+        baseline = None
+    logging.info(f"{'':<24}{'throughput':>22}{'seconds':>10}{'peak MiB':>10}" + (f"{'vs. baseline':>28}" if baseline else ''))
+    for name, result in results.items():
+        if name == 'corpus':
+            continue
+        peak = f"{result['peak_rss']:>10.1f}" if result['peak_rss'] is not None else f"{'n/a':>10}"
+        line = f"{name:<24}{result['rate']:>15,.0f} {result['unit']}/s{result['seconds']:>10.2f}{peak}"
+        previous = (baseline or {}).get(name)
+        if previous is not None:
+            line += f"{(result['rate'] / previous['rate'] - 1) * 100:>+14.1f}%"
+            if result['peak_rss'] is not None and previous['peak_rss'] is not None:
+                line += f"{(result['peak_rss'] / previous['peak_rss'] - 1) * 100:>+13.1f}%"
+        logging.info(line)
+
+
+def define_parser() -> argparse.ArgumentParser:
+    """Define console argument parser for the benchmark command."""
+    parser = argparse.ArgumentParser(prog="otacon benchmark", description="Measure the throughput and memory of the stages of a search and of whole searches")
+    parser.add_argument('--input', '-I', type=dir_path, required=True,
+                        help="The directory containing the dumps, e.g. the directory 'comments' written by the synthesize command.")
+    parser.add_argument('--stages', nargs='*', choices=list(STAGES), default=list(STAGES), required=False,
+                        help="The stages to time. Defaults to all of them.")
+    parser.add_argument('--queries', nargs='*', choices=list(QUERIES), default=list(QUERIES), required=False,
+                        help="The searches to time as a whole. Defaults to all of them.")
+    parser.add_argument('--repeat', type=int, default=3, required=False,
+                        help="How often each stage and search is run. The fastest run counts. Defaults to 3.")
+    parser.add_argument('--baseline', type=str, required=False,
+                        help=f"The file with the baseline results. Defaults to {BASELINE_FILE} in the input directory.")
+    parser.add_argument('--save_baseline', action='store_true', required=False,
+                        help="Save the results as the new baseline.")
+    return parser
+
+
+def main(argv=None):
+    args = define_parser().parse_args(argv)
+    baseline_path = args.baseline or os.path.join(args.input, BASELINE_FILE)
+    baseline = None
+    if os.path.isfile(baseline_path):
+        with open(baseline_path, 'r') as f:
+            baseline = json.load(f)
+
+    results = benchmark(args.input, args.stages, args.queries, max(args.repeat, 1))
+    report(results, baseline)
+
+    if args.save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        logging.info(f"Saved the results as baseline to {baseline_path}.")
+
+
+if __name__ == "__main__":
+    main()
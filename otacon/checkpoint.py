@@ -0,0 +1,103 @@
+'''
+checkpoint: Periodic checkpoints of a running search, so that an interrupted search can be resumed with --resume
+without losing or duplicating results. A checkpoint consists of a JSON file with the state of the search
+(position in the timeframe and in the current month, counters, statistics, reservoir, random state and
+the sizes of the output files) and the files of the duplicate check, in a directory inside the output directory.
+'''
+
+import os
+import json
+import time
+import shutil
+import random
+import argparse
+
+from otacon.result_cache import query_fingerprint
+
+import logging
+logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+
+
+CHECKPOINT_VERSION = 2
+CHECKPOINT_DIRNAME = '.otacon_checkpoint'
+STATE_FILE = 'checkpoint.json'
+
+
+def checkpoint_dir(output_dir: str) -> str:
+    return os.path.join(output_dir, CHECKPOINT_DIRNAME)
+
+
+def search_fingerprint(args: argparse.Namespace, timeframe: list) -> dict:
+    """Everything a resumed search has to share with the interrupted one."""
+    return dict(query_fingerprint(args), timeframe=timeframe, sample=args.sample, sample_method=args.sample_method, reservoir_size=args.reservoir_size, dedupe=args.dedupe,
+                output_format=args.output_format)
+
+
+def output_sizes(paths: list) -> dict:
+    """The current sizes of the output files, None for those that do not exist."""
+    return {path: os.path.getsize(path) if os.path.isfile(path) else None for path in paths}
+
+
+def restore_outputs(sizes: dict):
+    """Cut the output files back to their sizes at the checkpoint, removing rows written after it."""
+    for path, size in sizes.items():
+        if size is None:
+            if os.path.isfile(path):
+                os.remove(path)
+        else:
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+
+
+class Checkpoints:
+    """
+    Writes the checkpoints of a search, at most once per interval (in seconds) within a month.
+    Each checkpoint holds the base (the search fingerprint and output file names) and the sizes of the output files.
+    """
+
+    def __init__(self, directory: str, interval: float, base: dict, outputs: list, generation: int = 0):
+        self.directory = directory
+        self.interval = interval
+        self.base = base
+        self.outputs = outputs
+        self.generation = generation
+        self.last = time.monotonic()
+
+    def due(self) -> bool:
+        return time.monotonic() - self.last >= self.interval
+
+    def save(self, state: dict, dedupe, random_state=None):
+        """
+        Write a checkpoint with the given state, the random state (the current one unless given) and the duplicate check.
+        The duplicate check is written under a new generation number, so the previous checkpoint stays usable until the new one is complete.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.generation += 1
+        state = dict(self.base, **state, version=CHECKPOINT_VERSION, generation=self.generation, outputs=output_sizes(self.outputs),
+                     random_state=random_state or random.getstate(), dedupe=dedupe.save(self.directory, self.generation))
+        path = os.path.join(self.directory, STATE_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+        for name in [f'ids-{self.generation - 1}.bin', f'bloom-{self.generation - 1}.bin']:
+            if os.path.isfile(os.path.join(self.directory, name)):
+                os.remove(os.path.join(self.directory, name))
+        self.last = time.monotonic()
+
+    def remove(self):
+        """Remove the checkpoint once the search is complete."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def load(directory: str) -> dict:
+    """Read the state of the last checkpoint and restore the random state. Returns None if there is no checkpoint."""
+    path = os.path.join(directory, STATE_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as f:
+        state = json.load(f)
+    if state.get('version') != CHECKPOINT_VERSION:
+        return None
+    version, internal_state, gauss_next = state['random_state']
+    random.setstate((version, tuple(internal_state), gauss_next))
+    return state
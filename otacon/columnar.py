@@ -0,0 +1,335 @@
+'''
+columnar: A columnar store of the Pushshift data dumps in Parquet files, and the query path that searches it.
+Each month becomes a directory of Parquet files with the metadata and texts in separate columns, so a search only reads
+the columns its criteria need: metadata filters run vectorized over whole columns, the texts are only read for rows
+that pass them, and only the hits are decoded from their original JSON line, which is kept in the store as well.
+
+Usage: python otacon/main.py store --input <directory with the dumps> --output <store directory> [--subreddit_buckets N] [--workers N]
+The store directory can then be searched like the dumps by passing it as --input.
+'''
+
+import os
+import re
+import json
+import heapq
+import shutil
+import zlib
+import argparse
+from multiprocessing import Pool
+
+# the store is optional, so is its dependency
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from otacon.data_types import dir_path
+from otacon.pushshift_handling import read_lines, parse_line, available_json_backends
+
+import logging
+logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+
+
+STORE_VERSION = 1
+STORE_MARKER = 'otacon-store.json'
+
+# the fields that get a column of their own, besides the line number and the original JSON line
+STRING_FIELDS = ('id', 'parent_id', 'body', 'selftext', 'title')
+DICTIONARY_FIELDS = ('subreddit', 'author', 'author_flair_text') # few distinct values, stored dictionary-encoded
+INTEGER_FIELDS = ('created_utc', 'score')
+STORED_FIELDS = STRING_FIELDS + DICTIONARY_FIELDS + INTEGER_FIELDS
+
+ROW_GROUP_SIZE = 2**15
+
+
+def schema():
+    """The Arrow schema of the Parquet files in the store."""
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([('line', pa.int64())]
+                     + [(field, pa.string()) for field in STRING_FIELDS]
+                     + [(field, dictionary) for field in DICTIONARY_FIELDS]
+                     + [(field, pa.int64()) for field in INTEGER_FIELDS]
+                     + [('raw', pa.binary())])
+
+
+def is_store(directory: str) -> bool:
+    """Test if a directory is a columnar store written by the store command."""
+    return os.path.isfile(os.path.join(directory, STORE_MARKER))
+
+
+def read_store_meta(directory: str) -> dict:
+    with open(os.path.join(directory, STORE_MARKER), 'r') as f:
+        return json.load(f)
+
+
+def month_name(dump: str) -> str:
+    """The name of a month's directory in the store: the dump's file name without its ending."""
+    return re.sub(r'\.\w+$', '', dump)
+
+
+def bucket_of(subreddit: str, buckets: int) -> int:
+    """The bucket of a subreddit. Lower-cased, so that case-insensitive searches only need the buckets of the searched names as well."""
+    return zlib.crc32(subreddit.lower().encode()) % buckets
+
+
+def as_string(value):
+    return value if isinstance(value, str) else None
+
+
+def as_integer(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class MonthWriter:
+    """Collects the rows of a month and writes them to one Parquet file per bucket in row groups of ROW_GROUP_SIZE rows."""
+
+    def __init__(self, directory: str, buckets: int):
+        self.directory = directory
+        self.buckets = buckets
+        self.writers = {}
+        self.rows = {}
+
+    def add(self, line_number: int, entry: dict, line: bytes):
+        subreddit = as_string(entry.get('subreddit'))
+        bucket = bucket_of(subreddit or '', self.buckets) if self.buckets else 0
+        rows = self.rows.setdefault(bucket, [])
+        rows.append((line_number, entry, line))
+        if len(rows) == ROW_GROUP_SIZE:
+            self.flush(bucket)
+
+    def flush(self, bucket: int):
+        rows = self.rows.pop(bucket, [])
+        if not rows:
+            return
+        columns = {'line': pa.array([line_number for line_number, _, _ in rows], pa.int64())}
+        for field in STRING_FIELDS:
+            columns[field] = pa.array([as_string(entry.get(field)) for _, entry, _ in rows], pa.string())
+        for field in DICTIONARY_FIELDS:
+            columns[field] = pa.array([as_string(entry.get(field)) for _, entry, _ in rows], pa.string()).dictionary_encode()
+        for field in INTEGER_FIELDS:
+            columns[field] = pa.array([as_integer(entry.get(field)) for _, entry, _ in rows], pa.int64())
+        columns['raw'] = pa.array([line for _, _, line in rows], pa.binary())
+        table = pa.table(columns, schema=schema())
+
+        if bucket not in self.writers:
+            name = f'bucket-{bucket:03}.parquet' if self.buckets else 'part.parquet'
+            self.writers[bucket] = pq.ParquetWriter(os.path.join(self.directory, name), schema(), compression='zstd')
+        self.writers[bucket].write_table(table, row_group_size=ROW_GROUP_SIZE)
+
+    def close(self):
+        for bucket in list(self.rows):
+            self.flush(bucket)
+        for writer in self.writers.values():
+            writer.close()
+
+
+def store_month(infile: str, store_dir: str, buckets: int, backend: str = 'json'):
+    """Write a month's dump to the store. Corrupted lines are left out, but the line numbers of the others are kept so that sampling picks the same lines."""
+    outdir = os.path.join(store_dir, month_name(os.path.basename(infile)))
+    tmpdir = os.path.join(store_dir, '.' + month_name(os.path.basename(infile)) + '.tmp') # hidden from the month listing
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    os.makedirs(tmpdir)
+
+    writer = MonthWriter(tmpdir, buckets)
+    lines = 0
+    for line_number, line in enumerate(read_lines(infile)):
+        lines += 1
+        line = line.rstrip(b'\n')
+        entry = parse_line(line, infile, STORED_FIELDS, backend)
+        if entry is not None:
+            writer.add(line_number, entry, line)
+    writer.close()
+
+    shutil.rmtree(outdir, ignore_errors=True)
+    os.replace(tmpdir, outdir) # a month is only ever complete or absent
+    logging.info(f"Stored {lines:,} lines of {os.path.basename(infile)}.")
+
+
+def dictionary_mask(column, test):
+    """
+    Evaluate a test on the values of a dictionary-encoded column, returning a boolean column.
+    The test is only run once per distinct value and then spread over the rows by their dictionary indices. Missing values fail.
+    """
+    chunks = []
+    for chunk in column.chunks:
+        if not pa.types.is_dictionary(chunk.type):
+            chunk = chunk.dictionary_encode()
+        passing = pa.array([value is not None and bool(test(value)) for value in chunk.dictionary.to_pylist()], pa.bool_())
+        chunks.append(pc.fill_null(passing.take(chunk.indices), False))
+    return pa.chunked_array(chunks, pa.bool_())
+
+
+def metadata_filters(args: argparse.Namespace) -> list:
+    """
+    The vectorized tests that follow from the search arguments, as (column, function returning a boolean column) tuples.
+    They never reject an entry that matches_criteria() accepts, which still decides on the entries that pass.
+    """
+    filters = []
+    if args.name is not None:
+        src = 'author' if args.src == 'user' else 'subreddit'
+        names, case_sensitive = args.name, args.case_sensitive
+        filters.append((src, lambda column: dictionary_mask(column, lambda value: (value if case_sensitive else value.lower()) in names)))
+    if args.toplevel:
+        filters.append(('parent_id', lambda column: pc.fill_null(pc.starts_with(column, 't3'), False)))
+    for regex, field in [(args.flairregex, 'author_flair_text'), (args.userregex, 'author')]:
+        if regex is not None:
+            filters.append((field, lambda column, regex=regex: dictionary_mask(column, lambda value: re.search(regex, value))))
+    return filters
+
+
+def month_files(month_dir: str, args: argparse.Namespace) -> list:
+    """The Parquet files of a month that can hold relevant entries: with subreddit buckets and a subreddit search, only the buckets of the searched subreddits."""
+    files = sorted(name for name in os.listdir(month_dir) if name.endswith('.parquet'))
+    buckets = read_store_meta(os.path.dirname(os.path.normpath(month_dir))).get('subreddit_buckets')
+    if buckets and args.name is not None and args.src == 'subreddit':
+        wanted = {f'bucket-{bucket_of(name, buckets):03}.parquet' for name in args.name}
+        files = [name for name in files if name in wanted]
+    return [os.path.join(month_dir, name) for name in files]
+
+
+def query_file(path: str, args: argparse.Namespace, filters: list, positions, predicate):
+    """
+    Yield (line number, raw line) of the entries in a Parquet file of the store that pass the metadata filters and the predicate, in line order.
+    The predicate is called with a dict of the fields in args.fields.
+    """
+    parquet = pq.ParquetFile(path)
+    fields = list(args.fields or ())
+    metadata = ['line'] + sorted({column for column, _ in filters})
+    texts = [field for field in fields if field not in metadata]
+
+    for row_group in range(parquet.num_row_groups):
+        table = parquet.read_row_group(row_group, columns=metadata)
+        mask = None
+        for column, test in filters:
+            passing = test(table.column(column))
+            mask = passing if mask is None else pc.and_(mask, passing)
+        if positions is not None:
+            passing = pc.is_in(table.column('line'), value_set=positions)
+            mask = passing if mask is None else pc.and_(mask, passing)
+        if mask is not None:
+            table = table.filter(mask)
+            if table.num_rows == 0:
+                continue
+
+        # the texts are only read for the rows that passed the metadata filters
+        if texts:
+            text_table = parquet.read_row_group(row_group, columns=texts)
+            if mask is not None:
+                text_table = text_table.filter(mask)
+            for field in texts:
+                table = table.append_column(field, text_table.column(field))
+        rows = table.select(fields).to_pylist() if fields else [{}] * table.num_rows
+        hits = [i for i, row in enumerate(rows) if predicate(row)]
+        if not hits:
+            continue
+
+        raw = parquet.read_row_group(row_group, columns=['raw']).column('raw')
+        if mask is not None:
+            raw = raw.filter(mask)
+        hits = pa.array(hits, pa.int64())
+        yield from zip(table.column('line').take(hits).to_pylist(), raw.take(hits).to_pylist())
+
+
+def line_count(month_dir: str) -> int:
+    """The number of lines of a month's dump up to its last stored entry, from the statistics of the line column."""
+    count = 0
+    for name in os.listdir(month_dir):
+        if name.endswith('.parquet'):
+            metadata = pq.ParquetFile(os.path.join(month_dir, name)).metadata
+            for row_group in range(metadata.num_row_groups):
+                statistics = metadata.row_group(row_group).column(0).statistics
+                if statistics is not None and statistics.has_min_max:
+                    count = max(count, statistics.max + 1)
+    return count
+
+
+def query_month(month_dir: str, args: argparse.Namespace, predicate, positions=None):
+    """
+    Yield (line number, raw line) of the entries of a month in the store that pass the metadata filters and the predicate, in the order of the original dump.
+    If positions are given, only the entries at these line numbers are considered.
+    """
+    if positions is not None:
+        positions = pa.array(positions, pa.int64())
+    filters = metadata_filters(args)
+    streams = [query_file(path, args, filters, positions, predicate) for path in month_files(month_dir, args)]
+    yield from heapq.merge(*streams, key=lambda hit: hit[0])
+
+
+def read_lines_at(month_dir: str, line_numbers) -> dict:
+    """Read the raw lines with the given line numbers from a month in the store, as a dict of line number to raw line."""
+    wanted = pa.array(sorted(set(line_numbers)), pa.int64())
+    lines = {}
+    for name in sorted(os.listdir(month_dir)):
+        if name.endswith('.parquet'):
+            table = pq.read_table(os.path.join(month_dir, name), columns=['line', 'raw'], filters=pc.is_in(pc.field('line'), value_set=wanted))
+            lines.update(zip(table.column('line').to_pylist(), table.column('raw').to_pylist()))
+    return lines
+
+
+def store_task(task: tuple):
+    """Store a single dump (used as pool task)."""
+    store_month(*task)
+
+
+def define_parser() -> argparse.ArgumentParser:
+    """Define console argument parser for the store command."""
+    parser = argparse.ArgumentParser(prog="otacon store", description="Convert the Pushshift data dumps into a columnar store that can be searched like the dumps")
+    parser.add_argument('--input', '-I', type=dir_path, required=True,
+                        help="The directory containing the Pushshift data dumps.")
+    parser.add_argument('--output', '-O', type=dir_path, required=True,
+                        help="The directory of the store.")
+    parser.add_argument('--subreddit_buckets', type=int, required=False,
+                        help="Partition each month into this many files by subreddit, so that searches for a few subreddits only read their files.")
+    parser.add_argument('--workers', '-W', type=int, default=1, required=False,
+                        help="Number of dumps converted at the same time.")
+    parser.add_argument('--force', action='store_true', required=False,
+                        help="Convert months that are already in the store again.")
+    return parser
+
+
+def main(argv=None):
+    parser = define_parser()
+    args = parser.parse_args(argv)
+    if pa is None:
+        parser.error("The store command requires pyarrow, which is not installed.")
+    if args.subreddit_buckets is not None and args.subreddit_buckets < 1:
+        parser.error("--subreddit_buckets must be at least 1.")
+
+    if is_store(args.output) and read_store_meta(args.output).get('subreddit_buckets') != args.subreddit_buckets:
+        if not args.force:
+            parser.error("The store was written with a different number of subreddit buckets. Use --force to convert all months again.")
+    elif not is_store(args.output) and os.listdir(args.output):
+        parser.error("The output directory is neither empty nor a store.")
+    with open(os.path.join(args.output, STORE_MARKER), 'w') as f:
+        json.dump({'version': STORE_VERSION, 'subreddit_buckets': args.subreddit_buckets}, f)
+    # the monthly counts are needed for sampling
+    counts = os.path.join(args.input, 'monthly-counts.txt')
+    if os.path.isfile(counts):
+        shutil.copy(counts, args.output)
+
+    backend = available_json_backends()[0]
+    tasks = []
+    for month in sorted(os.listdir(args.input)):
+        if not (month.startswith("RC") or month.startswith("RS")):
+            continue
+        if not args.force and os.path.isdir(os.path.join(args.output, month_name(month))):
+            logging.info(f"{month} is already in the store.")
+            continue
+        tasks.append((os.path.join(args.input, month), args.output, args.subreddit_buckets, backend))
+
+    if args.workers > 1:
+        with Pool(args.workers) as pool:
+            for _ in pool.imap_unordered(store_task, tasks):
+                pass
+    else:
+        for task in tasks:
+            store_task(task)
+
+
+if __name__ == "__main__":
+    main()
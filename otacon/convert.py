@@ -0,0 +1,129 @@
+'''
+convert: Re-encode the Pushshift data dumps into independently decodable zstd frames with a frame table.
+The converted files are still valid zstd files, but they can be read starting at any frame, and lines at known
+offsets can be read by decompressing only their frame.
+
+Usage: python otacon/main.py convert --input <directory with the dumps> --output <directory> [--frame_size MiB] [--level N] [--workers N]
+'''
+
+import os
+import json
+import struct
+import argparse
+from multiprocessing import Pool
+from zstandard import ZstdCompressor
+
+from otacon.data_types import dir_path
+from otacon.pushshift_handling import read_lines, parse_line, available_json_backends, read_frame_table, FRAME_TABLE_MARKER, FRAME_TABLE_FOOTER, SKIPPABLE_FRAME_MAGIC
+
+import logging
+logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+
+
+FRAME_TABLE_VERSION = 1
+
+
+def created_utc(line: bytes, infile: str, backend: str) -> int:
+    """The creation time of a raw line, or None if it is missing or corrupted."""
+    entry = parse_line(line, infile, ('created_utc',), backend)
+    try:
+        return int(entry['created_utc'])
+    except (TypeError, KeyError, ValueError):
+        return None
+
+
+def convert_dump(infile: str, outfile: str, frame_size: int, level: int = 9, backend: str = 'json'):
+    """
+    Re-encode a dump into zstd frames of about frame_size bytes of decompressed data each. Frames always end at a line break.
+    The frame table is appended as JSON inside a skippable frame, which decompressors ignore, and is followed by
+    its length and a marker so that it can be found from the end of the file.
+    """
+    compressor = ZstdCompressor(level=level, write_content_size=True)
+    frames = []
+    lines, data_offset, offset = 0, 0, 0
+    tmpfile = outfile + '.tmp'
+
+    with open(tmpfile, 'wb') as f:
+        def write_frame(pending: list, times: list):
+            nonlocal lines, data_offset, offset
+            data = b''.join(pending)
+            compressed = compressor.compress(data)
+            f.write(compressed)
+            frames.append({'offset': offset, 'size': len(compressed), 'data_offset': data_offset, 'data_size': len(data),
+                           'first_line': lines, 'lines': len(pending),
+                           'min_utc': min(times) if times else None, 'max_utc': max(times) if times else None})
+            lines += len(pending)
+            data_offset += len(data)
+            offset += len(compressed)
+
+        pending, times, pending_size = [], [], 0
+        for line in read_lines(infile):
+            line = line.rstrip(b'\n') + b'\n'
+            pending.append(line)
+            pending_size += len(line)
+            time = created_utc(line, infile, backend)
+            if time is not None:
+                times.append(time)
+            if pending_size >= frame_size:
+                write_frame(pending, times)
+                pending, times, pending_size = [], [], 0
+        if pending:
+            write_frame(pending, times)
+
+        table = json.dumps({'version': FRAME_TABLE_VERSION, 'frame_size': frame_size, 'frames': frames}).encode()
+        f.write(struct.pack('<II', SKIPPABLE_FRAME_MAGIC, len(table) + FRAME_TABLE_FOOTER.size))
+        f.write(table)
+        f.write(FRAME_TABLE_FOOTER.pack(len(table), FRAME_TABLE_MARKER))
+    os.replace(tmpfile, outfile) # a converted dump is only ever complete or absent
+    logging.info(f"Converted {lines:,} lines of {os.path.basename(infile)} into {len(frames):,} frames.")
+
+
+def convert_month(task: tuple):
+    """Convert a single dump (used as pool task)."""
+    convert_dump(*task)
+
+
+def define_parser() -> argparse.ArgumentParser:
+    """Define console argument parser for the convert command."""
+    parser = argparse.ArgumentParser(prog="otacon convert", description="Re-encode the Pushshift data dumps into independently decodable zstd frames")
+    parser.add_argument('--input', '-I', type=dir_path, required=True,
+                        help="The directory containing the Pushshift data dumps.")
+    parser.add_argument('--output', '-O', type=dir_path, required=True,
+                        help="The directory the converted dumps are written to. If it is the input directory, the dumps are replaced.")
+    parser.add_argument('--frame_size', type=int, default=16, required=False,
+                        help="The amount of decompressed data per frame in MiB. Smaller frames allow finer-grained access but compress less well.")
+    parser.add_argument('--level', type=int, default=9, required=False,
+                        help="The zstd compression level.")
+    parser.add_argument('--workers', '-W', type=int, default=1, required=False,
+                        help="Number of dumps converted at the same time.")
+    parser.add_argument('--force', action='store_true', required=False,
+                        help="Convert dumps that are already divided into frames again.")
+    return parser
+
+
+def main(argv=None):
+    args = define_parser().parse_args(argv)
+    backend = available_json_backends()[0]
+
+    tasks = []
+    for month in sorted(os.listdir(args.input)):
+        if not (month.startswith("RC") or month.startswith("RS")):
+            continue
+        infile = os.path.join(args.input, month)
+        outfile = os.path.join(args.output, month if month.endswith('.zst') else os.path.splitext(month)[0] + '.zst')
+        if not args.force and os.path.isfile(outfile) and read_frame_table(outfile) is not None:
+            logging.info(f"{month} is already converted.")
+            continue
+        tasks.append((infile, outfile, args.frame_size * 2**20, args.level, backend))
+
+    if args.workers > 1:
+        with Pool(args.workers) as pool:
+            for _ in pool.imap_unordered(convert_month, tasks):
+                pass
+    else:
+        for task in tasks:
+            convert_month(task)
+
+
+if __name__ == "__main__":
+    main()
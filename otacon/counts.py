@@ -0,0 +1,150 @@
+'''
+counts: Build the file monthly-counts.txt with the number of entries of every dump in a directory, which sampling needs.
+The lines are counted on the decompressed data without decoding them. The counts are cached together with the size and
+modification time of each dump, so when the command is run again only new or changed dumps are counted.
+
+Usage: python otacon/main.py counts --input <directory with the dumps> [--workers N]
+'''
+
+import os
+import re
+import csv
+import json
+import argparse
+from multiprocessing import Pool
+from zstandard import ZstdDecompressor
+
+from otacon.data_types import dir_path
+from otacon.indexing import file_identity
+from otacon.pushshift_handling import read_frame_table, CHUNK_SIZE
+
+import logging
+logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+
+
+COUNTS_FILE = 'monthly-counts.txt'
+COUNTS_CACHE = '.monthly-counts.json'
+
+
+def count_lines(infile: str, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Count the lines of a dump by counting the line breaks in its decompressed data, plus an unterminated last line.
+    Dumps converted into frames are not decompressed at all, since their frame table holds the number of lines.
+    """
+    compressed = infile.endswith('.bz2') or infile.endswith('.xz') or infile.endswith('.zst')
+    frames = read_frame_table(infile) if compressed else None
+    if frames is not None:
+        return sum(frame['lines'] for frame in frames)
+
+    lines, last = 0, b'\n'
+    buffer = bytearray(chunk_size)
+    with open(infile, 'rb') as file_handle:
+        reader = ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle, read_across_frames=True) if compressed else file_handle
+        while True:
+            n = reader.readinto(buffer)
+            if n == 0:
+                break
+            lines += buffer.count(b'\n', 0, n)
+            last = buffer[n - 1:n]
+    return lines + (last != b'\n')
+
+
+def month_of(dump: str) -> tuple:
+    """The year and month of a dump as strings, e.g. ('2010', '01') for 'RC_2010-01.zst'."""
+    year, month = re.sub(r'\.\w+$', '', dump).split('_')[1].split('-')
+    return year, month
+
+
+def read_counts(path: str) -> dict:
+    """Read a counts file into a dict of (year, month) to count, skipping rows that are not counts (e.g. a header)."""
+    counts = {}
+    if os.path.isfile(path):
+        with open(path, 'r') as infile:
+            for row in csv.reader(infile, delimiter='\t'):
+                if len(row) >= 3 and row[2].strip().isdigit():
+                    counts[(row[0].strip(), row[1].strip())] = int(row[2])
+    return counts
+
+
+def count_task(infile: str) -> tuple:
+    """Count the lines of a single dump (used as pool task)."""
+    lines = count_lines(infile)
+    logging.info(f"{os.path.basename(infile)} has {lines:,} lines.")
+    return os.path.basename(infile), dict(file_identity(infile), lines=lines)
+
+
+def update_counts(input_dir: str, workers: int = 1, force: bool = False) -> dict:
+    """
+    Count the lines of the dumps in a directory that are not in the cache yet or have changed since, and rewrite its counts file.
+    Rows of the counts file for months without a dump are kept. Returns the counts.
+    Raises a ValueError if there are dumps of comments and of submissions, or different dumps, of the same month.
+    """
+    cache_path = os.path.join(input_dir, COUNTS_CACHE)
+    cache = {}
+    if os.path.isfile(cache_path) and not force:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+
+    dumps = sorted(name for name in os.listdir(input_dir) if (name.startswith("RC") or name.startswith("RS")) and os.path.isfile(os.path.join(input_dir, name)))
+    cache = {dump: entry for dump, entry in cache.items() if dump in dumps}
+    tasks = []
+    for dump in dumps:
+        infile = os.path.join(input_dir, dump)
+        entry = cache.get(dump)
+        if entry is not None and {k: entry.get(k) for k in ('size', 'mtime')} == file_identity(infile):
+            continue
+        tasks.append(infile)
+    logging.info(f"Counting the lines of {len(tasks)} of {len(dumps)} dumps.")
+
+    if workers > 1 and len(tasks) > 1:
+        with Pool(min(workers, len(tasks))) as pool:
+            cache.update(pool.imap_unordered(count_task, tasks))
+    else:
+        cache.update(map(count_task, tasks))
+
+    with open(cache_path + '.tmp', 'w') as f:
+        json.dump(cache, f)
+    os.replace(cache_path + '.tmp', cache_path)
+
+    counts_path = os.path.join(input_dir, COUNTS_FILE)
+    counts = read_counts(counts_path)
+    counted = {} # (year, month): (dump, count)
+    for dump in dumps:
+        month = month_of(dump)
+        if month in counted:
+            other, lines = counted[month]
+            # the counts file only has one count per month, which sampling would use for the dumps of either kind
+            if other[:2] != dump[:2] or lines != cache[dump]['lines']:
+                raise ValueError(f"{other} and {dump} are both dumps of {'-'.join(month)}, but the counts file can only hold one count per month. "
+                                 "Keep the comments and the submissions in separate directories.")
+        counted[month] = (dump, cache[dump]['lines'])
+    counts.update((month, lines) for month, (_, lines) in counted.items())
+
+    with open(counts_path + '.tmp', 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+        for (year, month), count in sorted(counts.items()):
+            writer.writerow([year, month, count])
+    os.replace(counts_path + '.tmp', counts_path)
+    logging.info(f"Wrote the counts of {len(counts)} months to {counts_path}.")
+    return counts
+
+
+def define_parser() -> argparse.ArgumentParser:
+    """Define console argument parser for the counts command."""
+    parser = argparse.ArgumentParser(prog="otacon counts", description="Count the entries of the Pushshift data dumps for sampling")
+    parser.add_argument('--input', '-I', type=dir_path, required=True,
+                        help=f"The directory containing the Pushshift data dumps. The counts are written to the file {COUNTS_FILE} in it.")
+    parser.add_argument('--workers', '-W', type=int, default=os.cpu_count(), required=False,
+                        help="Number of dumps counted at the same time. Defaults to the number of CPUs.")
+    parser.add_argument('--force', action='store_true', required=False,
+                        help="Count all dumps again, even those whose counts are already known.")
+    return parser
+
+
+def main(argv=None):
+    args = define_parser().parse_args(argv)
+    update_counts(args.input, args.workers, args.force)
+
+
+if __name__ == "__main__":
+    main()
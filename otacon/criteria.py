@@ -0,0 +1,86 @@
+'''
+criteria: The search criteria of a search compiled into a chain of checks (see compile_criteria() in main), which matches_criteria() runs on every
+decoded entry. The chain holds only the criteria that apply, each with the values it needs bound in advance, and keeps reordering them
+by what they cost and how many entries they reject, so that the cheap and selective ones run first. Each check only depends on the entry,
+so the order never changes which entries match.
+'''
+
+import time
+
+# every SAMPLE_EVERY-th entry goes through all checks, timed, to estimate the cost and the rejection rate of each of them
+SAMPLE_EVERY = 128
+# the checks are reordered after this many sampled entries, and the older samples count for half from then on
+REORDER_EVERY = 32
+
+
+class CriteriaChain:
+    """
+    A conjunction of checks, given as (name, check) pairs. Called on an entry, it returns False as soon as one of the checks rejects it.
+    The last check, if given, always runs last and is also passed whether to POS tag the entry (see spacy_matches() in main).
+    """
+
+    def __init__(self, checks: list, last: tuple = None):
+        self.checks = list(checks)
+        self.last = last
+        self.order = [check for _, check in self.checks]
+        self.ranks = list(range(len(self.checks))) # the index of each check in self.checks, in the order they run
+        self.calls = 0
+        self.samples = 0
+        self.rejected = [0] * len(self.checks)
+        self.seconds = [0.0] * len(self.checks)
+
+    def __bool__(self):
+        return bool(self.checks or self.last)
+
+    def __call__(self, entry: dict, tag: bool = True) -> bool:
+        self.calls += 1
+        if self.calls % SAMPLE_EVERY == 0 and len(self.checks) > 1:
+            if not self.sample(entry):
+                return False
+        else:
+            for check in self.order:
+                if not check(entry):
+                    return False
+        return self.last is None or self.last[1](entry, tag)
+
+    def sample(self, entry: dict) -> bool:
+        """
+        Run all checks on an entry and count their rejections and time. The result is that of running them in order:
+        the checks after the first rejection only run for the counts, so their errors are ignored, as they would never have run.
+        """
+        passed = True
+        for i in self.ranks:
+            start = time.perf_counter()
+            try:
+                accepted = self.checks[i][1](entry)
+            except Exception:
+                if passed:
+                    raise
+                accepted = False
+            self.seconds[i] += time.perf_counter() - start
+            if not accepted:
+                self.rejected[i] += 1
+                passed = False
+        self.samples += 1
+        if self.samples % REORDER_EVERY == 0:
+            self.reorder()
+        return passed
+
+    def reorder(self):
+        """Order the checks by their seconds per rejected entry, ascending. Checks that rejected nothing run last, in their original order."""
+        self.ranks.sort(key=lambda i: (self.rejected[i] == 0, self.seconds[i] / self.rejected[i] if self.rejected[i] else 0, i))
+        self.order = [self.checks[i][1] for i in self.ranks]
+        # later samples weigh more, so the order follows changes in the data, e.g. from month to month
+        self.rejected = [rejected / 2 for rejected in self.rejected]
+        self.seconds = [seconds / 2 for seconds in self.seconds]
+
+    def names(self) -> list:
+        """The names of the checks in the order they currently run."""
+        return [self.checks[i][0] for i in self.ranks] + ([self.last[0]] if self.last else [])
+
+    def wrap(self, wrapper):
+        """Replace each check with wrapper(name, check), e.g. to time it (see profiling)."""
+        self.checks = [(name, wrapper(name, check)) for name, check in self.checks]
+        self.order = [self.checks[i][1] for i in self.ranks]
+        if self.last is not None:
+            self.last = (self.last[0], wrapper(*self.last))
@@ -0,0 +1,234 @@
+'''
+dedupe: Memory-bounded duplicate detection for comments and posts, keyed on their Reddit ID.
+Reddit IDs are base-36 numbers, so each one is stored as a single 64-bit integer instead of a string or hash digest.
+'''
+
+import os
+import mmap
+import hashlib
+from math import log
+import tempfile
+from array import array
+
+import logging
+logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+
+
+# odd 64-bit constants for multiplicative hashing (Fibonacci hashing)
+MULTIPLIER = 0x9E3779B97F4A7C15
+SECOND_MULTIPLIER = 0xC2B2AE3D27D4EB4F
+MASK = 2**64 - 1
+LN2 = log(2)
+
+# tables are resized when they are fuller than this
+MAX_LOAD = 0.66
+INITIAL_SIZE = 2**16
+
+
+def reddit_id_key(reddit_id: str) -> int:
+    """Turn a Reddit ID (base-36, optionally with a type prefix like t1_) into a 64-bit integer key."""
+    reddit_id = reddit_id.split('_')[-1]
+    try:
+        key = int(reddit_id, 36)
+    except ValueError:
+        key = None
+    if key is None or key >= MASK:
+        # not a valid base-36 ID, which should not occur in the dumps
+        key = int.from_bytes(hashlib.md5(reddit_id.encode()).digest()[:8], 'little') % MASK
+    return key + 1 # 0 marks empty slots
+
+
+def slot(key: int, bits: int) -> int:
+    """The preferred slot of a key in a table of 2**bits slots."""
+    return ((key * MULTIPLIER) & MASK) >> (64 - bits)
+
+
+class IdSet:
+    """
+    An exact set of integer keys in open-addressing tables of 8 bytes per slot.
+    Once the table in memory would grow beyond the memory budget, it is written to a temporary file and memory-mapped,
+    and a new table is started, so memory use stays bounded no matter how many keys are added.
+    """
+
+    def __init__(self, memory_budget: int = None, spill_dir: str = None):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.bits = INITIAL_SIZE.bit_length() - 1
+        self.table = array('Q', bytes(8 * INITIAL_SIZE))
+        self.count = 0
+        self.spilled = [] # (bits, memoryview of the table, mmap, file, number of keys) per table on disk
+
+    def __len__(self):
+        return self.count + sum(count for _, _, _, _, count in self.spilled)
+
+    def __contains__(self, key: int) -> bool:
+        if self.find(self.table, self.bits, key):
+            return True
+        for bits, view, _, _, _ in self.spilled:
+            if self.find(view, bits, key):
+                return True
+        return False
+
+    @staticmethod
+    def find(table, bits: int, key: int) -> bool:
+        """Probe a table for a key."""
+        mask = (1 << bits) - 1
+        i = slot(key, bits)
+        while True:
+            value = table[i]
+            if value == key:
+                return True
+            if value == 0:
+                return False
+            i = (i + 1) & mask
+
+    @staticmethod
+    def insert(table, bits: int, key: int) -> bool:
+        """Insert a key into a table, returning False if it was already present."""
+        mask = (1 << bits) - 1
+        i = slot(key, bits)
+        while True:
+            value = table[i]
+            if value == key:
+                return False
+            if value == 0:
+                table[i] = key
+                return True
+            i = (i + 1) & mask
+
+    def add(self, key: int):
+        if self.insert(self.table, self.bits, key):
+            self.count += 1
+            if self.count > MAX_LOAD * len(self.table):
+                self.grow()
+
+    def grow(self):
+        """Double the table in memory, or move it to disk if the doubled table would exceed the memory budget."""
+        if self.memory_budget is not None and 16 * len(self.table) > self.memory_budget:
+            self.spill()
+            return
+        old = self.table
+        self.bits += 1
+        self.table = array('Q', bytes(8 * (1 << self.bits)))
+        for key in old:
+            if key:
+                self.insert(self.table, self.bits, key)
+
+    def spill(self):
+        """Write the table in memory to a temporary file, keep it memory-mapped for lookups and start a new table."""
+        file = tempfile.TemporaryFile(dir=self.spill_dir)
+        self.table.tofile(file)
+        file.flush()
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.spilled.append((self.bits, memoryview(mapped).cast('Q'), mapped, file, self.count))
+        logging.info(f"Moved {self.count:,} IDs of the duplicate check to disk ({len(self.spilled)} table(s) on disk).")
+        self.bits = INITIAL_SIZE.bit_length() - 1
+        self.table = array('Q', bytes(8 * INITIAL_SIZE))
+        self.count = 0
+
+    def save(self, directory: str, generation: int) -> dict:
+        """
+        Write the set to a directory, e.g. for a checkpoint, returning the metadata needed to load it again.
+        Tables on disk never change, so each is only written once. The table in memory is written as the given generation.
+        """
+        for i, (_, view, _, _, _) in enumerate(self.spilled):
+            path = os.path.join(directory, f'ids-spilled-{i}.bin')
+            if not os.path.isfile(path):
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(view)
+                os.replace(path + '.tmp', path)
+        with open(os.path.join(directory, f'ids-{generation}.bin'), 'wb') as f:
+            self.table.tofile(f)
+        return {'type': 'exact', 'bits': self.bits, 'count': self.count, 'spilled': [[bits, count] for bits, _, _, _, count in self.spilled]}
+
+    @classmethod
+    def load(cls, directory: str, generation: int, meta: dict, memory_budget: int = None, spill_dir: str = None):
+        """Load a set written by save(). Tables that were on disk are memory-mapped from the directory again."""
+        ids = cls(memory_budget, spill_dir)
+        for i, (bits, count) in enumerate(meta['spilled']):
+            file = open(os.path.join(directory, f'ids-spilled-{i}.bin'), 'rb')
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            ids.spilled.append((bits, memoryview(mapped).cast('Q'), mapped, file, count))
+        ids.bits, ids.count = meta['bits'], meta['count']
+        ids.table = array('Q')
+        with open(os.path.join(directory, f'ids-{generation}.bin'), 'rb') as f:
+            ids.table.fromfile(f, 1 << ids.bits)
+        return ids
+
+    def clear(self):
+        for _, view, mapped, file, _ in self.spilled:
+            view.release()
+            mapped.close()
+            file.close()
+        self.__init__(self.memory_budget, self.spill_dir)
+
+
+class BloomFilter:
+    """
+    A probabilistic set of integer keys with a fixed size determined by the expected number of keys and the accepted false-positive rate.
+    Membership tests never miss an added key but may wrongly report a key that was never added, at about the given rate.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # optimal number of bits and hash functions
+        self.size = max(8, int(-capacity * log(error_rate) / (LN2 ** 2)))
+        self.hashes = max(1, round(self.size / capacity * LN2))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def positions(self, key: int):
+        """The bit positions of a key, from two independent hashes (double hashing)."""
+        h1 = (key * MULTIPLIER) & MASK
+        h2 = ((key * SECOND_MULTIPLIER) & MASK) | 1
+        for i in range(self.hashes):
+            yield ((h1 + i * h2) & MASK) % self.size
+
+    def __contains__(self, key: int) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self.positions(key))
+
+    def add(self, key: int):
+        bits = self.bits
+        for pos in self.positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+        if self.count == self.capacity + 1:
+            logging.warning(f"The duplicate check holds more than the expected {self.capacity:,} IDs, so its false-positive rate rises above {self.error_rate}.")
+
+    def save(self, directory: str, generation: int) -> dict:
+        """Write the filter to a directory as the given generation, returning the metadata needed to load it again."""
+        with open(os.path.join(directory, f'bloom-{generation}.bin'), 'wb') as f:
+            f.write(self.bits)
+        return {'type': 'bloom', 'capacity': self.capacity, 'error_rate': self.error_rate, 'count': self.count}
+
+    @classmethod
+    def load(cls, directory: str, generation: int, meta: dict):
+        """Load a filter written by save()."""
+        bloom = cls(meta['capacity'], meta['error_rate'])
+        with open(os.path.join(directory, f'bloom-{generation}.bin'), 'rb') as f:
+            bloom.bits = bytearray(f.read())
+        bloom.count = meta['count']
+        return bloom
+
+    def clear(self):
+        self.__init__(self.capacity, self.error_rate)
+
+
+def make_dedupe(args):
+    """Build the duplicate check chosen by the arguments."""
+    if args.dedupe == 'bloom':
+        logging.info(f"Checking for duplicates with a Bloom filter for {args.bloom_capacity:,} IDs at a false-positive rate of {args.bloom_error_rate}.")
+        return BloomFilter(args.bloom_capacity, args.bloom_error_rate)
+    return IdSet(memory_budget=args.dedupe_memory * 2**20, spill_dir=args.output)
+
+
+def load_dedupe(directory: str, generation: int, meta: dict, args):
+    """Load a duplicate check written with its save() method, e.g. from a checkpoint."""
+    if meta['type'] == 'bloom':
+        return BloomFilter.load(directory, generation, meta)
+    return IdSet.load(directory, generation, meta, memory_budget=args.dedupe_memory * 2**20, spill_dir=args.output)
@@ -4,60 +4,209 @@ Warning: This assumes that all files in a given directory belong to the same dat
 '''
 
 
+import io
 import os
 import re
 import csv
-from subprocess import call
+import shutil
+from multiprocessing import Pool
+from zstandard import ZstdCompressor
+
+from otacon.writers import format_of, open_writer, close_writer, read_rows, open_text, parquet_schema, pa, COMPRESSION_LEVEL
+if pa is not None:
+    import pyarrow.parquet as pq
+
+
+# the number of characters of an output file that are read at once when consolidating, and the bytes that are copied at once
+BLOCK_SIZE = 2**22
+COPY_BUFFER_SIZE = 2**22
 
 
 def extract_time_info(filename):
     '''Reads the year and month info from each filename.'''
-    year = re.search('\d{4}', filename).group()
-    month = re.search('\-(\d{2})', filename).group(1)
+    year = re.search(r'\d{4}', filename).group()
+    month = re.search(r'-(\d{2})', filename).group(1)
     return year, month
 
 
 def gather_output_files(directory):
     '''Returns list of files that are assumed to belong to the output.'''
-    return [elem for elem in os.listdir(directory) if elem.endswith(".csv") or elem.endswith(".jsonl") and not elem.startswith(".") and re.search('\d{4}\-\d{2}', elem)]
+    return [elem for elem in os.listdir(directory) if format_of(elem) is not None and not elem.startswith(".") and re.search(r'\d{4}-\d{2}', elem)]
+
+
+def consolidated_headers(header: list) -> tuple:
+    """
+    The columns of the consolidated file, given those of the first output file, and whether the type, year and month have to be added to each row,
+    which is not the case for the files written by otacon, whose rows begin with them. Results and filtered-out hits go to the same file, so it has a filter reason.
+    """
+    add_metadata = header[:3] != ['type', 'year', 'month']
+    return (['type', 'year', 'month'] if add_metadata else []) + header + (['filter reason'] if header[-1] != 'filter reason' else []), add_metadata
+
+
+def first_header(path: str, output_format: str) -> list:
+    """
+    The header of an output file (the column names of a Parquet file), or None for JSON lines that are consolidated into JSON lines.
+    The keys of the first entry are the header of JSON lines that are converted into another format.
+    """
+    if format_of(path).startswith('jsonl'):
+        if output_format.startswith('jsonl'):
+            return None
+        return list(next(read_rows(path), {}).keys())
+    return next(read_rows(path))
+
+
+def record_blocks(infile, block_size: int = BLOCK_SIZE):
+    """
+    Read CSV text in blocks of about block_size characters that end with a complete record, without parsing it:
+    a line break ends a record if it follows an even number of quote characters, since quotes inside quoted fields are doubled.
+    """
+    rest = ''
+    while True:
+        block = infile.read(block_size)
+        if not block:
+            break
+        block = rest + block
+        quotes = block.count('"')
+        end = block.rfind('\n')
+        while end != -1 and (quotes - block.count('"', end)) % 2:
+            end = block.rfind('\n', 0, end)
+        block, rest = block[:end + 1], block[end + 1:]
+        if block:
+            yield block
+    if rest:
+        yield rest
+
+
+def prefix_records(block: str, prefix: str) -> str:
+    """Put a prefix in front of each record of a block of CSV text from record_blocks()."""
+    if '"' not in block: # every line is a record
+        prefixed = prefix + block.replace('\n', '\n' + prefix)
+        return prefixed[:-len(prefix)] if block.endswith('\n') else prefixed
+    lines = block.split('\n')
+    last = lines.pop()
+    records, inside = [], False
+    for line in lines + ([last] if last else []):
+        records.append(line if inside else prefix + line)
+        inside ^= line.count('"') % 2 == 1
+    return '\n'.join(records) + ('\n' if not last else '')
+
+
+def text_part(task: tuple) -> str:
+    """
+    Turn an output file with CSV or JSON lines into the part of the consolidated file that it makes up (used as pool task):
+    without its header, with the type, year and month in front of each row if they have to be added, and compressed like the consolidated file.
+    Returns the path of the part, which is the file itself if nothing has to be changed.
+    """
+    path, part, prefix, skip_header, compress = task
+    if not skip_header and prefix is None and path.endswith('.zst') == compress:
+        return path
+    with open_text(path) as infile:
+        if skip_header:
+            infile.readline()
+        with open(part, 'wb') as f:
+            stream = ZstdCompressor(level=COMPRESSION_LEVEL).stream_writer(f, closefd=False) if compress else f
+            with io.TextIOWrapper(stream, encoding='utf-8', newline='') as outfile:
+                for block in record_blocks(infile):
+                    _=outfile.write(prefix_records(block, prefix) if prefix is not None else block)
+    return part
 
 
-def cleanup(directory, extraction_name):
-    """Consolidates CSV/JSONL files from directory into a single output file."""
+def parquet_part(task: tuple) -> str:
+    """Like text_part(), for a Parquet file: the columns of the type, year and month and the filter reason are added to each batch of rows as needed."""
+    path, part, metadata, schema = task
+    with pq.ParquetWriter(part, schema, compression='zstd') as writer:
+        for batch in pq.ParquetFile(path).iter_batches():
+            columns = batch.columns
+            if metadata is not None:
+                columns = [pa.repeat(value, batch.num_rows) for value in metadata] + columns
+            columns += [pa.nulls(batch.num_rows)] * (len(schema) - len(columns))
+            writer.write_table(pa.Table.from_arrays(columns, names=schema.names).cast(schema))
+    return part
+
+
+def cleanup(directory, extraction_name, workers: int = 1):
+    """
+    Consolidates the output files from directory into a single output file, whose format is given by its name (see writers).
+    The files are turned into the parts of the consolidated file in a pool of workers, and the parts are appended to it in order.
+    Files with rows as text are streamed in blocks if the consolidated file holds the same kind of text, only adding the type, year and month
+    to each row if needed, and Parquet files are copied batch by batch into a consolidated Parquet file. Other combinations are converted row by row.
+    """
     directory = os.path.abspath(directory)
-    f_list = gather_output_files(directory)
-    os.chdir(directory)
-    
     output_path = os.path.join(directory, extraction_name)
-    
-    # Handle JSONL files: concatenate directly
-    if f_list[0].endswith(".jsonl"):
-        call(f'cat {" ".join(f_list)} > {output_path}', shell=True)
-        for elem in f_list:
-            os.remove(elem)
+    f_list = sorted(os.path.join(directory, elem) for elem in gather_output_files(directory) if elem != extraction_name)
+    if not f_list:
         return
-    
-    # Handle CSV files: merge with metadata
-    with open(output_path, "w", encoding="utf-8") as outfile:
-        csvwriter = csv.writer(outfile, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        csvwriter.writerow(['type', 'year', 'month', 'id', 'text', 'span', 'subreddit', 'score', 'user', 'flairtext', 'date', 'permalink', 'filter reason'])
-        
-        for file in f_list:
-            # Determine type from filename prefix
-            data_type = "comment" if file.startswith("comment") else "submission"
-            year, month = extract_time_info(file)
-            
-            # Read and merge each file, skipping header and empty rows
-            with open(file, "r", encoding="utf-8") as infile:
-                csvreader = csv.reader(infile, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL)
-                next(csvreader)  # Skip header
-                for row in csvreader:
-                    if row[0] != 'text':
-                        csvwriter.writerow([data_type, year, month] + row)
-            
-            os.remove(file)
-    
-    
+
+    input_format, output_format = format_of(f_list[0]), format_of(output_path)
+    header = first_header(f_list[0], output_format)
+    headers, add_metadata = consolidated_headers(header) if header is not None else (None, False)
+    metadata = []
+    for file in f_list:
+        # Determine type from filename prefix
+        data_type = "comment" if os.path.basename(file).startswith("comment") else "submission"
+        metadata.append((data_type,) + extract_time_info(os.path.basename(file)) if add_metadata else None)
+    parts = [os.path.join(directory, f".otacon_cleanup_{i}_{os.getpid()}.part") for i in range(len(f_list))]
+
+    if input_format.split('.')[0] == output_format.split('.')[0] != 'parquet':
+        tasks = [(file, part, ';'.join(values) + ';' if values is not None else None, header is not None, output_format.endswith('.zst'))
+                 for file, part, values in zip(f_list, parts, metadata)]
+        consolidate_text(output_path, headers, tasks, workers)
+    elif input_format == output_format == 'parquet':
+        schema = parquet_schema(headers)
+        tasks = [(file, part, values, schema) for file, part, values in zip(f_list, parts, metadata)]
+        consolidate_parquet(output_path, schema, tasks, workers)
+    else:
+        consolidate_rows(output_path, headers, add_metadata, f_list, metadata)
+
+    for file in f_list:
+        os.remove(file)
+
+
+def consolidate_text(output_path: str, headers: list, tasks: list, workers: int):
+    """Write the header of the consolidated file, then append the parts as they are done, as bytes."""
+    with open(output_path, 'wb') as outfile:
+        if headers is not None:
+            header_writer = io.StringIO()
+            csv.writer(header_writer, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL).writerow(headers)
+            header = header_writer.getvalue().encode('utf-8')
+            _=outfile.write(ZstdCompressor(level=COMPRESSION_LEVEL).compress(header) if output_path.endswith('.zst') else header)
+        for task, part in zip(tasks, parts_in_order(text_part, tasks, workers)):
+            with open(part, 'rb') as infile:
+                shutil.copyfileobj(infile, outfile, COPY_BUFFER_SIZE)
+            if part != task[0]: # a part of its own was written
+                os.remove(part)
+
+
+def consolidate_parquet(output_path: str, schema, tasks: list, workers: int):
+    """Copy the row groups of the parts into the consolidated Parquet file as they are done."""
+    with pq.ParquetWriter(output_path, schema, compression='zstd') as writer:
+        for part in parts_in_order(parquet_part, tasks, workers):
+            for batch in pq.ParquetFile(part).iter_batches():
+                writer.write_batch(batch)
+            os.remove(part)
+
+
+def consolidate_rows(output_path: str, headers: list, add_metadata: bool, f_list: list, metadata: list):
+    """Convert the rows of the files one by one into the format of the consolidated file, e.g. from CSV into Parquet."""
+    outfile = open_writer(output_path, headers)
+    for file, values in zip(f_list, metadata):
+        rows = read_rows(file)
+        if not format_of(file).startswith('jsonl'):
+            next(rows)  # Skip header
+        for row in rows:
+            row = list(row.values()) if isinstance(row, dict) else row
+            row = list(values) + row if add_metadata else row
+            outfile.writerow(row + [None] * (len(headers) - len(row)))  # rows of results files have no filter reason
+    close_writer(output_path)
+
+
+def parts_in_order(part_task, tasks: list, workers: int):
+    """Yield the parts made by part_task() from the tasks in order, while the following ones are made by a pool of workers."""
+    if workers > 1 and len(tasks) > 1:
+        with Pool(min(workers, len(tasks))) as pool:
+            yield from pool.imap(part_task, tasks)
+    else:
+        yield from map(part_task, tasks)
 
 
 def main():
@@ -0,0 +1,250 @@
+'''
+indexing: Sidecar indexes that map the subreddits and authors of a monthly dump to the byte offsets of their records.
+With an index, a search for a few subreddits or users only reads their records instead of decoding the whole month.
+
+Usage: python otacon/main.py index --input <directory with the dumps> [--index_dir <directory>] [--workers N]
+'''
+
+import os
+import json
+import mmap
+import struct
+import argparse
+from array import array
+from multiprocessing import Pool
+from zstandard import ZstdCompressor, ZstdDecompressor
+
+from otacon.data_types import dir_path
+from otacon.pushshift_handling import read_lines_with_offsets, parse_line, available_json_backends
+
+import logging
+logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+
+
+INDEX_VERSION = 2
+INDEX_MAGIC = b'OTACON-INDEX\n'
+INDEXED_FIELDS = ('author', 'subreddit')
+INDEX_DIRNAME = 'otacon_index'
+
+# postings lists with fewer offsets are stored uncompressed
+MIN_COMPRESSED_POSTINGS = 64
+
+# a record of a key table: position and length of the key in the section's keys, and position, length, number of offsets
+# and compression of its postings list
+KEY_RECORD = struct.Struct('<QIQQQB')
+
+
+def default_index_dir(input_dir: str) -> str:
+    """The index directory that is used if none is given: a subdirectory of the input directory."""
+    return os.path.join(input_dir, INDEX_DIRNAME)
+
+
+def index_path(index_dir: str, month: str) -> str:
+    """The path of a month's index file."""
+    return os.path.join(index_dir, month + '.idx')
+
+
+def file_identity(file: str) -> dict:
+    """Size and modification time of a dump, to recognize indexes that were built from a different version of it."""
+    stat = os.stat(file)
+    return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def build_index(infile: str, outfile: str, backend: str = 'json'):
+    """
+    Scan a dump once and write its index. After a line identifying the format, the index consists of
+    a JSON line with metadata on the dump and the position of each field's section, one section per field,
+    and the postings lists, i.e. the byte offsets of their records as delta-encoded 64-bit integers.
+    A section holds a table of fixed-size records (see KEY_RECORD) of the field's values, sorted by their lower-cased value,
+    followed by the values themselves, so a lookup finds a value by binary search without reading the other values.
+    """
+    postings = {field: {} for field in INDEXED_FIELDS}
+    lines = 0
+    for line, offset in read_lines_with_offsets(infile):
+        entry = parse_line(line, infile, INDEXED_FIELDS, backend)
+        lines += 1
+        if entry is None:
+            continue
+        for field in INDEXED_FIELDS:
+            value = entry.get(field)
+            if isinstance(value, str):
+                postings[field].setdefault(value, array('Q')).append(offset)
+
+    compressor = ZstdCompressor(level=3)
+    sections, blobs = [], []
+    position = 0
+    for field in INDEXED_FIELDS:
+        table, names = bytearray(), bytearray()
+        for key in sorted(postings[field], key=lambda key: (key.lower(), key)):
+            offsets = postings[field][key]
+            deltas = array('Q', [offsets[0]] + [b - a for a, b in zip(offsets, offsets[1:])])
+            blob = deltas.tobytes()
+            compressed = len(offsets) >= MIN_COMPRESSED_POSTINGS
+            if compressed:
+                blob = compressor.compress(blob)
+            name = key.encode('utf-8', 'surrogatepass')
+            table += KEY_RECORD.pack(len(names), len(name), position, len(blob), len(offsets), compressed)
+            names += name
+            blobs.append(blob)
+            position += len(blob)
+        sections.append((field, table, names))
+
+    # the sections and postings lists follow the metadata line, their positions are relative to its end
+    layout, position = {}, 0
+    for field, table, names in sections:
+        layout[field] = {'table': position, 'keys': len(table) // KEY_RECORD.size, 'names': position + len(table)}
+        position += len(table) + len(names)
+    meta = {'version': INDEX_VERSION, 'file': os.path.basename(infile), **file_identity(infile), 'lines': lines, 'sections': layout, 'postings': position}
+    tmpfile = outfile + '.tmp'
+    with open(tmpfile, 'wb') as f:
+        f.write(INDEX_MAGIC)
+        f.write(json.dumps(meta).encode() + b'\n')
+        for _, table, names in sections:
+            f.write(table)
+            f.write(names)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmpfile, outfile) # an index is only ever complete or absent
+    logging.info(f"Indexed {lines:,} lines of {os.path.basename(infile)}: {layout['subreddit']['keys']:,} subreddits, {layout['author']['keys']:,} authors.")
+
+
+def read_meta(f, infile: str) -> dict:
+    """Read the metadata of an open index file. Returns None if the index is invalid or was not built from the current version of the dump."""
+    if f.readline() != INDEX_MAGIC:
+        return None
+    meta = json.loads(f.readline())
+    if meta.get('version') != INDEX_VERSION or {k: meta.get(k) for k in ('size', 'mtime')} != file_identity(infile):
+        return None
+    return meta
+
+
+def index_is_current(index_dir: str, infile: str) -> bool:
+    """Test if there is an up-to-date index for a dump."""
+    path = index_path(index_dir, os.path.basename(infile))
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return read_meta(f, infile) is not None
+
+
+class KeyTable:
+    """The key table of a field's section in a memory-mapped index, where the records of values are found by binary search."""
+
+    def __init__(self, mapped, start: int, section: dict):
+        self.mapped = mapped
+        self.table = start + section['table']
+        self.names = start + section['names']
+        self.keys = section['keys']
+
+    def record(self, i: int) -> tuple:
+        """The value of the i-th key and the position, length, number of offsets and compression of its postings list."""
+        name_position, name_length, *postings = KEY_RECORD.unpack_from(self.mapped, self.table + i * KEY_RECORD.size)
+        name = self.mapped[self.names + name_position:self.names + name_position + name_length].decode('utf-8', 'surrogatepass')
+        return name, postings
+
+    def find(self, name: str, case_sensitive: bool) -> list:
+        """
+        The postings of the keys that are the given value, or, without case sensitivity, whose lower-cased value is the given one
+        (which is expected in lower case).
+        """
+        folded = name.lower() if case_sensitive else name
+        low, high = 0, self.keys
+        while low < high: # the first key whose lower-cased value is not before the searched one
+            middle = (low + high) // 2
+            if self.record(middle)[0].lower() < folded:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        for i in range(low, self.keys):
+            key, postings = self.record(i)
+            if key.lower() != folded:
+                break
+            if not case_sensitive or key == name:
+                found.append((i, postings))
+        return found
+
+
+def lookup_offsets(index_dir: str, infile: str, field: str, names, case_sensitive: bool) -> list:
+    """
+    Return the ascending byte offsets of all records in a dump whose field has one of the given values.
+    Without case sensitivity, names are expected in lower case and matched against the lower-cased values.
+    Only the records of the searched values are read from the index, not the values of the whole field.
+    Returns None if there is no up-to-date index for the dump.
+    """
+    path = index_path(index_dir, os.path.basename(infile))
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        meta = read_meta(f, infile)
+        if meta is None:
+            logging.warning(f"The index {path} is outdated or invalid and will not be used. Rebuild it with the index command.")
+            return None
+        start = f.tell()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            table = KeyTable(mapped, start, meta['sections'][field])
+            matching = dict(found for name in names for found in table.find(name, case_sensitive)) # a key only once, even if several names match it
+
+            offsets = array('Q')
+            postings_start = start + meta['postings']
+            for position, length, count, compressed in matching.values():
+                blob = mapped[postings_start + position:postings_start + position + length]
+                if compressed:
+                    blob = ZstdDecompressor().decompress(blob, max_output_size=8 * count)
+                deltas = array('Q')
+                deltas.frombytes(blob)
+                total = 0
+                for delta in deltas:
+                    total += delta
+                    offsets.append(total)
+    logging.info(f"The index lists {len(offsets):,} of {meta['lines']:,} records for the searched {field}(s).")
+    return sorted(offsets)
+
+
+def index_month(task: tuple):
+    """Build the index of a single dump (used as pool task)."""
+    infile, outfile, backend = task
+    build_index(infile, outfile, backend)
+
+
+def define_parser() -> argparse.ArgumentParser:
+    """Define console argument parser for the index command."""
+    parser = argparse.ArgumentParser(prog="otacon index", description="Build sidecar indexes of subreddits and authors for the Pushshift data dumps")
+    parser.add_argument('--input', '-I', type=dir_path, required=True,
+                        help="The directory containing the Pushshift data dumps.")
+    parser.add_argument('--index_dir', type=str, required=False,
+                        help=f"The directory the indexes are written to. Defaults to a directory '{INDEX_DIRNAME}' inside the input directory.")
+    parser.add_argument('--workers', '-W', type=int, default=1, required=False,
+                        help="Number of dumps indexed at the same time.")
+    parser.add_argument('--force', action='store_true', required=False,
+                        help="Rebuild indexes that are already up to date.")
+    return parser
+
+
+def main(argv=None):
+    args = define_parser().parse_args(argv)
+    index_dir = args.index_dir or default_index_dir(args.input)
+    os.makedirs(index_dir, exist_ok=True)
+    backend = available_json_backends()[0]
+
+    tasks = []
+    for month in sorted(os.listdir(args.input)):
+        if not (month.startswith("RC") or month.startswith("RS")):
+            continue
+        infile, outfile = os.path.join(args.input, month), index_path(index_dir, month)
+        if not args.force and index_is_current(index_dir, infile):
+            logging.info(f"The index of {month} is up to date.")
+            continue
+        tasks.append((infile, outfile, backend))
+
+    if args.workers > 1:
+        with Pool(args.workers) as pool:
+            for _ in pool.imap_unordered(index_month, tasks):
+                pass
+    else:
+        for task in tasks:
+            index_month(task)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,36 +5,74 @@ For Usage and Flags see README doc.
 '''
 
 import os
+import sys
 import re
-import csv
 import json
+import math
 import random
 import datetime
-import hashlib
 import logging
 import calendar
 import argparse
-from typing import TextIO
+import threading
+from multiprocessing import Pool
+from bisect import bisect_left
+from itertools import repeat
+from functools import partial
 
 from otacon.finalize import cleanup, gather_output_files, extract_time_info
 from otacon.argument_handling import define_parser, handle_args
-from otacon.pushshift_handling import read_redditfile
+from otacon.pushshift_handling import read_redditfile, read_lines_with_offsets, read_lines_at, batch_lines, parse_line
 from otacon.prep_input import establish_timeframe
-from otacon.prep_output import assemble_outfile_name, write_csv_headers
-from otacon.sampling import get_samplepoints
+from otacon.prep_output import assemble_outfile_name, write_csv_headers, open_output, output_headers
+from otacon.writers import RowBuffer, close_writer
+from otacon.prefilter import text_prefilter
+from otacon.pos_tagging import PosSearch, load_model
+from otacon.sampling import get_sample, restore_sample, BernoulliSample
+from otacon.dedupe import IdSet, make_dedupe, load_dedupe, reddit_id_key
+from otacon.metrics import Progress, StageClock, METRICS_FILE
+from otacon.profiling import SearchProfile
+from otacon.criteria import CriteriaChain
+from otacon import indexing, convert, columnar, result_cache, checkpoint, counts, synthetic, benchmark
 
 # set seeds for reproducibility
 random.seed(42)
 
-# keep track of already-processed comments throughout function calls
-hash_set = set()
+# keep track of already-processed comments throughout function calls, by their ID (replaced according to the arguments in main())
+seen_ids = IdSet()
 
 # return stats from which subreddits the relevant comments were and how many per subreddits
 stats_dict = {}
 
-# for reservoir sampling
+# the match spans of the most recently searched text: (text, regex, include_quoted, spans)
+last_matches = (None, None, None, None)
+
+# for reservoir sampling: the sampled matches as (month, offset, match index), the number of matches offered so far,
+# and, once the reservoir is full, the number of the match that replaces the next item and the current weight (see add_to_reservoir())
 reservoir = []
 relevant_count = 0
+reservoir_skip = None
+
+# the months finished so far as (month, count), the checkpoints written along the way (see main())
+# and the position within the first month when resuming from a checkpoint
+completed_months = []
+checkpoints = None
+resume_point = None
+
+# with --queries, the search whose state is the module-level state above (see switch_query())
+current_query = None
+
+# the time spent in each stage of the search, and the progress through the timeframe, which is reported regularly (see main())
+clock = StageClock()
+search_progress = None
+# with --profile, the profile of the search (see setup_profile())
+search_profile = None
+# the months in the order they are searched, so the next month's dump can be opened ahead of time (see next_dump())
+search_order = []
+
+# for the intra-file pipeline: number of lines per batch and batches queued per worker
+PIPELINE_BATCH_SIZE = 20000
+PIPELINE_BATCHES_PER_WORKER = 4
 
 
 def find_all_matches(text, regex):
@@ -44,19 +82,57 @@ def find_all_matches(text, regex):
         yield (match.start(), match.end())
 
 
+def quoted_ranges(text: str) -> list:
+    """
+    Find the ranges (first, last) in which the end of a match lies if the match is inside a quoted line.
+    Such lines in Reddit data begin with "&gt;". Only a quote at the very beginning of the text is recognized,
+    as there must be no linebreak between the quote symbol at the text's start and the end of the match.
+    """
+    if not text.startswith('&gt;'):
+        return []
+    linebreak = text.find('\n')
+    if linebreak == -1:
+        return [(5, len(text))]
+    if linebreak == 4: # empty quote
+        return []
+    return [(5, linebreak + 1)]
+
+
 def inside_quote(text: str, span: tuple) -> bool:
     """
     Test if a span-marked match is inside a quoted line.
     Such lines in Reddit data begin with "&gt;".
     """
-    end = span[1]
-    relevant_text = text[:end]
-    return True if re.search('^&gt;[^\n]+$', relevant_text) else False # tests if there is no linebreak between a line-initial quote symbol and the match
+    return any(first <= span[1] <= last for first, last in quoted_ranges(text))
+
 
+def may_match(regex, text: str) -> bool:
+    """Test if a text contains one of the literals that every match of the regex contains (see text_prefilter()), i.e. if the regex has to be run on it."""
+    scan = text_prefilter(regex)
+    return scan is None or scan(text)
 
-def extract(args, comment_or_post: dict, compiled_comment_regex: str, include_quoted: bool, outfile: TextIO, filter_reason: str):
+
+def matching_spans(text: str, regex, include_quoted: bool) -> list:
+    """
+    Return the spans of all regex matches in a text, leaving out those inside quoted lines unless include_quoted.
+    The spans of the most recent text are kept, so that testing for relevance, weighting and extracting a comment
+    or post only searches its text once.
+    """
+    global last_matches
+    cached_text, cached_regex, cached_include_quoted, spans = last_matches
+    if regex is cached_regex and include_quoted == cached_include_quoted and text == cached_text:
+        return spans
+    spans = list(find_all_matches(text, regex)) if may_match(regex, text) else []
+    if not include_quoted and spans:
+        ranges = quoted_ranges(text) # computed once per text instead of once per match
+        spans = [span for span in spans if not any(first <= span[1] <= last for first, last in ranges)]
+    last_matches = (text, regex, include_quoted, spans)
+    return spans
+
+
+def extract(args, comment_or_post: dict, compiled_comment_regex: str, include_quoted: bool, outfile, filter_reason: str):
     '''
-    Extract and write comment or post data to a CSV file with optional regex filtering.
+    Extract and write comment or post data to an output file with optional regex filtering.
     This function processes Reddit comment or post data and writes it to the specified output file.
     It handles three modes of operation:
     1. Return all data: If args.return_all is True, writes the entire JSON object as a single line.
@@ -73,12 +149,12 @@ def extract(args, comment_or_post: dict, compiled_comment_regex: str, include_qu
             - 'entry' (dict): The Reddit comment or post data as a dictionary.
         compiled_comment_regex (str): Compiled regex pattern for matching text. If None, extracts entire text.
         include_quoted (bool): If True, includes matches found inside quoted lines. If False, excludes them.
-        outfile (TextIO): Output file object where CSV data will be written.
+        outfile: Writer of the output file the rows are written to (see writers), or a RowBuffer.
         filter_reason (str): Reason for filtering, included in output.
     Returns:
         None
     Writes:
-        Either a JSON line (if args.return_all) or CSV rows with the following fields:
+        Either the entry as it is (if args.return_all) or rows with the following fields:
         type, year, month, id, text, span, subreddit, score, user, flairtext, date, permalink, filter_reason
     Raises:
         SystemExit: If firstmatch mode is enabled and no non-quoted match is found.
@@ -88,14 +164,12 @@ def extract(args, comment_or_post: dict, compiled_comment_regex: str, include_qu
     comment_or_post = comment_or_post['entry']
 
     if args.return_all:
-        comment_or_post = json.dumps(comment_or_post)
-        _=outfile.write(comment_or_post+'\n')
+        outfile.writerow(comment_or_post)
     
     else:
         type = 'comment' if args.searchmode == 'comms' else 'post'
         time = datetime.datetime.fromtimestamp(int(comment_or_post['created_utc']), tz=datetime.timezone.utc)
         year, month = time.year, time.month
-        month = datetime.datetime.fromtimestamp(int(comment_or_post['created_utc']), tz=datetime.timezone.utc).month
         id = comment_or_post['id']
         text = comment_or_post['body'] if args.searchmode == 'comms' else comment_or_post['selftext']
         user = comment_or_post['author']
@@ -112,35 +186,36 @@ def extract(args, comment_or_post: dict, compiled_comment_regex: str, include_qu
         # choose the newer "permalink" metadata instead if available
         permalink = f"https://www.reddit.com{comment_or_post['permalink']}"  if 'permalink' in comment_or_post.keys() else oldschool_link
 
-        csvwriter = csv.writer(outfile, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL)
-
         if compiled_comment_regex is None:
             row = [type, year, month, id, text, subreddit, score, user, flairtext, date, permalink, filter_reason]
-            csvwriter.writerow(row)
+            outfile.writerow(row)
         elif args.firstmatch:
             # find first match that is not quoted if not include_quoted
-            matches = list(find_all_matches(text, compiled_comment_regex))
-            matches = [span for span in matches if not inside_quote(text, span)] if not include_quoted else matches
+            matches = matching_spans(text, compiled_comment_regex, include_quoted)
             span = matches[0] if matches else None
             matched = text[span[0]:span[1]] if span else None
             
             row = [type, year, month, id, text, span, matched, subreddit, score, user, flairtext, date, permalink, filter_reason]
-            csvwriter.writerow(row)
+            outfile.writerow(row)
 
         else:
-            matches = list(find_all_matches(text, compiled_comment_regex))
-            if not include_quoted:
-                matches = [span for span in matches if not inside_quote(text, span)]
+            matches = matching_spans(text, compiled_comment_regex, include_quoted)
             
             if index < len(matches):
                 span = matches[index]
                 matched = text[span[0]:span[1]]
                 row = [type, year, month, id, text, span, matched, subreddit, score, user, flairtext, date, permalink, filter_reason]
-                csvwriter.writerow(row)
+                outfile.writerow(row)
             else:
                 logging.warning(f"Index {index} out of range for {len(matches)} matches")
 
 
+# texts like "I am a bot" in lower case, which are sent to manual review (see filter()), and the word they contain in any case,
+# which no non-ASCII character matches, so only the texts that have it need to be lower-cased
+BOT_PATTERN = re.compile(r"i( a)?[\'m]*\s*a\s*bot")
+BOT_WORD = re.compile('bot', re.IGNORECASE)
+
+
 def filter(comment_or_post: dict, popularity_threshold: int) -> tuple:
     """
     Test if a Reddit comment or post breaks any of the filtering rules.
@@ -154,13 +229,13 @@ def filter(comment_or_post: dict, popularity_threshold: int) -> tuple:
         return True, "AutoModerator"
 
     text = comment_or_post['body'] if 'body' in comment_or_post else comment_or_post['selftext']
-    if re.search(r"i( a)?[\'m]*\s*a\s*bot", text.lower()):
+    if BOT_WORD.search(text) and BOT_PATTERN.search(text.lower()):
         return True, "non-human generated"
     
     return False, None
 
 
-def filter_then_extract(comment_or_post: dict, compiled_comment_regex, args, include_quoted: bool, outfile: TextIO, reviewfile: TextIO):
+def filter_then_extract(comment_or_post: dict, compiled_comment_regex, args, include_quoted: bool, outfile, reviewfile):
     """First filter a comment or post, then extract it to the appropriate file."""
     filtered, reason = filter(comment_or_post['entry'], args.popularity) if args.dont_filter is None else False, None # apply filtering unless --dont_filter is set
     if not filtered:
@@ -169,6 +244,11 @@ def filter_then_extract(comment_or_post: dict, compiled_comment_regex, args, inc
         extract(args, comment_or_post, compiled_comment_regex, include_quoted, reviewfile, filter_reason=reason)
 
 
+def entry_key(comment_or_post: dict) -> int:
+    """Return the key of a comment or post for duplicate detection, i.e. its Reddit ID as integer."""
+    return reddit_id_key(comment_or_post['id'])
+
+
 def relevant(comment_or_post: dict, args: argparse.Namespace) -> bool:
     '''
     Test if a Reddit comment or post is relevant to the search criteria.
@@ -191,74 +271,123 @@ def relevant(comment_or_post: dict, args: argparse.Namespace) -> bool:
             - flairregex (re.Pattern or None): Regex pattern for author flair
             - userregex (re.Pattern or None): Regex pattern for author username
             - spacy_search (tuple or None): Tuple of (token, POS_tag) for NLP-based search
-            - nlp (spacy.Language): Spacy language model for NLP processing
+            - pos_search (PosSearch): Tags the texts for the NLP-based search
             - no_stats (bool): If False, updates statistics dictionary
     Returns:
         bool: True if the comment/post passes all relevance filters and is not a duplicate,
               False otherwise.
     Side Effects:
-        - Adds MD5 hash of the comment/post to a module-level hash_set to prevent duplicates
+        - Adds the ID of the comment/post to the module-level seen_ids to prevent duplicates
         - Updates module-level stats_dict with subreddit counts if no_stats is False
     Note:
-        Requires module-level variables: hash_set (set), stats_dict (dict)
-        Requires helper functions: find_all_matches(), inside_quote()
+        Requires module-level variables: seen_ids (IdSet or BloomFilter), stats_dict (dict)
+        Requires helper functions: matching_spans()
     '''
 
-    if args.name is not None: # if a subreddit or user was specified as argument, the comment's metadata are checked accordingly
-        src = 'author' if args.src == 'user' else 'subreddit' # the username is called 'author' in the data
-        
-        nm = comment_or_post[src] if args.case_sensitive else comment_or_post[src].lower()
-        
-        if src not in comment_or_post.keys() or nm not in args.name: 
-            return False
-    
-    if args.toplevel and not comment_or_post['parent_id'].startswith('t3'):
-        return False
-    
-    regex = args.commentregex if args.searchmode == 'comms' else args.postregex
-    body = 'body' if args.searchmode == 'comms' else 'selftext'
+    return matches_criteria(comment_or_post, args) and is_new(comment_or_post, args)
 
-    if regex is not None and args.include_quoted:
-        search = re.search(regex, comment_or_post[body])
-        if search: # checks if comment regex matches at least once, matches are extracted later
-            pass
-        else:
-            return False
-    elif regex is not None and not args.include_quoted:
-        matches_with_spans = list(find_all_matches(comment_or_post[body], regex))
-        matches = [span for span in matches_with_spans if not inside_quote(comment_or_post[body], span)]
-        if len(matches) == 0:
-            return False
-    
-    # Check if title, flair, or user regexes match; return False if they don't match or value is missing
+
+def relevance_fields(args: argparse.Namespace) -> tuple:
+    """
+    Return the keys of a comment or post that matches_criteria() looks at with the given arguments.
+    None if there are no criteria, in which case every entry has to be decoded in full anyway.
+    """
+    fields = []
+    if args.name is not None:
+        fields.append('author' if args.src == 'user' else 'subreddit')
+    if args.toplevel:
+        fields.append('parent_id')
+    regex = args.commentregex if args.searchmode == 'comms' else args.postregex
+    if regex is not None or args.spacy_search:
+        fields.append('body' if args.searchmode == 'comms' else 'selftext')
     for regex, key in zip([args.titleregex, args.flairregex, args.userregex], ['title', 'author_flair_text', 'author']):
         if regex is not None:
-            # Get the value, using .get() for optional flair field
-            value = comment_or_post[key] if key != 'author_flair_text' else comment_or_post.get('author_flair_text')
-            # Discard if value is missing (useful only for flair) or regex doesn't match
-            if value is None or not re.search(regex, value):
-                return False
+            fields.append(key)
+    return tuple(sorted(set(fields))) if fields else None
+
+
+# the arguments with the regexes of the fields of a comment or post, by key
+FIELD_REGEXES = {'title': 'titleregex', 'author_flair_text': 'flairregex', 'author': 'userregex'}
+
+
+# The checks of the search criteria take the values they need from the arguments first, bound by compile_criteria(),
+# and then the comment or post.
+
+def name_matches(key: str, names: set, case_sensitive: bool, comment_or_post: dict) -> bool:
+    """Test if a comment or post is from one of the subreddits or by one of the users that were specified as argument."""
+    nm = comment_or_post[key] if case_sensitive else comment_or_post[key].lower()
+    return key in comment_or_post.keys() and nm in names
+
+
+def is_toplevel(comment_or_post: dict) -> bool:
+    return comment_or_post['parent_id'].startswith('t3')
 
+
+def text_matches(regex, body: str, include_quoted: bool, comment_or_post: dict) -> bool:
+    """Test if the comment or post regex matches at least once (outside of quotes unless they are included), matches are extracted later."""
+    text = comment_or_post[body]
+    if include_quoted:
+        return bool(may_match(regex, text) and regex.search(text))
+    return len(matching_spans(text, regex, include_quoted=False)) > 0
+
+
+def field_matches(regex, key: str, comment_or_post: dict) -> bool:
+    """Test if the title, flair or user regex matches, which it does not if the value is missing (useful only for flair)."""
+    value = comment_or_post[key] if key != 'author_flair_text' else comment_or_post.get('author_flair_text')
+    return value is not None and bool(may_match(regex, value) and regex.search(value))
+
+
+def spacy_matches(token: str, body: str, pos_search: PosSearch, comment_or_post: dict, tag: bool) -> bool:
+    """Test if the text contains the token of the spacy search and, if tag is set, if it has the searched POS tag there."""
+    text = comment_or_post[body]
+    if token not in text:
+        return False
+    if tag:
+        clock.switch('spacy')
+        found = pos_search.find([text])[0]
+        clock.switch('relevance')
+        return found
+    return True
+
+
+def compile_criteria(args: argparse.Namespace) -> CriteriaChain:
+    """
+    Compile the search criteria that apply with the given arguments into a chain of checks (see criteria), which reorders them
+    by their cost and selectivity. The spacy search always comes last, as it is by far the most expensive.
+    """
+    body = 'body' if args.searchmode == 'comms' else 'selftext'
+    checks = []
+    if args.name is not None:
+        checks.append(('name', partial(name_matches, 'author' if args.src == 'user' else 'subreddit', args.name, args.case_sensitive)))
+    if args.toplevel:
+        checks.append(('toplevel', is_toplevel))
+    regex = args.commentregex if args.searchmode == 'comms' else args.postregex
+    if regex is not None:
+        checks.append(('regex', partial(text_matches, regex, body, args.include_quoted)))
+    for name, key in [('title', 'title'), ('flair', 'author_flair_text'), ('user', 'author')]:
+        if getattr(args, FIELD_REGEXES[key]) is not None:
+            checks.append((name, partial(field_matches, getattr(args, FIELD_REGEXES[key]), key)))
+    last = None
     if args.spacy_search:
-        token = args.spacy_search[0]
-        pos = args.spacy_search[1]
-        text = comment_or_post[body]
-        if token in text:
-            doc = args.nlp(text)
-            tk_list = [(elem.text.lower(), elem.pos_) for elem in doc]
-            if (token.lower(), pos) in tk_list:
-                pass
-            else:
-                return False
-        else:
-            return False
+        last = ('spacy', partial(spacy_matches, args.spacy_search[0], body, args.pos_search))
+    return CriteriaChain(checks, last)
 
-    
-    h = hashlib.md5(json.dumps(comment_or_post, sort_keys=True).encode()).hexdigest() # dicts are unhashable, their original json form is preferrable; hexdigest is used to reduce memory consumption
-    if h in hash_set: # hash check with all previous comments/posts in case the data contain redundancies
+
+def matches_criteria(comment_or_post: dict, args: argparse.Namespace, tag: bool = True) -> bool:
+    """
+    Test if a Reddit comment or post matches the search criteria (see compile_criteria()), without checking for duplicates.
+    Unless tag is set, the text is not POS tagged for a spacy search, which is left to the caller (see tag_pending()).
+    """
+    return args.criteria(comment_or_post, tag)
+
+
+def is_new(comment_or_post: dict, args: argparse.Namespace) -> bool:
+    """Test that a comment or post has not been seen before and add it to the stats if so."""
+    key = entry_key(comment_or_post)
+    if key in seen_ids: # ID check with all previous comments/posts in case the data contain redundancies
         return False
     else:
-        hash_set.add(h)
+        seen_ids.add(key)
         if not args.no_stats:
             stats_dict.setdefault(comment_or_post['subreddit'], 0)
             stats_dict[comment_or_post['subreddit']] += 1  
@@ -268,10 +397,7 @@ def relevant(comment_or_post: dict, args: argparse.Namespace) -> bool:
 def assess_number_of_matches(comment_or_post: dict, compiled_comment_regex, args) -> int:
     """Count the number of matches in a comment or post if a regex is supplied and the firstmatch flag is not set."""
     text = comment_or_post['body'] if args.searchmode == 'comms' else comment_or_post['selftext']
-    matches = list(find_all_matches(text, compiled_comment_regex))
-    if not args.include_quoted:
-        matches = [span for span in matches if not inside_quote(text, span)]
-    return len(matches)
+    return len(matching_spans(text, compiled_comment_regex, args.include_quoted))
 
 
 def log_month(month: str):
@@ -286,17 +412,351 @@ def log_month(month: str):
     logging.info("Processing " + m_name + " " + year)
 
 
-def handle_review_stub(reviewfile: TextIO):
-    """If no entries were filtered out, remove the review file and log this info."""
-    lines_in_review = sum(1 for line in open(reviewfile.name, "r", encoding="utf-8")) - 1
-    if lines_in_review > 0:
-        logging.info(f"{lines_in_review} entries were filtered out into {reviewfile.name}.")
-    else:
-        os.remove(reviewfile.name)
+def handle_review_stub(reviewfile: str):
+    """Close the review file. If no entries were filtered out into it, remove it and log this info."""
+    writer = close_writer(reviewfile)
+    if writer is None:
+        return
+    if writer.rows > 0:
+        logging.info(f"{writer.rows} entries were filtered out into {reviewfile}.")
+    elif not writer.had_rows:
+        os.remove(reviewfile)
         logging.info("No entries were filtered out.")
 
 
-def process_month(month, args, outfile, reviewfile):
+def entry_weight(comment_or_post: dict, args) -> int:
+    """Return the number of matches that will be extracted from a relevant comment or post."""
+    weight = assess_number_of_matches(comment_or_post, args.commentregex, args) if args.commentregex and not args.firstmatch else 1
+    if weight == 0:
+        # Defensive check: relevant() should have caught this, but log if it happens
+        logging.warning(f"Comment/post {comment_or_post['id']} matched the relevance criteria but had no matches for the comment regex. It will be extracted with empty span.")
+    return weight
+
+
+def decode_if_relevant(line: bytes, infile: str, args, tag: bool = True) -> dict:
+    """
+    Decode a raw line of the data if it passes the prefilter, returning the comment or post if it is relevant and None otherwise.
+    Unless tag is set, a spacy search is left out and so is the duplicate check, which has to follow it (see tag_pending()).
+    """
+    if args.prefilter is not None and not args.prefilter(line):
+        return None
+    # the search criteria are tested on the few fields they need, only matches are decoded in full
+    clock.switch('decode')
+    comment_or_post = parse_line(line, infile, args.fields, args.json_backend)
+    clock.switch('relevance')
+    if comment_or_post is None or not matches_criteria(comment_or_post, args, tag):
+        return None
+    if args.fields is not None:
+        clock.switch('decode')
+        comment_or_post = parse_line(line, infile, backend=args.json_backend)
+        clock.switch('relevance')
+    if tag and not is_new(comment_or_post, args):
+        return None
+    return comment_or_post
+
+
+def tag_pending(pending: list, args):
+    """
+    Run the spacy search on the texts of pending entries, given as (offset, comment_or_post), all at once,
+    then check the entries that pass it for duplicates and yield them in their original order
+    as (comment_or_post, weight, offset), like find_relevant(). The list is emptied.
+    """
+    batch = pending[:]
+    pending.clear()
+    if not batch:
+        return
+    body = 'body' if args.searchmode == 'comms' else 'selftext'
+    clock.switch('spacy')
+    found = args.pos_search.find([comment_or_post[body] for _, comment_or_post in batch])
+    for (offset, comment_or_post), passed in zip(batch, found):
+        clock.switch('relevance')
+        if passed and is_new(comment_or_post, args):
+            yield comment_or_post, entry_weight(comment_or_post, args), offset
+
+
+def sample_cursor(sample_points) -> tuple:
+    """
+    Return the first position of a month's sample, given as (sorted) sample points or as a BernoulliSample,
+    and a function that returns the next one, or None once there are no more sample points left.
+    """
+    if isinstance(sample_points, BernoulliSample):
+        def advance():
+            sample_points.advance()
+            return sample_points.next
+        return sample_points.next, advance
+    # the last sample point only ends the sample
+    positions = iter(sample_points[:-1])
+    return next(positions, None), lambda: next(positions, None)
+
+
+def sampled(lines, sample_points):
+    """
+    Yield only the (position, offset, line) items of a month's data stream whose position is in the sample (see sample_cursor()).
+    The lines in between are passed over without being decoded.
+    """
+    next_position, advance = sample_cursor(sample_points)
+    for line in lines:
+        if next_position is None:
+            break
+        if line[0] == next_position:
+            yield line
+            # the next position is only drawn once the line was handed on, see process_month()
+            next_position = advance()
+
+
+def next_dump(infile: str, args) -> str:
+    """The dump that is searched after the given one, which is opened ahead of time with --read_ahead. None if there is none."""
+    month = os.path.basename(infile)
+    if not args.read_ahead or month not in search_order:
+        return None
+    following = search_order.index(month) + 1
+    return os.path.join(args.input, search_order[following]) if following < len(search_order) else None
+
+
+def month_lines(infile: str, args, sample_points=None, start=None):
+    """
+    Return an iterator over the raw lines of a month that need to be looked at: only the lines listed in the month's index
+    for the searched subreddits or users if there is an index, otherwise all lines (or the sampled ones).
+    Each line comes as (position, offset, line), with its line number (None with an index) and byte offset in the decompressed data.
+    If start is given as (position, offset), reading starts at that line.
+    """
+    position, offset = start if start is not None else (0, 0)
+    if args.name is not None and not args.sample and not args.no_index:
+        src = 'author' if args.src == 'user' else 'subreddit'
+        offsets = indexing.lookup_offsets(args.index_dir, infile, src, args.name, args.case_sensitive)
+        if offsets is not None:
+            offsets = offsets[bisect_left(offsets, offset):]
+            return zip(repeat(None), offsets, read_lines_at(infile, offsets))
+
+    lines = read_lines_with_offsets(infile, args.chunk_size * 2**20, start_offset=offset, on_chunk=search_progress.read if search_progress is not None else None,
+                                    read_ahead=args.read_ahead, next_file=next_dump(infile, args))
+    lines = ((number, offset, line) for number, (line, offset) in enumerate(lines, position))
+    if args.sample:
+        lines = sampled(lines, sample_points)
+    return lines
+
+
+def find_relevant(month, args, sample_points=None, start=None, progress=None):
+    """
+    Iterate over a month's data, yielding each relevant comment or post together with its weight,
+    i.e. the number of regex matches that will be extracted from it, and its offset in the month's data
+    (its line number in a columnar store), from where it can be read again with read_entries().
+    If sample points are given, only the entries at these positions are considered.
+    Reading starts at the line given by start (see month_lines()), and progress is called with the position and offset
+    of each line before it is looked at, e.g. to write checkpoints. Neither applies to a columnar store.
+    With a spacy search, the entries that match all other criteria are collected and tagged in batches.
+    """
+    infile = os.path.join(args.input, month)
+    if args.store:
+        yield from find_relevant_in_store(infile, args, sample_points)
+        return
+    lines = month_lines(infile, args, sample_points, start)
+    if search_profile is not None:
+        lines = search_profile.sliced(lines)
+    batched = bool(args.spacy_search)
+    pending = []
+
+    for position, offset, line in lines:
+        if progress is not None:
+            # a checkpoint must not be written before entries that are still waiting to be tagged
+            if pending and checkpoints.due():
+                yield from tag_pending(pending, args)
+            if not pending:
+                progress(position, offset)
+        comment_or_post = decode_if_relevant(line, infile, args, tag=not batched)
+        if comment_or_post is None:
+            continue
+        if batched:
+            pending.append((offset, comment_or_post))
+            if len(pending) >= args.pos_search.pending_size:
+                yield from tag_pending(pending, args)
+        else:
+            yield comment_or_post, entry_weight(comment_or_post, args), offset
+
+    yield from tag_pending(pending, args)
+
+
+def find_relevant_in_store(month_dir, args, sample_points=None):
+    """
+    Like find_relevant(), for a month of a columnar store: the search criteria are tested on the stored columns
+    and only the matches are decoded from their original JSON line.
+    """
+    predicate = lambda fields: matches_criteria(fields, args, tag=False)
+    positions = None
+    if isinstance(sample_points, BernoulliSample):
+        positions = sample_points.positions_below(columnar.line_count(month_dir))
+    elif sample_points is not None:
+        positions = sample_points[:-1] # like sampled()
+    pending = []
+    for line_number, line in columnar.query_month(month_dir, args, predicate, positions):
+        comment_or_post = parse_line(line, month_dir, backend=args.json_backend)
+        if comment_or_post is None:
+            continue
+        if args.spacy_search:
+            pending.append((line_number, comment_or_post))
+            if len(pending) >= args.pos_search.pending_size:
+                yield from tag_pending(pending, args)
+        elif is_new(comment_or_post, args):
+            yield comment_or_post, entry_weight(comment_or_post, args), line_number
+    yield from tag_pending(pending, args)
+
+
+def read_entries(month, args, offsets) -> dict:
+    """Decode the entries at the given offsets of a month's data (line numbers in a columnar store) again, as a dict of offset to entry."""
+    infile = os.path.join(args.input, month)
+    if args.store:
+        lines = columnar.read_lines_at(infile, offsets)
+    else:
+        offsets = sorted(set(offsets))
+        lines = dict(zip(offsets, read_lines_at(infile, offsets)))
+    return {offset: parse_line(line, infile, backend=args.json_backend) for offset, line in lines.items()}
+
+
+def add_to_reservoir(item: tuple, reservoir_size: int):
+    """
+    Offer a single relevant match, given as (month, offset, match index), to the reservoir (Algorithm L).
+    Once the reservoir is full, the number of matches until the next one replaces a random item is drawn in advance,
+    so the matches in between cost neither a random number nor an allocation.
+    """
+    global relevant_count, reservoir_skip
+    relevant_count += 1
+    if len(reservoir) < reservoir_size:
+        reservoir.append(item)
+        if len(reservoir) == reservoir_size:
+            reservoir_skip = next_reservoir_skip(1.0, reservoir_size)
+    elif relevant_count == reservoir_skip[0]:
+        reservoir[random.randrange(reservoir_size)] = item
+        reservoir_skip = next_reservoir_skip(reservoir_skip[1], reservoir_size)
+
+
+def next_reservoir_skip(weight: float, reservoir_size: int) -> tuple:
+    """Draw the new weight and from it the number of the next match that enters the reservoir, as (number, weight)."""
+    weight *= math.exp(math.log(1 - random.random()) / reservoir_size)
+    if weight >= 1: # only if the random number was 0
+        return relevant_count + 1, weight
+    return relevant_count + 1 + math.floor(math.log(1 - random.random()) / math.log(1 - weight)), weight
+
+
+def reservoir_entries(args):
+    """Yield the sampled matches in the reservoir as {'entry', 'index'}, reading the entries of each month again at once."""
+    entries = {}
+    for month in dict.fromkeys(month for month, _, _ in reservoir):
+        offsets = [offset for item_month, offset, _ in reservoir if item_month == month]
+        entries.update(((month, offset), entry) for offset, entry in read_entries(month, args, offsets).items())
+    for month, offset, index in reservoir:
+        yield {'entry': entries[(month, offset)], 'index': index}
+
+
+def render_hit(comment_or_post: dict, weight: int, args) -> tuple:
+    """Render the output rows of a relevant entry as text in the output format (see RowBuffer), returning (outfile text, reviewfile text)."""
+    outbuf, reviewbuf = RowBuffer(args.output_format, output_headers(args)), RowBuffer(args.output_format, output_headers(args, review=True))
+    for i in range(weight):
+        filter_then_extract({'entry': comment_or_post, 'index': i}, args.commentregex, args, args.include_quoted, outbuf, reviewbuf)
+    return outbuf.getvalue(), reviewbuf.getvalue()
+
+
+def hit_record(comment_or_post: dict, weight: int, args, offset: int = None) -> tuple:
+    """
+    Turn a relevant entry found in a worker process into a record that can be merged by the parent:
+    (ID key, subreddit, weight, outfile text, reviewfile text).
+    When reservoir sampling, the entry's offset is carried in place of the outfile text.
+    """
+    if args.count:
+        out_text, review_text = '', ''
+    elif args.reservoir_size:
+        out_text, review_text = f'{offset}\n', ''
+    else:
+        out_text, review_text = render_hit(comment_or_post, weight, args)
+    return entry_key(comment_or_post), comment_or_post['subreddit'], weight, out_text, review_text
+
+
+def merge_hit(record: tuple, args, outf, reviewf, month: str = None) -> int:
+    """
+    Merge a record from a worker process in exactly the way the serial run would have processed the entry:
+    duplicates of entries seen before are dropped, stats are updated, rows are written to the output files
+    or the entry's matches in the given month are offered to the reservoir. Returns the number of relevant matches that were added.
+    """
+    key, subreddit, weight, out_text, review_text = record
+    if key in seen_ids:
+        return 0
+    seen_ids.add(key)
+    if not args.no_stats:
+        stats_dict.setdefault(subreddit, 0)
+        stats_dict[subreddit] += 1
+    if search_progress is not None:
+        search_progress.hits += 1
+
+    if args.reservoir_size:
+        offset = int(out_text)
+        for i in range(weight):
+            add_to_reservoir((month, offset, i), args.reservoir_size)
+    elif not args.count:
+        # the rows of an entry all go to one of the files, one per match (see entry_weight())
+        outf.write_rendered(out_text, weight if out_text else 0)
+        reviewf.write_rendered(review_text, weight if review_text else 0)
+    return weight
+
+
+def init_worker(args):
+    """Make the search arguments available to a pipeline worker process once, instead of with every batch."""
+    global worker_args
+    worker_args = args
+
+
+def process_batch(task: tuple) -> list:
+    """
+    Decode a batch of raw lines and test them for relevance in a pipeline worker, returning the records of the relevant entries in order
+    and the time spent in each stage.
+    """
+    infile, batch = task
+    global seen_ids
+    args = worker_args
+    seen_ids = IdSet() # duplicates across batches are caught when merging
+    records, pending = [], []
+    clock.switch('relevance')
+    for offset, line in batch:
+        comment_or_post = decode_if_relevant(line, infile, args, tag=not args.spacy_search)
+        if comment_or_post is None:
+            continue
+        if args.spacy_search: # the whole batch is tagged at once
+            pending.append((offset, comment_or_post))
+        else:
+            clock.switch('write')
+            records.append(hit_record(comment_or_post, entry_weight(comment_or_post, args), args, offset))
+            clock.switch('relevance')
+    for comment_or_post, weight, offset in tag_pending(pending, args):
+        clock.switch('write')
+        records.append(hit_record(comment_or_post, weight, args, offset))
+    return records, clock.take()
+
+
+def bounded(iterable, semaphore):
+    """Only hand out a new item once the semaphore allows it, to keep the number of batches in flight limited."""
+    for item in iterable:
+        semaphore.acquire()
+        yield item
+
+
+def find_relevant_pipelined(month, args, sample_points=None):
+    """
+    Iterate over a month's data in a pipeline: the file is decompressed and split into batches of lines
+    in the background, a pool of args.line_workers processes decodes and tests each batch,
+    and the records of the relevant entries are yielded in the original order.
+    """
+    infile = os.path.join(args.input, month)
+    lines = ((offset, line) for _, offset, line in month_lines(infile, args, sample_points))
+
+    in_flight = threading.Semaphore(PIPELINE_BATCHES_PER_WORKER * args.line_workers)
+    tasks = ((infile, batch) for batch in bounded(batch_lines(lines, PIPELINE_BATCH_SIZE), in_flight))
+
+    with Pool(args.line_workers, initializer=init_worker, initargs=(args,)) as pool:
+        for records, times in pool.imap(process_batch, tasks):
+            in_flight.release()
+            clock.add(times)
+            yield from records
+
+
+def process_month(month, args, outfile, reviewfile, resume=None):
     """
     Process Reddit data for a specific month and extract relevant comments/posts.
     This function reads Reddit data from a monthly file, filters entries based on
@@ -320,73 +780,268 @@ def process_month(month, args, outfile, reviewfile):
     Side Effects:
         - Modifies global 'reservoir' list with sampled entries if reservoir_size is set.
         - Modifies global 'relevant_count' counter.
-        - Creates/appends to outfile and reviewfile if not counting and not using reservoir.
-        - Calls handle_review_stub() to finalize review file.
+        - Appends to outfile and reviewfile if not counting and not using reservoir. Their writers stay open for the next month.
     Raises:
         Implicitly may raise exceptions from read_redditfile(), relevant(), and file I/O operations.
+    Checkpoints:
+        If checkpoints are written, one is written within the month whenever one is due (except with args.line_workers).
+        If resume is given, the month is continued from such a checkpoint.
     """
     log_month(month)
-    monthly_relevant_count = 0
-    total_count = -1
-    infile = os.path.join(args.input, month)
+    monthly_relevant_count = resume['count'] if resume is not None else 0
 
-    # for reservoir sampling
-    global reservoir
-    global relevant_count
-
-    if args.sample:
-        sample_points = get_samplepoints(month, args.sample, args.input)
+    if resume is not None:
+        sample_points = restore_sample(resume['sample_points'])
+    else:
+        sample_points = get_sample(month, args) if args.sample else None
 
+    outf, reviewf = None, None
     if not args.count and not args.reservoir_size:
-        outf, reviewf = open(outfile, "a", encoding="utf-8"), open(reviewfile, "a", encoding="utf-8")
+        outf, reviewf = open_output(outfile, args), open_output(reviewfile, args, review=True)
+    pipelined = args.line_workers > 1 and resume is None
+    if search_progress is not None: # with --line_workers, the dump is read in another thread
+        search_progress.start_month(month, concurrent=pipelined)
+
+    def progress(position, offset):
+        """Write a checkpoint before the line at the given position, if one is due."""
+        if checkpoints.due():
+            if outf is not None:
+                outf.flush()
+                reviewf.flush()
+            # the sample continues with the current line
+            if isinstance(sample_points, BernoulliSample):
+                remaining = sample_points.state()
+            else:
+                remaining = sample_points[bisect_left(sample_points, position):] if sample_points is not None else None
+            save_checkpoint({'month': month, 'position': position, 'offset': offset, 'sample_points': remaining, 'count': monthly_relevant_count})
 
-    for comment_or_post in read_redditfile(infile):
-        total_count += 1
-        if not args.sample or (args.sample and total_count == sample_points[0]):
+    if pipelined:
+        for record in find_relevant_pipelined(month, args, sample_points):
+            clock.switch('write')
+            monthly_relevant_count += merge_hit(record, args, outf, reviewf, month)
+            clock.switch(None) # waiting for the workers
 
-            # if sampling, remove the first sample point from the ordered list
-            if args.sample:
-                del sample_points[0]
-                if len(sample_points) == 0: # no more sample points left
-                    break
+    else:
+        start = (resume['position'], resume['offset']) if resume is not None else None
+        clock.switch('relevance') # the lines are read and checked until the next hit
+        for comment_or_post, weight, offset in find_relevant(month, args, sample_points, start, progress if checkpoints is not None else None):
+            clock.switch('write')
+            monthly_relevant_count += weight
+            if search_progress is not None:
+                search_progress.hits += 1
             
-            if relevant(comment_or_post, args):
-                weight = assess_number_of_matches(comment_or_post, args.commentregex, args) if args.commentregex and not args.firstmatch else 1
-                if weight == 0:
-                    # Defensive check: relevant() should have caught this, but log if it happens
-                    logging.warning(f"Comment/post {comment_or_post['id']} matched the relevance criteria but had no matches for the comment regex. It will be extracted with empty span.")
-                monthly_relevant_count += weight
-                
-                # Reservoir sampling logic
-                for i in range(weight):
-                    relevant_count += 1
-                    entrydict = {'entry': comment_or_post, 'index': i}
-                    if args.reservoir_size:
-                        if len(reservoir) < args.reservoir_size:
-                            reservoir.append(entrydict)
-                        else:
-                            # calculate j for reservoir sampling accounting for the current item's position in the stream
-                            j = random.randint(0, relevant_count - 1)
-                            if j < args.reservoir_size:
-                                reservoir[j] = entrydict
-                    else:
-                        if not args.count:
-                            filter_then_extract(entrydict, args.commentregex, args, args.include_quoted, outf, reviewf)
+            # Reservoir sampling logic
+            for i in range(weight):
+                if args.reservoir_size:
+                    add_to_reservoir((month, offset, i), args.reservoir_size)
+                else:
+                    if not args.count:
+                        filter_then_extract({'entry': comment_or_post, 'index': i}, args.commentregex, args, args.include_quoted, outf, reviewf)
+            clock.switch('relevance')
 
     if not args.count and not args.reservoir_size:
+        clock.switch('write')
+        outf.flush()
+        reviewf.flush()
+    clock.switch(None)
+    if args.count:
+        return monthly_relevant_count
+
+
+def process_month_worker(task: tuple) -> tuple:
+    """
+    Process a single month in a worker process with its own dedupe set and stats.
+    Rows are written to the month's part files (or, when reservoir sampling, the offset of each entry in the month's data,
+    from where the parent reads the sampled entries again) and a ledger with one record per relevant entry is returned,
+    holding the length of its texts in the part files instead of the texts themselves, so that the parent can merge the months deterministically.
+    Returns the ledger, the number of lines read and the time spent in each stage.
+    """
+    global seen_ids, search_progress, search_order
+    month, args, sample_points, out_part, review_part = task
+    log_month(month)
+    seen_ids = IdSet()
+    clock.take() # the times so far are the parent's (see process_month_isolated())
+    # the progress is reported by the parent, month by month, this one only counts the lines
+    search_progress = Progress([os.path.join(args.input, month)], math.inf, clock)
+    search_progress.start_month(month, concurrent=args.line_workers > 1)
+    search_order = [] # the other months are searched at the same time
+    stats_dict.clear()
+    ledger = []
+
+    if out_part is not None:
+        outf, reviewf = open(out_part, "w", encoding="utf-8", newline=''), open(review_part, "w", encoding="utf-8", newline='')
+
+    pipelined = args.line_workers > 1 # only in the parent process, see process_month_isolated()
+    found = find_relevant_pipelined(month, args, sample_points) if pipelined else find_relevant(month, args, sample_points)
+
+    waiting = None if pipelined else 'relevance' # the pipeline workers keep their own times
+    clock.switch(waiting)
+    for item in found:
+        clock.switch('write')
+        h, subreddit, weight, out_text, review_text = item if pipelined else hit_record(item[0], item[1], args, item[2])
+        if out_part is not None:
+            _=outf.write(out_text)
+            _=reviewf.write(review_text)
+        ledger.append((h, subreddit, weight, len(out_text), len(review_text)))
+        clock.switch(waiting)
+
+    clock.switch('write')
+    if out_part is not None:
         outf.close()
         reviewf.close()
-        handle_review_stub(reviewf)
-    elif args.count:
-        return monthly_relevant_count
+    return ledger, search_progress.lines, clock.take()
+
+
+def process_month_isolated(task: tuple) -> tuple:
+    """Run process_month_worker() in this process without losing the dedupe set, stats, progress and stage times of the run."""
+    global seen_ids, search_progress, search_order
+    saved_ids, saved_stats, saved_progress, saved_order = seen_ids, dict(stats_dict), search_progress, search_order
+    saved_times = clock.take()
+    try:
+        return process_month_worker(task)
+    finally:
+        seen_ids, search_progress, search_order = saved_ids, saved_progress, saved_order
+        stats_dict.clear()
+        stats_dict.update(saved_stats)
+        clock.add(saved_times)
+
+
+def month_ledgers(args, infiles: list, tasks: list):
+    """
+    Yield the result of each month task in order, with its part files written: its ledger, the lines read and the time spent in each stage.
+    With the result cache, months whose dump has not changed since they were searched with the same arguments are answered by the cache,
+    and the others are added to it. Only the headers of the entries are read up front, each entry is loaded when its month is merged.
+    Months are processed in a pool of args.workers processes, or in this process if there is only one.
+    """
+    paths, hits, misses = [], [], []
+    for infile, task in zip(infiles, tasks):
+        month, _, sample_points, out_part, review_part = task
+        path = result_cache.entry_path(args, month, sample_points) if args.cache else None
+        hit = path is not None and result_cache.is_current(path, infile, rows=out_part is not None)
+        paths.append(path)
+        hits.append(hit)
+        if not hit:
+            misses.append(task)
+    if args.cache:
+        logging.info(f"{len(tasks) - len(misses)} of {len(tasks)} months are answered by the result cache.")
+
+    if args.workers > 1 and misses:
+        pool = Pool(args.workers)
+        results = pool.imap(process_month_worker, misses)
+    else:
+        pool = None
+        results = map(process_month_isolated, misses)
+
+    for infile, task, path, hit in zip(infiles, tasks, paths, hits):
+        month, _, sample_points, out_part, review_part = task
+        entry = result_cache.load(path, infile) if hit else None
+        if entry is not None:
+            log_month(month)
+            ledger, lines = entry
+            if out_part is not None:
+                result_cache.copy_rows(path, out_part, review_part)
+            yield ledger, lines, {} # no time was spent on the month
+            continue
+        # an entry that went away since its header was read is searched here
+        ledger, lines, times = next(results) if not hit else process_month_isolated(task)
+        if args.cache_counts_only:
+            # the ledger of a counting search, which has no rows, is what a later --count search looks up
+            counts = [(key, subreddit, weight, 0, 0) for key, subreddit, weight, _, _ in ledger]
+            result_cache.store(result_cache.entry_path(args, month, sample_points, mode='count'), infile, counts, lines)
+        elif path is not None:
+            result_cache.store(path, infile, ledger, lines, out_part, review_part)
+        yield ledger, lines, times
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+def merge_month_result(month, args, result, parts, outfile, reviewfile) -> int:
+    """Merge the result and part files of a month processed by a worker (see month_ledgers()), returning the month's count of relevant matches."""
+    monthly_relevant_count = 0
+    ledger, lines, times = result
+    out_part, review_part = parts
+    if search_progress is not None:
+        search_progress.merged(lines, times)
+    clock.switch('write')
+
+    outf, reviewf = None, None
+    if out_part is not None:
+        out_partf, review_partf = open(out_part, "r", encoding="utf-8", newline=''), open(review_part, "r", encoding="utf-8", newline='')
+    if not args.count and not args.reservoir_size:
+        outf, reviewf = open_output(outfile, args), open_output(reviewfile, args, review=True)
+
+    for key, subreddit, weight, out_len, review_len in ledger:
+        out_text = out_partf.read(out_len) if out_len else ''
+        review_text = review_partf.read(review_len) if review_len else ''
+        monthly_relevant_count += merge_hit((key, subreddit, weight, out_text, review_text), args, outf, reviewf, month)
+
+    if out_part is not None:
+        out_partf.close()
+        review_partf.close()
+        os.remove(out_part)
+        os.remove(review_part)
+    if not args.count and not args.reservoir_size:
+        outf.flush() # before the checkpoint after the month
+        reviewf.flush()
+    clock.switch(None)
+    return monthly_relevant_count
+
+
+def process_months_merged(args, timeframe, outfile, reviewfile):
+    """
+    Process each month of the timeframe on its own, in a pool of args.workers processes or from the result cache (see month_ledgers()).
+    Results are merged in timeframe order as soon as they are available, yielding (month, count) per month.
+    The merged output, counts, stats and reservoir are identical to those of a serial run.
+    """
+    tasks, parts, random_states = [], [], []
+    for month in timeframe:
+        random_states.append(random.getstate())
+        # sample points are drawn here, in order, so the random state evolves as in a serial run
+        sample_points = get_sample(month, args) if args.sample else None
+        if args.count:
+            month_parts = (None, None)
+        else:
+            part_base = os.path.join(args.output, f".otacon_{month}_{os.getpid()}")
+            month_parts = (part_base + "_out.part", part_base + "_review.part")
+        tasks.append((month, args, sample_points) + month_parts)
+        parts.append(month_parts)
+
+    # when sampling, the random state after a month is the one before the sample points of the next month were drawn
+    random_states = random_states[1:] + [None]
+
+    infiles = [os.path.join(args.input, month) for month in timeframe]
+    for month, month_parts, result, random_state in zip(timeframe, parts, month_ledgers(args, infiles, tasks), random_states):
+        count = merge_month_result(month, args, result, month_parts, outfile, reviewfile)
+        yield month, count
+        month_completed(month, count, random_state if args.sample else None)
+
+
+def save_checkpoint(current: dict = None, random_state=None):
+    """
+    Write a checkpoint with the completed months, the position in the current month if there is one,
+    and the global state. The random state can be given if it differs from the current one.
+    """
+    state = {'completed': completed_months, 'current': current, 'stats': stats_dict, 'reservoir': reservoir, 'reservoir_skip': reservoir_skip, 'relevant_count': relevant_count}
+    checkpoints.save(state, seen_ids, random_state)
+
+
+def month_completed(month, count, random_state=None):
+    """Keep track of a completed month, report the progress and write a checkpoint after it."""
+    completed_months.append((month, count))
+    if search_progress is not None:
+        search_progress.end_month(month)
+    if checkpoints is not None:
+        save_checkpoint(random_state=random_state)
 
 
 def open_files(args, month) -> tuple:
     """Open the output and review files for writing and write their headers."""
     outfile = assemble_outfile_name(args, month)
     outfile = os.path.join(args.output, outfile)
-    reviewfile = outfile[:-4] + "_filtered-out_matches.csv" if not args.return_all else outfile[:-4] + "_filtered-out_matches.jsonl"
-    reviewfile = os.path.join(args.output, reviewfile)
+    ending = "." + args.output_format
+    reviewfile = outfile[:-len(ending)] + "_filtered-out_matches" + ending
     if not args.return_all and not args.reservoir_size:
         write_csv_headers(outfile, reviewfile, args)
     return outfile, reviewfile
@@ -398,55 +1053,104 @@ def setup_logging_and_args():
     return handle_args()
 
 
+def setup_progress(args, timeframe: list):
+    """
+    Report the progress through the timeframe every --progress_interval seconds, to the log and to the metrics file.
+    The months are also kept in the order they are searched in (see next_dump()).
+    """
+    global search_progress, search_order
+    search_order = list(timeframe)
+    if args.progress_interval > 0:
+        path = args.metrics_file or (os.path.join(args.output, METRICS_FILE) if args.output else None)
+        search_progress = Progress([os.path.join(args.input, month) for month in timeframe], args.progress_interval, clock, path)
+
+
+def setup_profile(args):
+    """With --profile, prepare the profile of the search and time the prefilter and each search criterion."""
+    global search_profile
+    if args.profile is None:
+        return
+    search_profile = SearchProfile(args.profile or None)
+    if args.prefilter is not None:
+        args.prefilter = search_profile.timed('prefilter', args.prefilter)
+    args.criteria.wrap(search_profile.timed)
+
+
 def setup_spacy(args):
     """Load spacy model if NLP search is enabled."""
     if args.spacy_search:
-        logging.info("Importing spacy…")
-        import spacy
-        logging.info(f"Importing {args.language} model…")
-        args.nlp = spacy.load(args.language)
+        token, pos = args.spacy_search
+        args.pos_search = PosSearch(load_model(args.language), token, pos, args.spacy_batch_size, args.spacy_processes)
+
+
+def process_months(args, timeframe, outfile=None, reviewfile=None):
+    """
+    Process all months in the timeframe, serially or in parallel, yielding (month, count) per month.
+    When resuming from a checkpoint within a month, that month is continued serially first.
+    """
+    global resume_point
+    if resume_point is not None:
+        month, resume, resume_point = timeframe[0], resume_point, None
+        count = process_month(month, args, outfile, reviewfile, resume)
+        yield month, count
+        month_completed(month, count)
+        timeframe = timeframe[1:]
+
+    if args.workers > 1 or args.cache:
+        yield from process_months_merged(args, timeframe, outfile, reviewfile)
+    else:
+        for month in timeframe:
+            count = process_month(month, args, outfile, reviewfile)
+            yield month, count
+            month_completed(month, count)
 
 
 def process_timeframe(args, timeframe, outfile, reviewfile):
     """Process all months in the timeframe with normal extraction."""
-    for month in timeframe:
-        process_month(month, args, outfile, reviewfile)
+    for _ in process_months(args, timeframe, outfile, reviewfile):
+        pass
+
+
+def report_month_count(args, month, count):
+    """Log the count of a month and write the month's stats in count mode."""
+    logging.info(f"{count} instances for {month}" + (f" ({args.query_name})" if args.query_name else ""))
+    if args.output:
+        stats_file = os.path.join(args.output, f'otacon_search_stats_{month}.txt')
+        with open(stats_file, "w") as outfile:
+            _=outfile.write(json.dumps(stats_dict))
 
 
 def process_count_mode(args, timeframe):
     """Process timeframe in count mode and output statistics."""
-    total_count = 0
-    for month in timeframe:
-        count = process_month(month, args, outfile=None, reviewfile=None)
-        logging.info(f"{count} instances for {month}")
-        total_count += count
-        if args.output:
-            stats_file = os.path.join(args.output, f'otacon_search_stats_{month}.txt')
-            with open(stats_file, "w") as outfile:
-                _=outfile.write(json.dumps(stats_dict))
+    for month, count in process_months(args, timeframe):
+        report_month_count(args, month, count)
+    total_count = sum(count for month, count in completed_months) # including the months before a resumed checkpoint
     logging.info(f"{total_count} total instances")
 
 
 def process_reservoir_sampling(args, timeframe, outfile, reviewfile):
     """Process timeframe using reservoir sampling and write results."""
-    for month in timeframe:
-        process_month(month, args, outfile=None, reviewfile=None)
-    
+    for _ in process_months(args, timeframe):
+        pass
+    write_reservoir(args, outfile, reviewfile)
+
+
+def write_reservoir(args, outfile, reviewfile):
+    """Write the entries in the reservoir to the output."""
     logging.info(f"Writing reservoir of size {args.reservoir_size} to output.")
     
     if not args.return_all:
         write_csv_headers(outfile, reviewfile, args)
     
-    outf, reviewf = open(outfile, "a", encoding="utf-8"), open(reviewfile, "a", encoding="utf-8")
+    outf, reviewf = open_output(outfile, args), open_output(reviewfile, args, review=True)
     
     logging.info(f"Size of reservoir: {len(reservoir)}")
     
-    for comment_or_post in reservoir:
-        filter_then_extract(comment_or_post, args.commentregex, args, args.include_quoted, outf, reviewf)
+    for entrydict in reservoir_entries(args):
+        filter_then_extract(entrydict, args.commentregex, args, args.include_quoted, outf, reviewf)
     
-    outf.close()
-    reviewf.close()
-    handle_review_stub(reviewf)
+    close_writer(outfile)
+    handle_review_stub(reviewfile)
 
 
 def write_final_stats(args):
@@ -457,7 +1161,207 @@ def write_final_stats(args):
             _=outfile.write(json.dumps(stats_dict))
 
 
+class Query:
+    """
+    A search of a --queries run, with its own arguments, duplicate check, stats, reservoir, counts and output files,
+    and, if it samples, its own random state, which starts out as that of a search run on its own.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.random_state = random.getstate() if args.sample or args.reservoir_size else None
+        self.seen_ids = make_dedupe(args)
+        self.stats = {}
+        self.reservoir = []
+        self.relevant_count = 0
+        self.reservoir_skip = None
+        self.completed_months = []
+        self.outfile, self.reviewfile = None, None
+
+
+def switch_query(query: Query):
+    """Make the state of a query the module-level state that is_new(), add_to_reservoir() and the output functions work on."""
+    global current_query, seen_ids, stats_dict, reservoir, relevant_count, reservoir_skip, completed_months
+    if query is current_query:
+        return
+    if current_query is not None:
+        current_query.relevant_count, current_query.reservoir_skip = relevant_count, reservoir_skip
+        if current_query.random_state is not None:
+            current_query.random_state = random.getstate()
+    seen_ids, stats_dict, reservoir, completed_months = query.seen_ids, query.stats, query.reservoir, query.completed_months
+    relevant_count, reservoir_skip = query.relevant_count, query.reservoir_skip
+    if query.random_state is not None:
+        random.setstate(query.random_state)
+    current_query = query
+
+
+def process_month_queries(month, args, queries: list) -> list:
+    """
+    Search a month for several queries in a single pass: each line is decompressed and prefiltered once, decoded once
+    with the fields that all queries need, tested against the criteria of each query, and decoded in full once if any query matches.
+    Every query keeps its own sample, duplicate check, stats and outputs. Returns the month's count of relevant matches per query.
+    """
+    log_month(month)
+    infile = os.path.join(args.input, month)
+    counts = [0] * len(queries)
+
+    # the next sample position and the function that draws the one after it, per sampling query
+    cursors = {}
+    for i, query in enumerate(queries):
+        if query.args.sample:
+            switch_query(query)
+            cursors[i] = list(sample_cursor(get_sample(month, query.args)))
+    fields = [query.args.fields for query in queries]
+    fields = None if None in fields else tuple(sorted({field for query_fields in fields for field in query_fields}))
+
+    outfs, reviewfs = [None] * len(queries), [None] * len(queries)
+    for i, query in enumerate(queries):
+        if not args.count and not query.args.reservoir_size:
+            outfs[i], reviewfs[i] = open_output(query.outfile, query.args), open_output(query.reviewfile, query.args, review=True)
+
+    if search_progress is not None:
+        search_progress.start_month(month)
+    lines = read_lines_with_offsets(infile, args.chunk_size * 2**20, on_chunk=search_progress.read if search_progress is not None else None,
+                                    read_ahead=args.read_ahead, next_file=next_dump(infile, args))
+    clock.switch('relevance')
+    for position, (line, offset) in enumerate(lines):
+        candidates = []
+        for i, query in enumerate(queries):
+            if i in cursors:
+                if cursors[i][0] != position:
+                    continue
+                cursors[i][0] = cursors[i][1]()
+            if query.args.prefilter is None or query.args.prefilter(line):
+                candidates.append(i)
+        if not candidates:
+            continue
+
+        clock.switch('decode')
+        comment_or_post = parse_line(line, infile, fields, args.json_backend)
+        clock.switch('relevance')
+        if comment_or_post is None:
+            continue
+        matching = [i for i in candidates if matches_criteria(comment_or_post, queries[i].args)]
+        if not matching:
+            continue
+        if fields is not None:
+            clock.switch('decode')
+            comment_or_post = parse_line(line, infile, backend=args.json_backend)
+
+        for i in matching:
+            query = queries[i]
+            switch_query(query)
+            clock.switch('relevance')
+            if not is_new(comment_or_post, query.args):
+                continue
+            clock.switch('write')
+            if search_progress is not None:
+                search_progress.hits += 1
+            weight = entry_weight(comment_or_post, query.args)
+            counts[i] += weight
+            for j in range(weight):
+                if query.args.reservoir_size:
+                    add_to_reservoir((month, offset, j), query.args.reservoir_size)
+                elif not args.count:
+                    filter_then_extract({'entry': comment_or_post, 'index': j}, query.args.commentregex, query.args, query.args.include_quoted, outfs[i], reviewfs[i])
+        clock.switch('relevance')
+
+    clock.switch('write')
+    for outf, reviewf in zip(outfs, reviewfs):
+        if outf is not None:
+            outf.flush()
+            reviewf.flush()
+    clock.switch(None)
+    return counts
+
+
+def process_queries(args, timeframe):
+    """
+    Run the searches of a --queries file in a single pass over the timeframe (see process_month_queries()).
+    Each search writes its results, counts and stats to its own subdirectory of the output directory, as if it had been run on its own.
+    """
+    queries = []
+    for query_args in args.queries.values():
+        setup_spacy(query_args)
+        query_args.fields = relevance_fields(query_args)
+        query_args.criteria = compile_criteria(query_args)
+        if query_args.output is not None:
+            query_args.output = os.path.abspath(query_args.output)
+            os.makedirs(query_args.output, exist_ok=True)
+        query = Query(query_args)
+        if not args.count:
+            query.outfile, query.reviewfile = open_files(query_args, timeframe[0])
+        queries.append(query)
+
+    for month in timeframe:
+        counts = process_month_queries(month, args, queries)
+        for query, count in zip(queries, counts):
+            switch_query(query)
+            completed_months.append((month, count))
+            if args.count:
+                report_month_count(query.args, month, count)
+        if search_progress is not None:
+            search_progress.end_month(month)
+
+    for query in queries:
+        switch_query(query)
+        if args.count:
+            logging.info(f"{sum(count for month, count in completed_months)} total instances ({query.args.query_name})")
+        elif query.args.reservoir_size is not None:
+            write_reservoir(query.args, query.outfile, query.reviewfile)
+        else:
+            close_writer(query.outfile)
+            handle_review_stub(query.reviewfile)
+            if args.no_cleanup is None:
+                cleanup(query.args.output, extraction_name=assemble_outfile_name(query.args, month=None), workers=args.workers)
+        write_final_stats(query.args)
+    if search_progress is not None:
+        search_progress.finish()
+
+
+# subcommands, called as e.g. "python otacon/main.py index --input …"
+COMMANDS = {
+    'index': indexing.main,
+    'convert': convert.main,
+    'store': columnar.main,
+    'counts': counts.main,
+    'synthesize': synthetic.main,
+    'benchmark': benchmark.main,
+}
+
+
+def resume_search(args, timeframe: list) -> dict:
+    """
+    Restore the state of an interrupted search from its last checkpoint and cut the output files back to their state at that point.
+    Returns the checkpoint, or None if there is no usable checkpoint.
+    """
+    global seen_ids, relevant_count, reservoir_skip, resume_point
+    directory = checkpoint.checkpoint_dir(args.output)
+    state = checkpoint.load(directory)
+    if state is None:
+        logging.error(f"There is no checkpoint to resume from in {args.output}.")
+        return None
+    if state['fingerprint'] != json.loads(json.dumps(checkpoint.search_fingerprint(args, timeframe))):
+        logging.error("The checkpoint belongs to a search with different parameters or a different timeframe.")
+        return None
+
+    completed_months[:] = [tuple(month) for month in state['completed']]
+    stats_dict.update(state['stats'])
+    reservoir[:] = [tuple(item) for item in state['reservoir']]
+    reservoir_skip = tuple(state['reservoir_skip']) if state['reservoir_skip'] is not None else None
+    relevant_count = state['relevant_count']
+    seen_ids = load_dedupe(directory, state['generation'], state['dedupe'], args)
+    resume_point = state['current']
+    checkpoint.restore_outputs(state['outputs'])
+    logging.info(f"Resuming the search after {len(completed_months)} completed month(s)" + (f" in {resume_point['month']}." if resume_point else "."))
+    return state
+
+
 def main():
+    global seen_ids, checkpoints
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
+
     args = setup_logging_and_args()
     timeframe = establish_timeframe(args.time_from, args.time_to, args.input)
     if args.reverse_order:
@@ -468,23 +1372,57 @@ def main():
         logging.info(f"Using reservoir sampling with size {args.reservoir_size}.")
 
     setup_spacy(args)
-
-    if not args.count:
+    args.fields = relevance_fields(args)
+    args.criteria = compile_criteria(args)
+    setup_profile(args)
+    seen_ids = make_dedupe(args)
+    if args.output:
         args.output = os.path.abspath(args.output)
+
+    if args.queries is not None:
+        setup_progress(args, timeframe)
+        return process_queries(args, timeframe)
+
+    state = None
+    if args.resume:
+        state = resume_search(args, timeframe)
+        if state is None:
+            sys.exit(1)
+        outfile, reviewfile = state['outfile'], state['reviewfile']
+    elif not args.count:
         outfile, reviewfile = open_files(args, timeframe[0])
 
+    if args.checkpoint:
+        outputs = [outfile, reviewfile] if not args.count and not args.reservoir_size else []
+        checkpoints = checkpoint.Checkpoints(checkpoint.checkpoint_dir(args.output), args.checkpoint_interval * 60,
+                                             base={'fingerprint': checkpoint.search_fingerprint(args, timeframe),
+                                                   'outfile': outfile if not args.count else None, 'reviewfile': reviewfile if not args.count else None},
+                                             outputs=outputs, generation=state['generation'] if state else 0)
+    timeframe = timeframe[len(completed_months):]
+    setup_progress(args, timeframe)
+    if search_profile is not None:
+        search_profile.start()
+
     if args.count:
         process_count_mode(args, timeframe)
     elif args.reservoir_size is not None:
-        outfile, reviewfile = open_files(args, timeframe[0])
         process_reservoir_sampling(args, timeframe, outfile, reviewfile)
     else:
         process_timeframe(args, timeframe, outfile, reviewfile)
+        close_writer(outfile)
+        handle_review_stub(reviewfile)
 
     if not args.count and args.no_cleanup is None and args.reservoir_size is None:
-        cleanup(args.output, extraction_name=assemble_outfile_name(args, month=None))
+        cleanup(args.output, extraction_name=assemble_outfile_name(args, month=None), workers=args.workers)
 
     write_final_stats(args)
+    if search_progress is not None:
+        search_progress.finish()
+    if search_profile is not None:
+        search_profile.stop()
+        search_profile.write(args.output or os.getcwd(), [name for name in ['prefilter'] + args.criteria.names() if name in search_profile.criteria])
+    if checkpoints is not None:
+        checkpoints.remove()
     
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+'''
+metrics: Progress and throughput of a running search and the time it spends in each stage, reported to the log
+and, as one JSON object per report, to a metrics file at regular intervals and after each month.
+The progress within a month is the position in its compressed dump, so the ETA of the month and of the whole timeframe
+are estimated from the compressed bytes read per second.
+'''
+
+import os
+import json
+import time
+import datetime
+
+import logging
+logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+
+
+STAGES = ('decompress', 'decode', 'relevance', 'spacy', 'write')
+METRICS_FILE = 'otacon_metrics.jsonl'
+
+
+class StageClock:
+    """
+    Attributes the time of a search to the stage it is in. switch() starts a stage and ends the one before it,
+    so every stretch of time counts exactly once. Time spent in no stage, e.g. waiting for worker processes, counts for none.
+    """
+
+    def __init__(self):
+        self.times = dict.fromkeys(STAGES, 0.0)
+        self.stage = None
+        self.since = time.perf_counter()
+
+    def switch(self, stage: str) -> str:
+        """Start the given stage (or none), returning the one that ended."""
+        now = time.perf_counter()
+        if self.stage is not None:
+            self.times[self.stage] += now - self.since
+        previous, self.stage, self.since = self.stage, stage, now
+        return previous
+
+    def take(self) -> dict:
+        """Return the times so far and start again from zero, e.g. to pass the times of a worker process on."""
+        self.switch(None)
+        times, self.times = self.times, dict.fromkeys(STAGES, 0.0)
+        return times
+
+    def add(self, times: dict):
+        for stage, seconds in times.items():
+            if seconds:
+                self.times[stage] += seconds
+
+    def spent(self, stage: str, seconds: float, concurrent: bool = False):
+        """
+        Attribute seconds to a stage without switching to it, e.g. the decompression of a chunk in the middle of the relevance checks.
+        Unless they were spent concurrently, in another thread, they no longer count for the stage the clock is in.
+        """
+        self.times[stage] += seconds
+        if not concurrent:
+            self.since += seconds
+
+
+def input_size(path: str) -> int:
+    """The size of a month's dump, or of all files of a month in a columnar store."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
+
+def duration(seconds: float) -> str:
+    return str(datetime.timedelta(seconds=round(seconds))) if seconds is not None else 'unknown'
+
+
+class Progress:
+    """
+    Keeps track of the progress of a search through the given months (paths of their dumps) and reports it every interval seconds.
+    The position in the current month and the lines are updated by the reader of its dump after each chunk (see read()),
+    so keeping track of them costs nothing per line.
+    """
+
+    def __init__(self, months: list, interval: float, clock: StageClock, path: str = None):
+        self.sizes = {os.path.basename(month): input_size(month) for month in months}
+        self.total = sum(self.sizes.values())
+        self.interval = interval
+        self.clock = clock
+        self.path = path
+        self.done = 0 # the compressed bytes of the completed months
+        self.lines, self.hits = 0, 0
+        self.month, self.position = None, 0
+        self.month_lines, self.month_start = 0, None
+        self.concurrent = False
+        self.start = time.monotonic()
+        self.next_report = self.start + interval
+
+    def start_month(self, month: str, position: int = 0, concurrent: bool = False):
+        """Start a month. If concurrent, its dump is read in another thread than the one the clock runs in (see --line_workers)."""
+        self.month, self.position, self.concurrent = month, position, concurrent
+        self.month_lines, self.month_start, self.month_position = 0, time.monotonic(), position
+
+    def read(self, position: int, lines: int, seconds: float):
+        """Called by the reader of a dump after each chunk, with its position in the compressed file, its lines and the seconds it took."""
+        self.position = position
+        self.lines += lines
+        self.month_lines += lines
+        self.clock.spent('decompress', seconds, self.concurrent)
+        if time.monotonic() >= self.next_report:
+            self.report()
+
+    def merged(self, lines: int, times: dict):
+        """Count the lines of a month that was searched in another process or answered by the result cache, and the time spent in each stage."""
+        self.lines += lines
+        self.clock.add(times)
+
+    def end_month(self, month: str):
+        """Count a completed month and report."""
+        self.done += self.sizes.get(month, 0)
+        self.month, self.position = None, 0
+        self.report(event='month', completed=month)
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        elapsed = now - self.start
+        read = self.done + self.position
+        rate = read / elapsed if elapsed > 0 else 0.0
+        month_size = self.sizes.get(self.month, 0)
+        month_elapsed = now - self.month_start if self.month is not None else 0
+        month_rate = (self.position - self.month_position) / month_elapsed if month_elapsed > 0 else 0.0
+        return {
+            'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'elapsed': round(elapsed, 3),
+            'month': self.month,
+            'month_fraction': round(self.position / month_size, 4) if self.month is not None and month_size else None,
+            'compressed_bytes': read,
+            'compressed_bytes_per_sec': round(rate),
+            'lines': self.lines,
+            'lines_per_sec': round(self.lines / elapsed) if elapsed > 0 else 0,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.lines if self.lines else None,
+            'eta_month': round((month_size - self.position) / month_rate) if self.month is not None and month_rate > 0 else None,
+            'eta_total': round((self.total - read) / rate) if rate > 0 else None,
+            'stage_seconds': {stage: round(seconds, 3) for stage, seconds in self.clock.times.items()},
+        }
+
+    def report(self, event: str = 'progress', **extra):
+        """Log the metrics and append them to the metrics file."""
+        metrics = dict(self.metrics(), event=event, **extra)
+        stage_total = sum(metrics['stage_seconds'].values())
+        stages = ', '.join(f"{stage} {seconds / stage_total:.0%}" for stage, seconds in metrics['stage_seconds'].items() if seconds) if stage_total else 'none'
+        hit_rate = f"{metrics['hit_rate']:.2%}" if metrics['hit_rate'] is not None else 'hit rate unknown'
+        where = f"{metrics['month']} {metrics['month_fraction']:.1%}, " if metrics['month_fraction'] is not None else f"{extra['completed']} done, " if 'completed' in extra else ''
+        logging.info(f"Progress: {where}{metrics['compressed_bytes'] / self.total if self.total else 0:.1%} of the timeframe, "
+                     f"{metrics['compressed_bytes_per_sec'] / 2**20:.1f} MiB/s compressed, {metrics['lines_per_sec']:,} lines/s, "
+                     f"{metrics['hits']:,} hits ({hit_rate}), "
+                     + (f"ETA month {duration(metrics['eta_month'])}, " if metrics['month'] is not None else '')
+                     + f"ETA total {duration(metrics['eta_total'])}; time spent in {stages}")
+        if self.path is not None:
+            with open(self.path, 'a') as f:
+                _=f.write(json.dumps(metrics) + '\n')
+        self.next_report = time.monotonic() + self.interval
+
+    def finish(self):
+        self.report(event='end')
@@ -0,0 +1,87 @@
+'''
+pos_tagging: The part of --spacy-search that needs spaCy. The model is loaded with only the pipeline components the POS tags
+depend on, texts are tagged in batches with nlp.pipe() and the results are cached by the hash of the text,
+so that duplicated or reposted texts are only tagged once.
+'''
+
+import hashlib
+from collections import OrderedDict
+
+import logging
+logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+
+
+# the components that token.pos_ depends on (the attribute ruler maps the tagger's fine-grained tags to POS tags in some models)
+POS_COMPONENTS = ('tok2vec', 'transformer', 'tagger', 'morphologizer', 'attribute_ruler')
+# the number of texts whose results are cached
+CACHE_SIZE = 2**18
+# how many batches per process are tagged with a single call of nlp.pipe(), which starts its processes anew with each call
+BATCHES_PER_PROCESS = 16
+
+
+def load_model(language: str):
+    """Load a spaCy model, disabling the components that are not needed for POS tagging, such as the parser and NER."""
+    logging.info("Importing spacy…")
+    import spacy
+    logging.info(f"Importing {language} model…")
+    nlp = spacy.load(language)
+    disabled = [name for name in nlp.pipe_names if name not in POS_COMPONENTS]
+    for name in disabled:
+        nlp.disable_pipe(name)
+    if disabled:
+        logging.info(f"Disabled the components {', '.join(disabled)} of the model.")
+    return nlp
+
+
+def text_key(text: str) -> bytes:
+    """The key of a text in the cache: a 128-bit hash, which is much smaller than most texts."""
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+class PosSearch:
+    """
+    Finds the texts that contain a token with a given POS tag (compared case-insensitively, like the token itself).
+    Texts are tagged batch_size at a time, by the given number of processes.
+    """
+
+    def __init__(self, nlp, token: str, pos: str, batch_size: int = 64, processes: int = 1, cache_size: int = CACHE_SIZE):
+        self.nlp = nlp
+        self.token = token.lower()
+        self.pos = pos
+        self.batch_size = batch_size
+        self.processes = processes
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    @property
+    def pending_size(self) -> int:
+        """How many texts are best collected before they are passed to find()."""
+        return self.batch_size * self.processes * BATCHES_PER_PROCESS
+
+    def contains(self, doc) -> bool:
+        return any(token.pos_ == self.pos and token.text.lower() == self.token for token in doc)
+
+    def find(self, texts: list) -> list:
+        """Return for each text whether it contains the token with the POS tag, in the order of the texts."""
+        keys = [text_key(text) for text in texts]
+        results, untagged = {}, {}
+        for key, text in zip(keys, texts):
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                results[key] = self.cache[key]
+            else:
+                untagged[key] = text # texts that occur more than once are only tagged once
+
+        if untagged:
+            processes = self.processes if len(untagged) > self.batch_size else 1
+            docs = self.nlp.pipe(untagged.values(), batch_size=self.batch_size, n_process=processes)
+            for key, doc in zip(untagged, docs):
+                results[key] = self.cache[key] = self.contains(doc)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return [results[key] for key in keys]
+
+    def __getstate__(self):
+        # worker processes start with an empty cache
+        return dict(self.__dict__, cache=OrderedDict())
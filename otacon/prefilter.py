@@ -0,0 +1,273 @@
+'''
+prefilter: Cheap tests on the raw JSON lines of the dumps that reject lines which cannot possibly be relevant.
+The tests run on the undecoded bytes. Only lines that pass are decoded and handed to relevant(), so a prefilter must never reject a relevant line.
+The literals required by a regex also serve to skip texts the regex cannot match before running it (see text_prefilter()).
+'''
+
+import re
+import string
+import argparse
+
+try:
+    import re._parser as sre_parse
+    from re._constants import LITERAL, IN, BRANCH, SUBPATTERN, MAX_REPEAT, MIN_REPEAT, POSSESSIVE_REPEAT, ATOMIC_GROUP
+except ImportError: # Python < 3.11
+    import sre_parse
+    from sre_constants import LITERAL, IN, BRANCH, SUBPATTERN, MAX_REPEAT, MIN_REPEAT
+    POSSESSIVE_REPEAT, ATOMIC_GROUP = None, None
+
+# optional, for scanning texts for many literals at once
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+import logging
+logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+
+
+# characters that are never escaped in JSON and can therefore be searched for in the raw line as they are
+SAFE_CHARS = set(string.ascii_letters + string.digits + " '-_.,!?:;#*+=%@~()[]{}|$^`")
+
+# ASCII letters that case-insensitively also match a non-ASCII character, which the bytes patterns would miss
+UNICODE_FOLDING_CHARS = set('iksIKS')
+# the forms these non-ASCII characters can take in the raw line: \u-escaped or UTF-8 encoded
+UNICODE_FOLDING_SEQUENCES = [b'\\u'] + [char.encode() for char in '\u0130\u0131\u212a\u017f']
+
+# Reddit user and subreddit names only consist of these characters
+NAME_PATTERN = re.compile(r'^[\w-]+$', re.ASCII)
+
+# the shortest literal worth searching for
+MIN_LITERAL_LENGTH = 2
+
+# the most alternatives a run of literals is expanded into, e.g. 'colou?r' into 'colour' and 'color'
+MAX_ALTERNATIVES = 64
+
+# shorter literals are in almost every text, so texts are not scanned for them
+MIN_TEXT_LITERAL_LENGTH = 3
+
+# texts are scanned with an Aho–Corasick automaton (if installed) from this number of literals on
+MIN_AUTOMATON_LITERALS = 8
+
+
+def required_literals(regex: re.Pattern, safe: set = SAFE_CHARS) -> list:
+    """
+    Find literals of which at least one must occur in every text the regex matches, made up of the given characters (any if safe is None).
+    Returns a list of alternative strings, or None if no useful literal could be found.
+    """
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except Exception: # the pattern compiled, so this only happens with parser changes across Python versions
+        return None
+    literals = sequence_literals(list(parsed), safe)
+    if literals is None or min(len(lit) for lit in literals) < MIN_LITERAL_LENGTH:
+        return None
+    return literals
+
+
+def item_strings(op, av, safe: set) -> list:
+    """
+    The strings a single regex item matches if they are few and made up of safe characters, e.g. ['u', ''] for 'u?'
+    or ['i', 'y', 'm'] for '[iym]'. Returns None for any other item.
+    """
+    if op is LITERAL:
+        strings = [chr(av)]
+    elif op is IN and all(item_op is LITERAL for item_op, _ in av):
+        strings = [chr(char) for _, char in av]
+    elif op is SUBPATTERN:
+        return sequence_strings(list(av[-1]), safe)
+    elif op is BRANCH:
+        strings = []
+        for branch in av[1]:
+            branch_strings = sequence_strings(list(branch), safe)
+            if branch_strings is None:
+                return None
+            strings += branch_strings
+    elif op in (MAX_REPEAT, MIN_REPEAT, POSSESSIVE_REPEAT) and av[1] == 1:
+        strings = sequence_strings(list(av[2]), safe)
+        if strings is not None and av[0] == 0:
+            strings = [''] + strings
+    else:
+        return None
+    if strings is None or len(strings) > MAX_ALTERNATIVES or (safe is not None and not all(set(string) <= safe for string in strings)):
+        return None
+    return list(dict.fromkeys(strings))
+
+
+def sequence_strings(items: list, safe: set) -> list:
+    """The strings a regex sequence matches if they are few and made up of safe characters, otherwise None."""
+    strings = ['']
+    for op, av in items:
+        alternatives = item_strings(op, av, safe)
+        if alternatives is None or len(strings) * len(alternatives) > MAX_ALTERNATIVES:
+            return None
+        strings = [string + alternative for string in strings for alternative in alternatives]
+    return strings
+
+
+def minimal_alternatives(literals: list) -> list:
+    """Leave out the alternatives that contain another one, as a text that contains them also contains the other."""
+    minimal = []
+    for lit in sorted(set(literals), key=len):
+        if not any(shorter in lit for shorter in minimal):
+            minimal.append(lit)
+    return [lit for lit in dict.fromkeys(literals) if lit in minimal]
+
+
+def sequence_literals(items: list, safe: set = SAFE_CHARS) -> list:
+    """
+    Choose the most selective requirement among the literal runs and required subpatterns of a regex sequence.
+    Runs include the few strings of optional parts, small character sets and alternations of literals, e.g. 'the(?:y|m)' gives 'they' or 'them'.
+    """
+    candidates = []
+    run = ['']
+    for op, av in items:
+        alternatives = item_strings(op, av, safe)
+        if alternatives is not None and len(run) * len(alternatives) <= MAX_ALTERNATIVES:
+            run = [string + alternative for string in run for alternative in alternatives]
+            continue
+        candidates.append(run)
+        run = ['']
+        if alternatives is not None: # too many alternatives together with the run so far
+            run = alternatives
+        elif op is SUBPATTERN:
+            candidates.append(sequence_literals(list(av[-1]), safe))
+        elif ATOMIC_GROUP is not None and op is ATOMIC_GROUP:
+            candidates.append(sequence_literals(list(av), safe))
+        elif op in (MAX_REPEAT, MIN_REPEAT, POSSESSIVE_REPEAT) and av[0] >= 1:
+            candidates.append(sequence_literals(list(av[2]), safe))
+        elif op is BRANCH:
+            branches = [sequence_literals(list(branch), safe) for branch in av[1]]
+            if all(branch is not None for branch in branches):
+                candidates.append([lit for branch in branches for lit in branch])
+    candidates.append(run)
+
+    # a run that can be empty requires nothing
+    candidates = [minimal_alternatives(candidate) for candidate in candidates if candidate and all(candidate)]
+    if not candidates:
+        return None
+    # prefer long literals and few alternatives
+    return max(candidates, key=lambda candidate: (min(len(lit) for lit in candidate), -len(candidate)))
+
+
+def ignores_case(regex: re.Pattern) -> bool:
+    """Test if a regex matches case-insensitively anywhere, including scoped flags like (?i:…)."""
+    return bool(regex.flags & re.IGNORECASE) or re.search(r'\(\?[a-zA-Z]*i[a-zA-Z]*[:)]', regex.pattern) is not None
+
+
+class Prefilter:
+    """A conjunction of raw-line tests compiled from the search arguments. Called on a raw line, it returns False if the line cannot be relevant."""
+
+    def __init__(self):
+        self.substrings = [] # lists of alternative literals, searched case-sensitively
+        self.patterns = [] # (bytes regex, whether lines with non-ASCII case variants pass as well)
+
+    def add_literals(self, literals: list, case_insensitive: bool):
+        """Require one of the literals to be present in the line."""
+        literals = [lit.encode() for lit in literals]
+        if case_insensitive:
+            folding = any(UNICODE_FOLDING_CHARS.intersection(lit.decode()) for lit in literals)
+            self.patterns.append((re.compile(b'|'.join(re.escape(lit) for lit in literals), re.IGNORECASE), folding))
+        else:
+            self.substrings.append(literals)
+
+    def add_pattern(self, pattern: re.Pattern):
+        """Require a bytes regex to match the line."""
+        self.patterns.append((pattern, False))
+
+    def __bool__(self):
+        return bool(self.substrings or self.patterns)
+
+    def __call__(self, line: bytes) -> bool:
+        for literals in self.substrings:
+            if not any(lit in line for lit in literals):
+                return False
+        for pattern, folding in self.patterns:
+            if not pattern.search(line) and not (folding and any(seq in line for seq in UNICODE_FOLDING_SEQUENCES)):
+                return False
+        return True
+
+
+# non-ASCII characters that match an ASCII letter case-insensitively but are not lower-cased to it, see LiteralScan
+CASE_FOLDING = str.maketrans({'\u0130': 'i', '\u0131': 'i', '\u017f': 's', '\u212a': 'k'})
+
+
+class LiteralScan:
+    """
+    Tests if a text contains one of several literals, in a single pass with an Aho–Corasick automaton if pyahocorasick is installed
+    and there are many literals. Case-insensitive literals are searched in the lower-cased text. Non-ASCII characters with case variants
+    in the literals have more case-insensitive matches than their lower-cased form, so non-ASCII texts always pass then.
+    """
+
+    def __init__(self, literals: list, case_insensitive: bool):
+        self.case_insensitive = case_insensitive
+        if case_insensitive:
+            literals = [lit.translate(CASE_FOLDING).lower() for lit in literals]
+        self.literals = sorted(minimal_alternatives(literals), key=len)
+        self.non_ascii_passes = case_insensitive and any(not char.isascii() and char.lower() != char.upper() for lit in self.literals for char in lit)
+        self.automaton = None
+        if ahocorasick is not None and len(self.literals) >= MIN_AUTOMATON_LITERALS:
+            self.automaton = ahocorasick.Automaton()
+            for lit in self.literals:
+                self.automaton.add_word(lit, lit)
+            self.automaton.make_automaton()
+
+    def __call__(self, text: str) -> bool:
+        if self.case_insensitive:
+            if not text.isascii():
+                if self.non_ascii_passes:
+                    return True
+                text = text.translate(CASE_FOLDING)
+            text = text.lower()
+        if self.automaton is not None:
+            return next(self.automaton.iter(text), None) is not None
+        return any(lit in text for lit in self.literals)
+
+
+# the text prefilters of the regexes used so far, by id (see text_prefilter())
+text_prefilters = {}
+
+
+def text_prefilter(regex: re.Pattern) -> LiteralScan:
+    """
+    The test for the literals that every match of a regex contains, to skip texts the regex cannot match without running it.
+    Returns None if the regex has no such literals.
+    """
+    entry = text_prefilters.get(id(regex))
+    if entry is None or entry[0] is not regex:
+        literals = required_literals(regex, safe=None)
+        if literals is not None and min(len(lit) for lit in literals) < MIN_TEXT_LITERAL_LENGTH:
+            literals = None
+        entry = (regex, LiteralScan(literals, ignores_case(regex)) if literals is not None else None)
+        text_prefilters[id(regex)] = entry
+    return entry[1]
+
+
+def compile_prefilter(args: argparse.Namespace) -> Prefilter:
+    """Compile the raw-line tests that follow from the search arguments. Returns None if there are none."""
+    prefilter = Prefilter()
+
+    # the subreddit or user name must be the value of the respective key
+    if args.name is not None and all(NAME_PATTERN.search(name) for name in args.name):
+        src = 'author' if args.src == 'user' else 'subreddit'
+        names = '|'.join(re.escape(name) for name in sorted(args.name))
+        names = f'(?:{names})' if args.case_sensitive else f'(?i:{names})'
+        prefilter.add_pattern(re.compile(f'"{src}"\\s*:\\s*"{names}"'.encode()))
+
+    # literals required by the regexes
+    regex = args.commentregex if args.searchmode == 'comms' else args.postregex
+    for rgx in [regex, args.titleregex, args.flairregex, args.userregex]:
+        if rgx is None:
+            continue
+        literals = required_literals(rgx)
+        if literals is not None:
+            prefilter.add_literals(literals, ignores_case(rgx))
+
+    # the token of a spacy search must literally be in the text
+    if args.spacy_search and set(args.spacy_search[0]) <= SAFE_CHARS:
+        prefilter.add_literals([args.spacy_search[0]], case_insensitive=False)
+
+    if not prefilter:
+        return None
+    logging.info(f"Prefiltering raw lines for {len(prefilter.substrings) + len(prefilter.patterns)} required pattern(s).")
+    return prefilter
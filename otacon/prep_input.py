@@ -10,9 +10,9 @@ def fetch_data_timeframe(input_dir: str) -> tuple:
     Establish a timeframe based on all directories found in the input directory.
     Used when no timeframe was given by user.
     """
-    months = [elem.replace("RC_", "") for elem in os.listdir(input_dir) if not elem.endswith(".txt")]
+    months = [elem.replace("RC_", "") for elem in os.listdir(input_dir) if elem.startswith("RC") or elem.startswith("RS")]
     months = [elem.replace("RS_", "") for elem in months]
-    months = [elem.replace(".zst", "") for elem in months if elem.endswith('.zst')]
+    months = [re.sub(r'\.\w+$', '', elem) for elem in months] # remove file ending (the months of a columnar store have none)
 
     months = sorted(months)
     months = [(int(elem.split("-")[0]), int(elem.split("-")[1])) for elem in months]
@@ -1,9 +1,9 @@
-import csv
 from datetime import datetime
 import argparse
-from typing import TextIO
 from pathvalidate import sanitize_filename
 
+from otacon import writers
+
 
 def assemble_outfile_name(args: argparse.Namespace, month) -> str:
     """
@@ -43,23 +43,33 @@ def assemble_outfile_name(args: argparse.Namespace, month) -> str:
     # specify the month of the reddit data
     outfile_name = outfile_name + "_" + month if month is not None else outfile_name
     # add file ending
-    outfile_name += ".csv" if not args.return_all else ".jsonl"
+    outfile_name += "." + args.output_format
 
     return outfile_name
 
 
-def write_csv_headers(outfile_path: str, reviewfile_path: TextIO, args: argparse.Namespace):
-    """Write the headers for both the results file and the file for filtered-out hits."""
-    with open(outfile_path, 'a', encoding='utf-8') as outf, open(reviewfile_path, "a", encoding='utf-8') as reviewf:
-        headers = ["type", "year", "month", 'id', 'text', 'span', 'matched', 'subreddit', 'score', 'user', 'flairtext', 'timestamp_utc', 'permalink']
+def output_headers(args: argparse.Namespace, review: bool = False) -> list:
+    """The headers of the results file or of the file for filtered-out hits, None with --return_all, which writes the entries as they are."""
+    if args.return_all:
+        return None
+    headers = ["type", "year", "month", 'id', 'text', 'span', 'matched', 'subreddit', 'score', 'user', 'flairtext', 'timestamp_utc', 'permalink']
+    if not args.commentregex:
+        headers.remove('span')
+        headers.remove('matched')
+    if review:
+        headers.append('filter reason')
+    return headers
 
-        if not args.commentregex:
-            headers.remove('span')
-            headers.remove('matched')
 
-        csvwriter = csv.writer(outf, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        csvwriter.writerow(headers)
+def open_output(path: str, args: argparse.Namespace, review: bool = False):
+    """Return the writer of the results file or of the file for filtered-out hits, opening it if it is not open yet."""
+    return writers.open_writer(path, output_headers(args, review))
 
-        headers.append('filter reason')
-        csvwriter = csv.writer(reviewf, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        csvwriter.writerow(headers)
\ No newline at end of file
+
+def write_csv_headers(outfile_path: str, reviewfile_path: str, args: argparse.Namespace):
+    """
+    Open the results file and the file for filtered-out hits, which writes their headers: the header row of a CSV file
+    or the schema of a Parquet file. JSON lines have no header, the headers are the keys of each line instead.
+    """
+    open_output(outfile_path, args)
+    open_output(reviewfile_path, args, review=True)
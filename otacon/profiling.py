@@ -0,0 +1,142 @@
+'''
+profiling: Profile a search through its real code path (see --profile), over the whole timeframe or only its first lines.
+Writes the functions the time is spent in, sorted by their own and by their cumulative time (PROFILE_REPORT, and the raw
+profile to PROFILE_DATA for tools like snakeviz), the sampled call stacks in the collapsed format that flamegraph.pl,
+speedscope and inferno read (PROFILE_STACKS), and how many entries each search criterion rejected and how long it took.
+'''
+
+import os
+import io
+import time
+import signal
+import pstats
+import cProfile
+from collections import Counter
+
+import logging
+logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+
+
+PROFILE_REPORT = 'otacon_profile.txt'
+PROFILE_DATA = 'otacon_profile.pstats'
+PROFILE_STACKS = 'otacon_profile.collapsed'
+# seconds of CPU time between two samples of the call stack
+SAMPLE_INTERVAL = 0.001
+# the number of functions listed per sort order
+REPORT_FUNCTIONS = 40
+
+
+class StackSampler:
+    """
+    Samples the call stack of the main thread every interval seconds of CPU time and counts how often each stack was seen.
+    Time spent in C code, e.g. in the regex engine or the decompressor, counts for the Python function that called it.
+    Only available where there are CPU time timers (not on Windows).
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.available = hasattr(signal, 'setitimer')
+
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        if self.available:
+            signal.signal(signal.SIGPROF, self.sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        if self.available:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def write(self, path: str):
+        """Write the stacks in the collapsed format, one stack with its frames separated by semicolons and its count per line."""
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                _=f.write(f"{stack} {count}\n")
+
+
+class SearchProfile:
+    """
+    Profiles a search with cProfile and a StackSampler between start() and stop(). If lines is given, only that many lines
+    of the data are searched (see sliced()). The search criteria wrapped with timed() count their checks, rejections and time.
+    """
+
+    def __init__(self, lines: int = None):
+        self.lines = lines
+        self.remaining = lines
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler()
+        self.criteria = {} # name: [checked, rejected, seconds]
+        self.seconds = 0.0
+
+    def timed(self, name: str, check):
+        """Wrap a check that returns whether an entry (or line) passes, counting how often it rejects and the time it takes."""
+        stats = self.criteria.setdefault(name, [0, 0, 0.0])
+        def timed_check(*args):
+            start = time.perf_counter()
+            passed = check(*args)
+            stats[2] += time.perf_counter() - start
+            stats[0] += 1
+            if not passed:
+                stats[1] += 1
+            return passed
+        return timed_check
+
+    def sliced(self, lines):
+        """Hand on the lines of a month as long as the slice of the search is not used up."""
+        if self.remaining is None:
+            yield from lines
+            return
+        if self.remaining <= 0:
+            return
+        for item in lines:
+            self.remaining -= 1
+            yield item
+            if self.remaining <= 0:
+                return
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.sampler.start()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.sampler.stop()
+        self.seconds += time.perf_counter() - self.start_time
+
+    def criteria_table(self, order: list = None) -> str:
+        """The counts and times of the search criteria, in the given order of their names."""
+        lines = [f"{'criterion':<16}{'checked':>12}{'rejected':>12}{'rejection rate':>16}{'seconds':>10}{'µs per check':>14}"]
+        for name in order or self.criteria:
+            checked, rejected, seconds = self.criteria[name]
+            lines.append(f"{name:<16}{checked:>12,}{rejected:>12,}{rejected / checked if checked else 0:>16.2%}{seconds:>10.3f}{seconds / checked * 1e6 if checked else 0:>14.2f}")
+        return '\n'.join(lines)
+
+    def write(self, directory: str, order: list = None):
+        """Write the reports to the directory and log the rejections of the search criteria, listed in the order they are tested in."""
+        searched = f"the first {self.lines - self.remaining:,} lines of the data" if self.lines is not None else "the whole search"
+        report = io.StringIO()
+        _=report.write(f"Profile of {searched}, {self.seconds:.2f} seconds (with the overhead of profiling).\n\n")
+        _=report.write("Search criteria in the order they were tested in the end (each one only sees the entries the ones before it passed):\n")
+        _=report.write(self.criteria_table(order) + "\n\n")
+        for sort, title in [('tottime', 'own time'), ('cumulative', 'cumulative time')]:
+            _=report.write(f"Functions by {title}:\n")
+            pstats.Stats(self.profile, stream=report).sort_stats(sort).print_stats(REPORT_FUNCTIONS)
+        with open(os.path.join(directory, PROFILE_REPORT), 'w') as f:
+            _=f.write(report.getvalue())
+        self.profile.dump_stats(os.path.join(directory, PROFILE_DATA))
+        if self.sampler.available:
+            self.sampler.write(os.path.join(directory, PROFILE_STACKS))
+        else:
+            logging.warning("The call stacks cannot be sampled on this platform, so there is no stack dump for a flamegraph.")
+        logging.info(f"Profiled {searched} in {self.seconds:.2f} seconds. Rejections by the search criteria:\n{self.criteria_table(order)}")
+        logging.info(f"Wrote the profile to {os.path.join(directory, PROFILE_REPORT)}.")
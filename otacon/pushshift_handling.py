@@ -1,58 +1,400 @@
 '''These are taken from Pushshift collaborator Watchful1. See README for GitHub link.'''
 
+import os
 import json
+import time
+import queue
+import struct
+import threading
+from bisect import bisect_right
 from zstandard import ZstdDecompressor
 
+# optional JSON decoders that are faster than the standard library
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 import logging
 logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
 
-def read_redditfile(file: str) -> dict:
+# size of the chunks that are decompressed at once
+CHUNK_SIZE = 2**24
+# the number of lines of an uncompressed file that count as a chunk
+PLAIN_CHUNK_LINES = 2**16
+# the number of chunks decompressed ahead of the lines being read, and the bytes of the next file read ahead of time (see ReadAhead)
+READ_AHEAD = 2
+PREFETCH_SIZE = 2**26
+# the compressed bytes read at once by the background thread, in few large reads, as it has to wait for the GIL after each of them
+READ_AHEAD_SIZE = 2**20
+
+# the dumps that were opened ahead of time, by path (see open_ahead())
+opened_ahead = {}
+
+# dumps converted with the convert command end in a skippable zstd frame holding the frame table,
+# followed by the table's length and this marker
+FRAME_TABLE_MARKER = b'OTACON-FRAMES-V1'
+FRAME_TABLE_FOOTER = struct.Struct('<I16s')
+SKIPPABLE_FRAME_MAGIC = 0x184D2A5E
+
+
+def read_redditfile(file: str, start_frame: int = 0) -> dict:
     """
     Iterate over the pushshift JSON lines, yielding them as Python dicts.
     Decompress iteratively if necessary.
+    Dumps converted into independent frames can be read starting at any frame.
+    """
+    for line in read_lines(file, start_frame=start_frame):
+        comment_or_post = parse_line(line, file)
+        if comment_or_post is not None:
+            yield comment_or_post
+
+
+def read_lines(file: str, chunk_size: int = CHUNK_SIZE, start_frame: int = 0) -> bytes:
+    """Iterate over the raw pushshift JSON lines of a file as bytes, decompressing iteratively if necessary."""
+    for line, offset in read_lines_with_offsets(file, chunk_size, start_frame):
+        yield line
+
+
+def read_lines_with_offsets(file: str, chunk_size: int = CHUNK_SIZE, start_frame: int = 0, start_offset: int = 0, on_chunk=None, read_ahead: int = 0, next_file: str = None) -> tuple:
+    """
+    Iterate over the raw lines of a file as bytes together with their byte offset in the (decompressed) data.
+    Reading can only start at a later frame in dumps converted into independent frames.
+    Reading can start at the line at any byte offset in any file, but a zstd stream is decompressed up to it.
+    If given, on_chunk is called whenever another chunk of the file was read, with the position in the (compressed) file,
+    the number of lines in the chunk and the seconds it took to read and decompress, e.g. to report progress.
+    A zstd stream can be decompressed read_ahead chunks ahead in the background, opening next_file ahead of time (see read_lines_zst()).
     """
     # older files in the dataset are uncompressed while newer ones use zstd compression and have .xz, .bz2, or .zst endings
     if not file.endswith('.bz2') and not file.endswith('.xz') and not file.endswith('.zst'):
-        with open(file, 'r', encoding='utf-8') as infile:
-            for line in infile:
-                l = json.loads(line)
-                yield(l)
+        frames = None
     else:
-        for comment_or_post, some_int in read_lines_zst(file):
-            try:
-                yield json.loads(comment_or_post)
-            except json.decoder.JSONDecodeError:
-                print(f"Encountered a ZST parsing error in {file}")
-                pass
-
-def read_and_decode(reader, chunk_size, max_window_size, previous_chunk=None, bytes_read=0):
-	chunk = reader.read(chunk_size)
-	bytes_read += chunk_size
-	if previous_chunk is not None:
-		chunk = previous_chunk + chunk
-	try:
-		return chunk.decode()
-	except UnicodeDecodeError:
-		if bytes_read > max_window_size:
-			raise UnicodeError(f"Unable to decode frame after reading {bytes_read:,} bytes")
-		logging.info(f"Decoding error with {bytes_read:,} bytes, reading another chunk")
-		return read_and_decode(reader, chunk_size, max_window_size, chunk, bytes_read)
-
-
-def read_lines_zst(file_name):
-	with open(file_name, 'rb') as file_handle:
-		buffer = ''
-		reader = ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle)
+        frames = read_frame_table(file)
+    if start_frame and frames is None:
+        raise ValueError(f"{file} is not divided into frames, so it can only be read from the start. Convert it with the convert command.")
+
+    if frames is not None:
+        start_frame = max(start_frame, bisect_right([frame['data_offset'] for frame in frames], start_offset) - 1)
+        for line, offset in read_lines_framed(file, frames, start_frame, on_chunk):
+            if offset >= start_offset:
+                yield line, offset
+    elif not file.endswith('.bz2') and not file.endswith('.xz') and not file.endswith('.zst'):
+        with open_dump(file) as infile:
+            infile.seek(start_offset)
+            offset = start_offset
+            for number, line in enumerate(infile, 1):
+                yield line, offset
+                offset += len(line)
+                if on_chunk is not None and number % PLAIN_CHUNK_LINES == 0:
+                    on_chunk(offset, PLAIN_CHUNK_LINES, 0.0)
+    else:
+        yield from read_lines_zst(file, chunk_size, start_offset, on_chunk, read_ahead, next_file)
+
+
+def read_frame_table(file: str) -> list:
+    """
+    Read the frame table of a dump converted into independently decodable frames.
+    Each frame is described by a dict with its position and size in the file ('offset', 'size'),
+    its position and size in the decompressed data ('data_offset', 'data_size'), the number of lines
+    before it and in it ('first_line', 'lines'), and the range of 'created_utc' in it ('min_utc', 'max_utc').
+    Returns None for any other file.
+    """
+    with open(file, 'rb') as infile:
+        infile.seek(0, 2)
+        size = infile.tell()
+        if size < FRAME_TABLE_FOOTER.size:
+            return None
+        infile.seek(size - FRAME_TABLE_FOOTER.size)
+        length, marker = FRAME_TABLE_FOOTER.unpack(infile.read(FRAME_TABLE_FOOTER.size))
+        if marker != FRAME_TABLE_MARKER or length > size - FRAME_TABLE_FOOTER.size:
+            return None
+        infile.seek(size - FRAME_TABLE_FOOTER.size - length)
+        return json.loads(infile.read(length))['frames']
+
+
+def read_frame(file_handle, frame: dict) -> bytes:
+    """Decompress a single frame of a converted dump."""
+    file_handle.seek(frame['offset'])
+    return ZstdDecompressor(max_window_size=2**31).decompress(file_handle.read(frame['size']), max_output_size=frame['data_size'])
+
+
+def read_lines_framed(file: str, frames: list, start_frame: int = 0, on_chunk=None) -> tuple:
+    """Iterate over the raw lines and their offsets in a converted dump frame by frame, starting at the given frame (see read_lines_with_offsets() for on_chunk)."""
+    with open_dump(file) as file_handle:
+        for frame in frames[start_frame:]:
+            began = time.perf_counter()
+            data = read_frame(file_handle, frame)
+            if on_chunk is not None:
+                on_chunk(frame['offset'] + frame['size'], data.count(b'\n'), time.perf_counter() - began)
+            offset = frame['data_offset']
+            start = 0
+            while start < len(data):
+                end = data.find(b'\n', start)
+                if end == -1:
+                    end = len(data)
+                yield data[start:end], offset + start
+                start = end + 1
+
+
+def read_lines_at(file: str, offsets, chunk_size: int = 2**16) -> bytes:
+    """
+    Iterate over the raw lines starting at the given ascending byte offsets of the (decompressed) data.
+    Uncompressed files are seeked directly. In a converted dump, only the frames holding the lines are decompressed.
+    In a zstd stream, the data in between is decompressed but never split into lines or decoded.
+    """
+    if not file.endswith('.bz2') and not file.endswith('.xz') and not file.endswith('.zst'):
+        with open(file, 'rb') as infile:
+            for offset in offsets:
+                infile.seek(offset)
+                yield infile.readline()
+        return
+
+    frames = read_frame_table(file)
+    if frames is not None:
+        starts = [frame['data_offset'] for frame in frames]
+        with open(file, 'rb') as file_handle:
+            current, data = None, b''
+            for offset in offsets:
+                i = bisect_right(starts, offset) - 1
+                if i != current:
+                    current, data = i, read_frame(file_handle, frames[i])
+                start = offset - starts[i]
+                end = data.find(b'\n', start)
+                yield data[start:] if end == -1 else data[start:end]
+        return
+
+    with open(file, 'rb') as file_handle:
+        reader = ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle, read_across_frames=True)
+        position, pending = 0, b'' # pending: data that was read beyond the position
+        for offset in offsets:
+            if offset < position + len(pending):
+                pending = pending[offset - position:]
+            else:
+                reader.seek(offset)
+                pending = b''
+            position = offset
+            end = pending.find(b'\n')
+            while end == -1:
+                chunk = reader.read(chunk_size)
+                if not chunk:
+                    end = len(pending)
+                    break
+                searched = len(pending)
+                pending += chunk
+                end = pending.find(b'\n', searched)
+            yield pending[:end]
+        reader.close()
+
+
+def batch_lines(lines, batch_size: int) -> list:
+    """Group an iterable of raw lines into lists of batch_size lines."""
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def available_json_backends() -> list:
+    """List the installed JSON backends, fastest first."""
+    backends = []
+    if msgspec is not None:
+        backends.append('msgspec')
+    if orjson is not None:
+        backends.append('orjson')
+    return backends + ['json']
+
+
+# decoding functions per backend and field projection, built on first use
+decoders = {}
+
+
+def get_decoder(backend: str, fields: tuple = None):
+    """
+    Return a function that decodes a JSON line into a dict.
+    If fields are given, the dict only holds those of the fields that are present in the line.
+    With msgspec, the other fields are skipped without being decoded at all.
+    """
+    if (backend, fields) in decoders:
+        return decoders[(backend, fields)]
+
+    if backend == 'msgspec' and fields is not None:
+        record_type = msgspec.defstruct('Record', [(field, object, msgspec.UNSET) for field in fields])
+        decode_record = msgspec.json.Decoder(record_type).decode
+        astuple, unset = msgspec.structs.astuple, msgspec.UNSET
+        def decode(line):
+            return {field: value for field, value in zip(fields, astuple(decode_record(line))) if value is not unset}
+    else:
+        loads = {'msgspec': msgspec.json.Decoder().decode if msgspec else None, 'orjson': orjson.loads if orjson else None, 'json': json.loads}[backend]
+        if fields is None:
+            decode = loads
+        else:
+            def decode(line):
+                entry = loads(line)
+                return {field: entry[field] for field in fields if field in entry}
+
+    decoders[(backend, fields)] = decode
+    return decode
+
+
+def parse_line(line: bytes, file: str, fields: tuple = None, backend: str = 'json') -> dict:
+    """
+    Decode a single JSON line, returning None if it is corrupted.
+    If fields are given, only these are decoded (see get_decoder).
+    """
+    try:
+        return get_decoder(backend, fields)(line)
+    except ValueError:
+        # the faster backends reject some lines that the standard library accepts, e.g. with unpaired surrogates
+        # (orjson does not reject integers beyond 64 bits, it decodes them as floats, see --json_backend)
+        try:
+            return json.loads(line)
+        except ValueError: # also catches invalid UTF-8
+            print(f"Encountered a ZST parsing error in {file}")
+            return None
+
+
+def open_dump(file: str):
+	"""Open a dump for reading, taking the file object if it was opened ahead of time (see open_ahead())."""
+	file_handle = opened_ahead.pop(file, None)
+	return file_handle if file_handle is not None else open(file, 'rb')
+
+
+def open_ahead(file: str, size: int = PREFETCH_SIZE):
+	"""
+	Open a dump that is read next and read its first size bytes, so that they are in the page cache by the time it is read,
+	which saves waiting for slow disks and network storage. The open file is kept for the next open_dump() of the dump.
+	"""
+	file_handle = open(file, 'rb')
+	if hasattr(os, 'posix_fadvise'):
+		os.posix_fadvise(file_handle.fileno(), 0, size, os.POSIX_FADV_WILLNEED)
+	while size > 0:
+		block = file_handle.read(min(size, 2**20))
+		if not block:
+			break
+		size -= len(block)
+	file_handle.seek(0)
+	previous = opened_ahead.pop(file, None)
+	if previous is not None:
+		previous.close()
+	opened_ahead[file] = file_handle
+
+
+class ReadAhead:
+	"""
+	Decompresses a zstd stream in a background thread, up to depth chunks ahead of the chunk whose lines are being read.
+	zstandard releases the GIL while it reads and decompresses, so this overlaps with the decoding and searching of the lines.
+	When the stream is done, the next file is opened ahead of time (see open_ahead()). Iterating yields (chunk, its length,
+	the position in the compressed file, the seconds spent waiting for it), like the chunks read inline in read_lines_zst().
+	"""
+
+	def __init__(self, file_name: str, chunk_size: int, start_offset: int, depth: int, next_file: str = None):
+		self.chunks = queue.Queue(depth)
+		self.stopped = threading.Event()
+		self.thread = threading.Thread(target=self.run, args=(file_name, chunk_size, start_offset, next_file), daemon=True)
+		self.thread.start()
+
+	def run(self, file_name: str, chunk_size: int, start_offset: int, next_file: str):
+		try:
+			with open_dump(file_name) as file_handle:
+				reader = ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle, read_size=READ_AHEAD_SIZE, read_across_frames=True)
+				if start_offset:
+					reader.seek(start_offset)
+				while not self.stopped.is_set():
+					chunk = reader.read(chunk_size)
+					self.put((chunk, file_handle.tell()))
+					if not chunk:
+						break
+				reader.close()
+			if next_file is not None and not self.stopped.is_set():
+				open_ahead(next_file)
+		except Exception as error: # raised in the reading thread instead
+			self.put((error, None))
+
+	def put(self, item: tuple):
+		"""Queue an item, unless reading was stopped in the meantime."""
+		while not self.stopped.is_set():
+			try:
+				self.chunks.put(item, timeout=0.1)
+				return
+			except queue.Full:
+				pass
+
+	def __iter__(self):
 		while True:
-			chunk = read_and_decode(reader, 2**27, (2**29) * 2)
-			
+			began = time.perf_counter()
+			chunk, position = self.chunks.get()
+			if isinstance(chunk, Exception):
+				raise chunk
 			if not chunk:
+				return
+			yield chunk, len(chunk), position, time.perf_counter() - began
+
+	def stop(self):
+		"""Stop reading, e.g. when the lines are not read to the end. The thread finishes on its own."""
+		self.stopped.set()
+
+
+def read_chunks_inline(file_name: str, chunk_size: int, start_offset: int):
+	"""Decompress a zstd stream chunk by chunk into a reusable buffer, yielding the same as iterating over a ReadAhead."""
+	with open_dump(file_name) as file_handle:
+		reader = ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle, read_across_frames=True)
+		buffer = bytearray(chunk_size)
+		if start_offset:
+			reader.seek(start_offset)
+		while True:
+			began = time.perf_counter()
+			n = reader.readinto(buffer)
+			if n == 0:
 				break
-			lines = (buffer + chunk).split("\n")
-			
-			for line in lines[:-1]:
-				yield line, file_handle.tell()
-			
-			buffer = lines[-1]
-		
-		reader.close()
\ No newline at end of file
+			yield buffer, n, file_handle.tell(), time.perf_counter() - began
+		reader.close()
+
+
+def read_lines_zst(file_name: str, chunk_size: int = CHUNK_SIZE, start_offset: int = 0, on_chunk=None, read_ahead: int = 0, next_file: str = None):
+	"""
+	Iterate over the raw lines of a zstd-compressed file as bytes, yielding (line, offset) tuples
+	where offset is the position of the line's first byte in the decompressed data. Reading starts at start_offset,
+	which has to be the offset of a line. on_chunk is called after each chunk (see read_lines_with_offsets()).
+	Only complete lines are copied out of the decompressed chunks, so lines are never split inside a multi-byte character
+	and nothing needs to be decoded here. With read_ahead, up to that many chunks are decompressed ahead in a background thread
+	and next_file, the file read after this one, is opened ahead of time (see ReadAhead), otherwise the chunks are decompressed inline.
+	"""
+	chunks = ReadAhead(file_name, chunk_size, start_offset, read_ahead, next_file) if read_ahead > 0 else read_chunks_inline(file_name, chunk_size, start_offset)
+	carry = bytearray() # incomplete line at the end of the previous chunk
+	offset = start_offset
+	try:
+		for buffer, n, position, seconds in chunks:
+			if on_chunk is not None:
+				on_chunk(position, buffer.count(b'\n', 0, n), seconds)
+			view = memoryview(buffer)
+			start = 0
+			while True:
+				end = buffer.find(b'\n', start, n)
+				if end == -1:
+					break
+				if carry:
+					carry += view[start:end]
+					line = bytes(carry)
+					carry.clear()
+				else:
+					line = view[start:end].tobytes()
+				yield line, offset
+				offset += len(line) + 1
+				start = end + 1
+			carry += view[start:n]
+			view.release()
+		if carry:
+			yield bytes(carry), offset
+	finally:
+		if read_ahead > 0:
+			chunks.stop()
+		else:
+			chunks.close()
@@ -0,0 +1,136 @@
+'''
+result_cache: A persistent cache of the search results per month, so that repeated searches over unchanged dumps do not scan them again.
+An entry holds a month's ledger (see process_month_worker) and its number of lines, after a header line that identifies the dump,
+and, unless counting, the rows that were extracted from it (see RowBuffer) in two compressed files next to it, which are copied
+in blocks and never read into memory as a whole. With --cache_counts_only, entries hold no rows and answer counting searches.
+Entries are keyed on the search arguments and are only used while the dump has the same path, size and modification time.
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import argparse
+from array import array
+from zstandard import ZstdCompressor, ZstdDecompressor, ZstdError
+
+from otacon.indexing import file_identity
+
+import logging
+logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+
+
+CACHE_VERSION = 6
+CACHE_DIRNAME = 'otacon_cache'
+# the bytes of rows copied into and out of the cache at once
+COPY_BLOCK_SIZE = 2**20
+
+# the arguments that determine the results of a month, and the output format they are kept in
+QUERY_ARGS = ('searchmode', 'src', 'name', 'case_sensitive', 'commentregex', 'postregex', 'titleregex', 'flairregex', 'userregex',
+              'firstmatch', 'include_quoted', 'toplevel', 'popularity', 'spacy_search', 'language', 'dont_filter', 'return_all', 'output_format')
+
+
+def default_cache_dir(input_dir: str) -> str:
+    """The cache directory that is used if none is given: a subdirectory of the input directory."""
+    return os.path.join(input_dir, CACHE_DIRNAME)
+
+
+def query_fingerprint(args: argparse.Namespace, mode: str = None) -> dict:
+    """
+    The search arguments in a canonical form that does not depend on their order or on how they were given.
+    The mode is that of the search unless given (see --cache_counts_only).
+    """
+    fingerprint = {'version': CACHE_VERSION}
+    for arg in QUERY_ARGS:
+        value = getattr(args, arg, None)
+        if hasattr(value, 'pattern'): # compiled regex
+            value = [value.pattern, value.flags]
+        elif isinstance(value, (set, tuple)):
+            value = sorted(value) if isinstance(value, set) else list(value)
+        fingerprint[arg] = value
+    # counting, extracting and reservoir sampling keep different things per entry (see hit_record)
+    fingerprint['mode'] = mode or ('count' if args.count else 'reservoir' if args.reservoir_size else 'extract')
+    if fingerprint['mode'] == 'count': # there are no rows, so the counts of all output formats are the same
+        del fingerprint['output_format']
+    return fingerprint
+
+
+def entry_path(args: argparse.Namespace, month: str, sample_points=None, mode: str = None) -> str:
+    """The path of the cache entry for a month, given the search arguments, the month's sample points, if any, and the mode (see query_fingerprint())."""
+    digest = hashlib.sha256(json.dumps(query_fingerprint(args, mode), sort_keys=True).encode())
+    if isinstance(sample_points, list):
+        digest.update(array('Q', sample_points).tobytes())
+    elif sample_points is not None: # a BernoulliSample, which is identified by its parameters
+        digest.update(repr(sample_points).encode())
+    return os.path.join(args.cache_dir, f'{month}.{digest.hexdigest()[:24]}.cache')
+
+
+def row_files(path: str) -> tuple:
+    """The files with the rows of the outfile and of the reviewfile that are kept with an entry."""
+    return path + '.out.zst', path + '.review.zst'
+
+
+def identity(infile: str) -> dict:
+    return dict(file_identity(infile), path=os.path.abspath(infile))
+
+
+def read_header(f, infile: str) -> dict:
+    """Read the header line of an open entry. Returns None if the entry is invalid or was not made from the current version of the dump."""
+    try:
+        header = json.loads(f.readline())
+    except ValueError:
+        return None
+    if not isinstance(header, dict) or header.get('identity') != identity(infile):
+        return None
+    return header
+
+
+def is_current(path: str, infile: str, rows: bool) -> bool:
+    """Test if there is an entry for the current version of the dump, with the rows if they are needed, without reading its ledger."""
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        header = read_header(f, infile)
+    return header is not None and (not rows or header['rows'] and all(os.path.isfile(file) for file in row_files(path)))
+
+
+def load(path: str, infile: str) -> tuple:
+    """Return the (ledger, lines) of an entry, or None if there is none for the current version of the dump."""
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            header = read_header(f, infile)
+            if header is None:
+                return None
+            ledger = json.loads(ZstdDecompressor().decompress(f.read()))
+    except (ValueError, ZstdError): # incomplete or corrupted entry
+        return None
+    return [tuple(record) for record in ledger], header['lines']
+
+
+def copy_rows(path: str, out_part: str, review_part: str):
+    """Decompress the rows kept with an entry into the part files of the month (see process_month_worker)."""
+    for file, part in zip(row_files(path), (out_part, review_part)):
+        with open(file, 'rb') as f, open(part, 'wb') as out:
+            shutil.copyfileobj(ZstdDecompressor().stream_reader(f, read_across_frames=True), out, COPY_BLOCK_SIZE)
+
+
+def store(path: str, infile: str, ledger: list, lines: int, out_part: str = None, review_part: str = None):
+    """
+    Write the entry of a month, with the rows in its part files if they are given. The rows are written first and the entry itself last,
+    so an entry is only ever complete or absent.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if out_part is not None:
+        for part, file in zip((out_part, review_part), row_files(path)):
+            with open(part, 'rb') as f, open(file + '.tmp', 'wb') as out:
+                with ZstdCompressor(level=3).stream_writer(out, closefd=False) as writer:
+                    shutil.copyfileobj(f, writer, COPY_BLOCK_SIZE)
+            os.replace(file + '.tmp', file)
+    header = {'identity': identity(infile), 'lines': lines, 'rows': out_part is not None}
+    tmpfile = path + '.tmp'
+    with open(tmpfile, 'wb') as f:
+        f.write(json.dumps(header).encode() + b'\n')
+        f.write(ZstdCompressor(level=3).compress(json.dumps(ledger).encode()))
+    os.replace(tmpfile, path)
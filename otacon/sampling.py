@@ -1,33 +1,139 @@
 import os
-import csv
+import re
+import math
 import random
 
+from otacon.counts import COUNTS_FILE, read_counts, month_of
+
 import logging
 logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
 
 
 def get_samplesize(month: str, sample_proportion: float, input_dir) -> int:
     "Get the number of data points that shall be considered based on the provided %"
-    month = month.replace("RC_", "")
-    month = month.replace("RS_", "")
-    month = month.replace(".zst", "")
-    year = month.split("-")[0] # get year string from the format 'RC_YYYY-MM.zst'
-    m_num = month.split("-")[1] # get month number as string
-
-    countfile = os.path.join(input_dir, "monthly-counts.txt")
-    with open(countfile, "r") as infile:
-        reader = csv.reader(infile, delimiter='\t')
-        for row in reader:
-            y, m, count = row[0], row[1], int(row[2])
-            if y == year and m == m_num:
-                samplesize = round(sample_proportion * count)
-                logging.info(f"With a sample proportion of {sample_proportion}, {samplesize} comments will be looked at.")
-                return samplesize, count
+    year, m_num = month_of(month) # from the format 'RC_YYYY-MM.zst'
+
+    countfile = os.path.join(input_dir, COUNTS_FILE)
+    count = read_counts(countfile).get((year, m_num))
+    if count is None:
+        logging.error(f"{countfile} has no count for {year}-{m_num}, which is needed for sampling. Run the counts command or use --sample_method bernoulli.")
+        exit(1)
+    samplesize = round(sample_proportion * count)
+    logging.info(f"With a sample proportion of {sample_proportion}, {samplesize} comments will be looked at.")
+    return samplesize, count
+
+
+def sample_positions(count: int, samplesize: int):
+    """
+    Yield a random sample of samplesize of the positions below count in increasing order, drawn sequentially
+    with the global random generator, so that neither all positions nor the sample have to be held at once.
+    While the sample is small compared with the remaining positions, the number of positions skipped before the next one
+    is drawn directly (Vitter's Algorithm D), otherwise each position is kept with the probability needed / remaining.
+    """
+    position = -1
+    remaining, needed = count, samplesize
+    while needed > 1 and remaining > 13 * needed:
+        needed_inv, needed_min1_inv = 1.0 / needed, 1.0 / (needed - 1)
+        qu1 = remaining - needed + 1
+        vprime = math.exp(math.log(random.random()) * needed_inv)
+        while True:
+            # a candidate skip, accepted by the squeeze test or else by the exact test
+            while True:
+                x = remaining * (1.0 - vprime)
+                skip = int(x)
+                if skip < qu1:
+                    break
+                vprime = math.exp(math.log(random.random()) * needed_inv)
+            y1 = math.exp(math.log(random.random() * remaining / qu1) * needed_min1_inv)
+            vprime = y1 * (1.0 - x / remaining) * (qu1 / (qu1 - skip))
+            if vprime <= 1.0:
+                break
+            y2, top = 1.0, remaining - 1.0
+            if needed - 1 > skip:
+                bottom, limit = remaining - needed, remaining - skip
+            else:
+                bottom, limit = remaining - skip - 1.0, qu1
+            for _ in range(remaining - 1, limit - 1, -1):
+                y2 = y2 * top / bottom
+                top -= 1
+                bottom -= 1
+            if remaining / (remaining - x) >= y1 * math.exp(math.log(y2) * needed_min1_inv):
+                break
+            vprime = math.exp(math.log(random.random()) * needed_inv)
+        position += skip + 1
+        yield position
+        remaining -= skip + 1
+        needed -= 1
+    while needed:
+        position += 1
+        if random.random() * remaining < needed:
+            yield position
+            needed -= 1
+        remaining -= 1
 
 
 def get_samplepoints(month, sample_proportion, input_dir):
-    "Find the needed samplesize and then generate a list of indexes to consider"
+    "Find the needed samplesize and then generate a sorted list of indexes to consider"
     samplesize, count = get_samplesize(month, sample_proportion, input_dir)
-    all_data_points = list(range(0, count))
-    sample = random.sample(all_data_points, samplesize)
-    return sorted(sample)
\ No newline at end of file
+    # random.sample() would copy a large share of the range into a list, this only keeps the sample
+    return list(sample_positions(count, samplesize))
+
+
+class BernoulliSample:
+    """
+    The positions of a Bernoulli sample of a month: each line is included independently with the sample proportion,
+    so neither the number of lines nor the sample has to be known beforehand.
+    The gaps between the positions are drawn from the geometric distribution instead of drawing for every line.
+    Each month has its own random generator, seeded with its name, so the sample does not depend on the order of the months.
+    """
+
+    def __init__(self, sample_proportion: float, seed: str):
+        self.sample_proportion = sample_proportion
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.next = -1
+        self.advance()
+
+    def advance(self):
+        """Draw the position after the current one."""
+        if self.sample_proportion >= 1:
+            self.next += 1
+            return
+        # number of lines skipped before the next sampled line; 1 - random() is in (0, 1]
+        skip = math.floor(math.log(1 - self.random.random()) / math.log(1 - self.sample_proportion))
+        self.next += 1 + skip
+
+    def positions_below(self, end: int) -> list:
+        """All remaining positions before the given one."""
+        positions = []
+        while self.next < end:
+            positions.append(self.next)
+            self.advance()
+        return positions
+
+    def state(self) -> dict:
+        """The state of the sample, to continue it with restore_sample()."""
+        return {'sample_proportion': self.sample_proportion, 'seed': self.seed, 'next': self.next, 'random_state': self.random.getstate()}
+
+    def __repr__(self):
+        # identifies the sample of a month in the result cache
+        return f"BernoulliSample({self.sample_proportion!r}, {self.seed!r})"
+
+
+def get_sample(month, args):
+    """The sample of a month: its sorted sample points (see get_samplepoints()), or a BernoulliSample with --sample_method bernoulli."""
+    if args.sample_method == 'bernoulli':
+        logging.info(f"With a sample proportion of {args.sample}, each comment will be looked at with that probability.")
+        return BernoulliSample(args.sample, re.sub(r'\.\w+$', '', month)) # the same sample for a dump and its columnar store
+    return get_samplepoints(month, args.sample, args.input)
+
+
+def restore_sample(saved):
+    """The sample of a month as saved in a checkpoint: a list of the remaining sample points or the state of a BernoulliSample."""
+    if not isinstance(saved, dict):
+        return saved
+    sample = BernoulliSample(saved['sample_proportion'], saved['seed'])
+    version, internal_state, gauss_next = saved['random_state']
+    sample.random.setstate((version, tuple(internal_state), gauss_next))
+    sample.next = saved['next']
+    return sample
\ No newline at end of file
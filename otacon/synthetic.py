@@ -0,0 +1,227 @@
+'''
+synthetic: Generate synthetic Pushshift dumps to benchmark otacon on (see benchmark). The comments have the keys of the old dumps
+up to RECENT_KEYS_FROM and those of the recent dumps from then on (see doc/comment_keys_*.txt), in the same order.
+Their texts are drawn from a small vocabulary with word frequencies like those of natural language and include quoted lines
+and bot comments, and a few entries are repeated like in the real dumps.
+
+Usage: python otacon/main.py synthesize --output <directory> [--time_from YYYY-MM] [--months N] [--lines N] [--submissions]
+'''
+
+import os
+import json
+import zlib
+import random
+import argparse
+import calendar
+import itertools
+from zstandard import ZstdCompressor
+
+from otacon.data_types import dir_path, valid_date
+from otacon.counts import update_counts
+
+import logging
+logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+
+
+KEYS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'doc')
+# the first month whose comments have the keys of the recent dumps
+RECENT_KEYS_FROM = (2018, 1)
+SUBMISSION_KEYS = ('author', 'author_flair_text', 'created_utc', 'id', 'is_self', 'name', 'num_comments', 'over_18', 'permalink',
+                   'score', 'selftext', 'subreddit', 'subreddit_id', 'title', 'url')
+
+WORDS = ("the I to a and it you of is that in they this for not be have it's on with but are was just my so like do what if "
+         "people can or all would think me no he about one at get don't will an your there more some them their know she time "
+         "good as her from we his really also said because how even make they're only then had want him than see themself "
+         "pronoun reddit post comment game thread lol yeah sure thing right way well much pretty actually friend anyone").split()
+SUBREDDITS = ('AskReddit', 'funny', 'pics', 'gaming', 'worldnews', 'politics', 'de', 'me_irl', 'NonBinary', 'asktransgender', 'linguistics', 'Showerthoughts')
+FLAIRS = ('they/them', 'she/her', 'he/him', 'she/they', 'he/they', 'Verified', 'Moderator')
+BOT_TEXT = "I am a bot, and this action was performed automatically. Please contact the moderators of this subreddit if you have any questions or concerns."
+
+# how often a comment quotes a line, is written by a bot, has a flair, is a top-level comment or repeats an earlier entry
+QUOTE_RATE = 0.1
+BOT_RATE = 0.02
+FLAIR_RATE = 0.15
+TOPLEVEL_RATE = 0.4
+REPEAT_RATE = 0.002
+USERS = 5000
+
+
+def read_keys(name: str) -> list:
+    """Read the keys of a dump schema from one of the files doc/comment_keys_*.txt."""
+    with open(os.path.join(KEYS_DIR, f'comment_keys_{name}.txt'), 'r') as f:
+        return [line.strip().strip("'") for line in f if line.strip()]
+
+
+def base36(number: int) -> str:
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    text = ''
+    while True:
+        number, digit = divmod(number, 36)
+        text = digits[digit] + text
+        if number == 0:
+            return text
+
+
+def default_value(key: str):
+    """The value of a key that the search does not look at, of the type it has in the dumps."""
+    if key.startswith(('is_', 'can_', 'no_', 'author_is_', 'author_p', 'over_')) or key in ('archived', 'collapsed', 'collapsed_because_crowd_control', 'edited', 'locked', 'send_replies', 'stickied', 'score_hidden'):
+        return False
+    if key in ('all_awardings', 'author_flair_richtext', 'treatment_tags'):
+        return []
+    if key == 'gildings':
+        return {}
+    if key in ('controversiality', 'gilded', 'downs', 'total_awards_received', 'num_comments'):
+        return 0
+    return None
+
+
+def zipf_weights(n: int) -> list:
+    """The cumulative weights of n items whose frequencies follow Zipf's law, like the words of a language."""
+    return list(itertools.accumulate(1 / rank for rank in range(1, n + 1)))
+
+
+class Generator:
+    """Draws synthetic comments and submissions. Each draw depends only on the seed and the draws before it."""
+
+    def __init__(self, seed: int = 42):
+        self.random = random.Random(seed)
+        self.word_weights = zipf_weights(len(WORDS))
+        self.users = [f'user_{base36(i * 7919)}' for i in range(USERS)] + ['AutoModerator', '[deleted]']
+        # a few percent of the comments are by AutoModerator or deleted
+        weights = zipf_weights(USERS)
+        self.user_weights = weights + [weights[-1] * 1.02, weights[-1] * 1.07]
+        self.subreddit_weights = zipf_weights(len(SUBREDDITS))
+        self.next_id = 36**5
+        self.drawn = []
+
+    def text(self, words: int) -> str:
+        text = ' '.join(self.random.choices(WORDS, cum_weights=self.word_weights, k=words))
+        return text[0].upper() + text[1:] + '.'
+
+    def body(self) -> tuple:
+        """The text of a comment and its author."""
+        if self.random.random() < BOT_RATE:
+            return BOT_TEXT, self.random.choice(['AutoModerator', 'RemindMeBot', 'WikiTextBot'])
+        paragraphs = [self.text(self.random.randint(3, 40)) for _ in range(self.random.choice([1, 1, 1, 2, 3]))]
+        if self.random.random() < QUOTE_RATE:
+            paragraphs.insert(0, '&gt; ' + self.text(self.random.randint(3, 20)))
+        return '\n\n'.join(paragraphs), self.random.choices(self.users, cum_weights=self.user_weights)[0]
+
+    def values(self, created_utc: int, recent: bool) -> dict:
+        """The values of the keys of a comment that the search may look at."""
+        body, author = self.body()
+        subreddit = self.random.choices(SUBREDDITS, cum_weights=self.subreddit_weights)[0]
+        id = base36(self.next_id)
+        self.next_id += self.random.randint(1, 50)
+        link_id = 't3_' + base36(self.random.randint(36**4, 36**5))
+        return {
+            'id': id, 'name': 't1_' + id, 'body': body, 'author': author, 'author_fullname': 't2_' + base36(zlib.crc32(author.encode())),
+            'subreddit': subreddit, 'subreddit_id': 't5_' + base36(SUBREDDITS.index(subreddit) + 1000),
+            'score': int(self.random.paretovariate(1.2)) - self.random.randint(0, 3), 'ups': 1,
+            'author_flair_text': self.random.choice(FLAIRS) if self.random.random() < FLAIR_RATE else None,
+            # the timestamps are strings in the old dumps
+            'created_utc': created_utc if recent else str(created_utc), 'retrieved_on': created_utc + 86400, 'retrieved_utc': created_utc + 86400,
+            'author_created_utc': created_utc - 10**7,
+            'link_id': link_id, 'parent_id': link_id if self.random.random() < TOPLEVEL_RATE else 't1_' + base36(self.next_id - self.random.randint(1, 10**4)),
+            'permalink': f'/r/{subreddit}/comments/{link_id[3:]}/_/{id}/',
+        }
+
+    def comment(self, created_utc: int, keys: list, recent: bool) -> dict:
+        values = self.values(created_utc, recent)
+        return {key: values[key] if key in values else default_value(key) for key in keys}
+
+    def submission(self, created_utc: int, keys: list, recent: bool) -> dict:
+        values = self.values(created_utc, recent)
+        values.update(name='t3_' + values['id'], title=self.text(self.random.randint(3, 15)), is_self=True,
+                      selftext=values.pop('body') if self.random.random() < 0.5 else '',
+                      url=f"https://www.reddit.com/r/{values['subreddit']}/comments/{values['id']}/",
+                      permalink=f"/r/{values['subreddit']}/comments/{values['id']}/_/")
+        # like the comments, the old submissions have no permalink
+        return {key: values[key] if key in values else default_value(key) for key in keys if recent or key != 'permalink'}
+
+    def entries(self, kind: str, year: int, month: int, lines: int):
+        """Draw the entries of a month, in the order of their creation time, some of them repeating earlier ones."""
+        recent = (year, month) >= RECENT_KEYS_FROM
+        keys = read_keys('recent-data' if recent else 'old-data') if kind == 'RC' else list(SUBMISSION_KEYS)
+        start = calendar.timegm((year, month, 1, 0, 0, 0))
+        seconds = calendar.monthrange(year, month)[1] * 86400
+        for i in range(lines):
+            if self.drawn and self.random.random() < REPEAT_RATE:
+                yield self.random.choice(self.drawn)
+                continue
+            draw = self.comment if kind == 'RC' else self.submission
+            entry = draw(start + i * seconds // lines, keys, recent)
+            if len(self.drawn) < 10**4:
+                self.drawn.append(entry)
+            yield entry
+
+
+def write_dump(path: str, entries, level: int = 3):
+    """Write entries as a zstd compressed dump of JSON lines."""
+    with open(path, 'wb') as f:
+        with ZstdCompressor(level=level).stream_writer(f) as writer:
+            block = []
+            for entry in entries:
+                block.append(json.dumps(entry))
+                if len(block) == 10**4:
+                    _=writer.write(('\n'.join(block) + '\n').encode('utf-8'))
+                    block = []
+            if block:
+                _=writer.write(('\n'.join(block) + '\n').encode('utf-8'))
+
+
+def months_from(time_from: tuple, months: int) -> list:
+    year, month = time_from
+    timeframe = []
+    for _ in range(months):
+        timeframe.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return timeframe
+
+
+def synthesize(output: str, time_from: tuple, months: int, lines: int, submissions: bool = False, seed: int = 42, level: int = 3) -> list:
+    """
+    Write synthetic dumps of comments to the directory 'comments' in output, and of submissions to 'submissions' if set,
+    each with its counts file. Returns the directories.
+    """
+    directories = []
+    for kind, name in [('RC', 'comments')] + ([('RS', 'submissions')] if submissions else []):
+        directory = os.path.join(output, name)
+        os.makedirs(directory, exist_ok=True)
+        generator = Generator(seed)
+        for year, month in months_from(time_from, months):
+            path = os.path.join(directory, f'{kind}_{year}-{month:02d}.zst')
+            logging.info(f"Writing {lines} entries to {path}")
+            write_dump(path, generator.entries(kind, year, month, lines), level)
+        update_counts(directory)
+        directories.append(directory)
+    return directories
+
+
+def define_parser() -> argparse.ArgumentParser:
+    """Define console argument parser for the synthesize command."""
+    parser = argparse.ArgumentParser(prog="otacon synthesize", description="Generate synthetic Pushshift dumps for benchmarks")
+    parser.add_argument('--output', '-O', type=dir_path, required=True,
+                        help="The directory the dumps are written to, comments to its subdirectory 'comments' and submissions to 'submissions'.")
+    parser.add_argument('--time_from', '-F', type=valid_date, default=(2017, 11), required=False,
+                        help=f"The first month, as YYYY-MM. Defaults to 2017-11, so the default months have both the old keys and the recent ones (from {RECENT_KEYS_FROM[0]}-{RECENT_KEYS_FROM[1]:02d}).")
+    parser.add_argument('--months', type=int, default=4, required=False,
+                        help="The number of months. Defaults to 4.")
+    parser.add_argument('--lines', type=int, default=100_000, required=False,
+                        help="The number of entries per month. Defaults to 100000, about 30 MB of JSON.")
+    parser.add_argument('--submissions', action='store_true', required=False,
+                        help="Also write dumps of submissions.")
+    parser.add_argument('--seed', type=int, default=42, required=False,
+                        help="The random seed. The same seed gives the same dumps.")
+    parser.add_argument('--level', type=int, default=3, required=False,
+                        help="The zstd compression level. Defaults to 3.")
+    return parser
+
+
+def main(argv=None):
+    args = define_parser().parse_args(argv)
+    synthesize(args.output, args.time_from, args.months, args.lines, args.submissions, args.seed, args.level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+'''
+writers: The writers of the output files, which write rows as CSV, as JSON lines (both optionally compressed with zstd) or to a Parquet file.
+A writer is opened once per file and kept open for the whole search, so rows are written in large buffered blocks.
+Rows are passed between processes and kept in the result cache as the text they take up in the output file (see RowBuffer),
+so they are written as they are, only rows for a Parquet file are passed as JSON lines.
+'''
+
+import io
+import os
+import re
+import csv
+import json
+from zstandard import ZstdCompressor, ZstdDecompressor, FLUSH_FRAME
+
+# Parquet output is optional, so is its dependency
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+OUTPUT_FORMATS = ('csv', 'csv.zst', 'jsonl', 'jsonl.zst', 'parquet')
+BUFFER_SIZE = 2**20
+COMPRESSION_LEVEL = 3
+PARQUET_ROW_GROUP_SIZE = 100_000
+# the columns that are not strings in a Parquet file, all others are
+INTEGER_COLUMNS = ('year', 'month', 'score', 'timestamp_utc')
+SPAN_COLUMN = 'span'
+
+# the writers that are open, by path
+open_writers = {}
+
+
+def format_of(path: str) -> str:
+    """The output format of a file, from its file ending, or None if it is none of the output formats."""
+    for output_format in sorted(OUTPUT_FORMATS, key=len, reverse=True):
+        if path.endswith('.' + output_format):
+            return output_format
+    return None
+
+
+def rendered_rows(text: str):
+    """
+    Iterate over the rows in a text rendered by a RowBuffer for a Parquet file, i.e. as JSON lines.
+    JSON has no tuples, so the spans come back as lists and are turned into tuples again.
+    """
+    for line in text.splitlines():
+        row = json.loads(line)
+        yield [tuple(value) if isinstance(value, list) else value for value in row] if isinstance(row, list) else row
+
+
+class RowFormat:
+    """
+    Writes rows to the text stream self.text as CSV or as JSON lines, depending on the output format.
+    Without headers, each row is an entry that is written as is (see --return_all), otherwise the JSON line of a row is an object with the headers as keys.
+    """
+
+    def start_rows(self, text, output_format: str, headers: list):
+        self.text = text
+        self.output_format = output_format
+        self.headers = headers
+        self.rows = 0
+        self.csvwriter = csv.writer(text, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL) if output_format.startswith('csv') else None
+
+    def writerow(self, row):
+        self.rows += 1
+        if self.csvwriter is not None:
+            self.csvwriter.writerow(row)
+        elif self.headers is None:
+            _=self.text.write(json.dumps(row) + '\n')
+        else:
+            _=self.text.write(json.dumps(dict(zip(self.headers, row))) + '\n')
+
+
+class RowBuffer(RowFormat):
+    """
+    Collects rows as the text they take up in an output file of the given format with the given headers, the form in which rows are
+    passed between processes and kept in the result cache, so the writer of the file only copies them (see write_rendered()).
+    Rows for a Parquet file, which is not text, are collected as JSON lines, from which the writer reads them again (see rendered_rows()).
+    """
+
+    def __init__(self, output_format: str = 'parquet', headers: list = None):
+        self.start_rows(io.StringIO(), 'jsonl' if output_format == 'parquet' else output_format, headers if output_format != 'parquet' else None)
+
+    def getvalue(self) -> str:
+        return self.text.getvalue()
+
+
+def open_text(path: str):
+    """Open an output file with rows as text for reading, decompressing it if necessary."""
+    f = open(path, 'rb')
+    stream = ZstdDecompressor().stream_reader(f, read_across_frames=True, closefd=True) if path.endswith('.zst') else f
+    return io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+
+class TextWriter(RowFormat):
+    """
+    Writes rows as CSV or as JSON lines (see RowFormat), to a text file or a zstd compressed one. The header row of a CSV file is written if the file is new.
+    Rows are appended to an existing file, e.g. when resuming a search, and had_rows tells if it already held any.
+    """
+
+    def __init__(self, path: str, headers: list):
+        self.path = path
+        output_format = format_of(path)
+        self.appended = os.path.isfile(path) and os.path.getsize(path) > 0
+        self.had_rows = False
+        if self.appended:
+            header_length = len(';'.join(headers)) + 2 if output_format.startswith('csv') and headers is not None else 0
+            with open_text(path) as f:
+                self.had_rows = len(f.read(header_length + 1)) > header_length
+        self.compressor = None
+        if output_format.endswith('.zst'):
+            self.compressor = ZstdCompressor(level=COMPRESSION_LEVEL).stream_writer(open(path, 'ab'))
+            text = io.TextIOWrapper(io.BufferedWriter(self.compressor, BUFFER_SIZE), encoding='utf-8')
+        else:
+            text = open(path, 'a', encoding='utf-8', buffering=BUFFER_SIZE)
+        self.start_rows(text, output_format, headers)
+        if self.csvwriter is not None and not self.appended and headers is not None:
+            self.csvwriter.writerow(headers)
+
+    def write_rendered(self, text: str, rows: int):
+        """Write the given number of rows, rendered by a RowBuffer for this file's format and headers, as they are."""
+        self.rows += rows
+        _=self.text.write(text)
+
+    def flush(self):
+        """Write all rows to the file. A compressed file ends with a complete frame afterwards, so it can be cut back to its current size (see checkpoint)."""
+        self.text.flush()
+        if self.compressor is not None:
+            self.compressor.flush(FLUSH_FRAME)
+
+    def close(self):
+        self.text.close()
+
+
+def parquet_schema(headers: list):
+    """The schema of a Parquet file with the given columns."""
+    return pa.schema([(header, pa.int64() if header in INTEGER_COLUMNS else pa.list_(pa.int64()) if header == SPAN_COLUMN else pa.string()) for header in headers])
+
+
+class ParquetWriter:
+    """Writes rows to a Parquet file in row groups of PARQUET_ROW_GROUP_SIZE rows. A Parquet file cannot be appended to, so it is always written anew."""
+
+    def __init__(self, path: str, headers: list):
+        self.path = path
+        self.headers = headers
+        self.had_rows = False
+        self.rows = 0
+        self.pending = []
+        self.schema = parquet_schema(headers)
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def writerow(self, row):
+        self.rows += 1
+        self.pending.append(row)
+        if len(self.pending) >= PARQUET_ROW_GROUP_SIZE:
+            self.write_pending()
+
+    def write_rendered(self, text: str, rows: int):
+        """Write the rows of a text rendered by a RowBuffer for a Parquet file."""
+        for row in rendered_rows(text):
+            self.writerow(row)
+
+    def write_pending(self):
+        if not self.pending:
+            return
+        columns = []
+        for field, values in zip(self.schema, zip(*self.pending)):
+            if field.name in INTEGER_COLUMNS: # the timestamps are strings in some dumps, and all values are strings in rows read from CSV files
+                values = [int(value) if value not in (None, '') else None for value in values]
+            elif field.name == SPAN_COLUMN:
+                values = [tuple(int(number) for number in re.findall(r'\d+', value)) if isinstance(value, str) else value for value in values]
+                values = [value if value != () else None for value in values]
+            elif field.type == pa.string():
+                values = [str(value) if value is not None else None for value in values]
+            columns.append(pa.array(values, field.type))
+        self.writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+        self.pending = []
+
+    def flush(self):
+        pass # rows are written in whole row groups
+
+    def close(self):
+        self.write_pending()
+        self.writer.close()
+
+
+def open_writer(path: str, headers: list):
+    """Return the writer of an output file, opening it with the given headers if it is not open yet."""
+    if path not in open_writers:
+        if format_of(path) == 'parquet':
+            open_writers[path] = ParquetWriter(path, headers)
+        else:
+            open_writers[path] = TextWriter(path, headers)
+    return open_writers[path]
+
+
+def close_writer(path: str):
+    """Close the writer of an output file if it is open, returning it (or None)."""
+    writer = open_writers.pop(path, None)
+    if writer is not None:
+        writer.close()
+    return writer
+
+
+def close_writers():
+    for path in list(open_writers):
+        close_writer(path)
+
+
+def read_rows(path: str):
+    """
+    Iterate over the rows of an output file, as lists for CSV and Parquet files, whose first row is the header (the column names of a Parquet file),
+    and as dicts for JSON lines.
+    """
+    output_format = format_of(path)
+    if output_format == 'parquet':
+        parquet_file = pq.ParquetFile(path)
+        yield parquet_file.schema_arrow.names
+        for batch in parquet_file.iter_batches():
+            yield from (list(row) for row in zip(*(column.to_pylist() for column in batch.columns)))
+        return
+    with open_text(path) as text:
+        if output_format.startswith('csv'):
+            yield from csv.reader(text, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        else:
+            yield from (json.loads(line) for line in text)
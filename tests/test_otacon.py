@@ -1,17 +1,40 @@
 import pytest
 import argparse
+import io
 
 import os
 import re
+import sys
+import shutil
+import subprocess
+import json
+import random
+import collections
 import datetime
 
-from otacon.main import valid_date
-from otacon.main import dir_path
-from otacon.main import within_timeframe
+from otacon.data_types import valid_date
+from otacon.data_types import dir_path
+from otacon.prep_input import within_timeframe
 from otacon.main import filter
-from otacon.main import fetch_data_timeframe
+from otacon.prep_input import fetch_data_timeframe
 from otacon.main import inside_quote
-from otacon.main import comment_regex
+from otacon.data_types import comment_regex
+from otacon.main import matching_spans
+from otacon.main import sampled
+from otacon.sampling import BernoulliSample, sample_positions
+from otacon.dedupe import IdSet, BloomFilter
+from otacon.prefilter import required_literals
+from otacon.pos_tagging import PosSearch
+from otacon.writers import RowBuffer, rendered_rows, format_of, open_writer, close_writers
+from otacon.finalize import record_blocks, prefix_records
+from otacon.synthetic import Generator, read_keys, synthesize
+from otacon.counts import update_counts
+from otacon.indexing import build_index, lookup_offsets
+from otacon.metrics import StageClock
+from otacon.profiling import SearchProfile
+from otacon.criteria import CriteriaChain, SAMPLE_EVERY, REORDER_EVERY
+from otacon.pushshift_handling import read_lines_zst, read_lines_with_offsets
+from zstandard import ZstdCompressor
 
 def test_valid_date():
     assert valid_date('2010-01') == (2010, 1)
@@ -72,7 +95,251 @@ def test_inside_quote():
     assert inside_quote(text, span1) == True
     assert inside_quote(text, span2) == False
 
+def test_matching_spans():
+    text = '&gt; they said it\n\nthey did'
+    regex = re.compile('they')
+
+    assert matching_spans(text, regex, include_quoted=True) == [(5, 9), (19, 23)]
+    assert matching_spans(text, regex, include_quoted=False) == [(19, 23)]
+    assert matching_spans('they', regex, include_quoted=False) == [(0, 4)]
+
 def test_comment_regex():
     string = '(?i)^naja'
 
-    assert comment_regex(string) == '^(?i)(^>.+\n\n)*naja'
\ No newline at end of file
+    assert comment_regex(string) == '^(?i)(^>.+\n\n)*naja'
+
+def test_sampled():
+    lines = [(i, None, b'') for i in range(10)]
+
+    assert [line[0] for line in sampled(lines, [2, 5, 7])] == [2, 5]
+    assert [line[0] for line in sampled(lines, [])] == []
+    assert [line[0] for line in sampled(lines, BernoulliSample(1.0, 'RC_2010-01'))] == list(range(10))
+    positions = [line[0] for line in sampled(lines, BernoulliSample(0.5, 'RC_2010-01'))]
+    assert positions == BernoulliSample(0.5, 'RC_2010-01').positions_below(10)
+
+def test_sample_positions():
+    random.seed(1)
+    for count, samplesize in [(10**6, 1000), (10**6, 300000), (100, 100), (100, 0)]:
+        positions = list(sample_positions(count, samplesize))
+        assert len(positions) == samplesize and positions == sorted(set(positions)) and all(0 <= position < count for position in positions)
+    # every position is equally likely to be sampled
+    counts = collections.Counter(position for _ in range(20000) for position in sample_positions(100, 2))
+    assert len(counts) == 100 and 300 < min(counts.values()) and max(counts.values()) < 500
+
+def test_required_literals():
+    assert required_literals(re.compile('colou?r')) == ['color', 'colour']
+    assert required_literals(re.compile('(?:he|she) said')) == ['he said']
+    assert required_literals(re.compile('(?:thei|they|them)(?:re|ve)?')) == ['thei', 'they', 'them']
+    assert required_literals(re.compile('x?')) is None
+
+def test_pos_search():
+    class Token:
+        def __init__(self, text, pos):
+            self.text, self.pos_ = text, pos
+    class Model: # tags each word after 'to' as a verb and keeps the tagged texts
+        def __init__(self):
+            self.tagged = []
+        def pipe(self, texts, batch_size, n_process):
+            for text in texts:
+                self.tagged.append(text)
+                words = text.split()
+                yield [Token(word, 'VERB' if i > 0 and words[i - 1] == 'to' else 'NOUN') for i, word in enumerate(words)]
+    nlp = Model()
+    search = PosSearch(nlp, 'Halt', 'VERB', batch_size=2)
+
+    assert search.find(['to halt', 'halt to', 'to halt', 'to Halt now']) == [True, False, True, True]
+    assert search.find(['halt to', 'halt']) == [False, False]
+    assert nlp.tagged == ['to halt', 'halt to', 'to Halt now', 'halt']
+
+def test_rendered_rows(tmp_path):
+    rows = [['comment', 2010, 1, 'abc', 'they said\n"it"', (5, 9), 'they', None], {'id': 'abc', 'body': 'x'}]
+    buffer = RowBuffer()
+    for row in rows:
+        buffer.writerow(row)
+
+    assert list(rendered_rows(buffer.getvalue())) == rows
+    for output_format, headers in [('csv', ['type', 'year', 'month', 'id', 'text', 'span', 'matched', 'user']), ('jsonl.zst', ['a'] * 8), ('jsonl', None)]:
+        written, rendered = open_writer(str(tmp_path / f'written.{output_format}'), headers), open_writer(str(tmp_path / f'rendered.{output_format}'), headers)
+        buffer = RowBuffer(output_format, headers)
+        for row in rows[:1] * 3:
+            written.writerow(row)
+            buffer.writerow(row)
+        rendered.write_rendered(buffer.getvalue(), buffer.rows)
+        assert written.rows == rendered.rows == 3
+        close_writers()
+        assert (tmp_path / f'written.{output_format}').read_bytes() == (tmp_path / f'rendered.{output_format}').read_bytes()
+    assert format_of('comment_extraction.csv.zst') == 'csv.zst'
+    assert format_of('comment_extraction.jsonl') == 'jsonl'
+    assert format_of('comment_extraction.zst') is None
+
+def test_prefix_records():
+    text = 'abc;"they said\r\n""it"""\r\ndef;x\r\n'
+    blocks = list(record_blocks(io.StringIO(text), block_size=4))
+    assert ''.join(blocks) == text
+    assert all(block.count('"') % 2 == 0 for block in blocks)
+    assert ''.join(prefix_records(block, 'comment;2010;01;') for block in blocks) == 'comment;2010;01;abc;"they said\r\n""it"""\r\ncomment;2010;01;def;x\r\n'
+
+def test_synthetic_entries():
+    old = list(Generator(seed=1).entries('RC', 2017, 12, 50))
+    recent = list(Generator(seed=1).entries('RC', 2018, 1, 50))
+    assert list(old[0]) == read_keys('old-data') and isinstance(old[0]['created_utc'], str)
+    assert list(recent[0]) == read_keys('recent-data') and 'permalink' in recent[0]
+    assert old == list(Generator(seed=1).entries('RC', 2017, 12, 50))
+
+def test_stage_clock():
+    clock = StageClock()
+    clock.switch('relevance')
+    clock.spent('decompress', 5.0)
+    assert clock.switch('write') == 'relevance'
+    times = clock.take()
+    assert times['decompress'] == 5.0 and times['relevance'] < 0 # the seconds were taken from the stage the clock was in
+    assert clock.stage is None and sum(clock.times.values()) == 0
+    clock.add({'spacy': 1.5})
+    assert clock.times['spacy'] == 1.5
+
+def test_search_profile():
+    profile = SearchProfile(lines=5)
+    check = profile.timed('even', lambda number: number % 2 == 0)
+    assert [number for number in profile.sliced(iter(range(4))) if check(number)] == [0, 2]
+    assert list(profile.sliced(iter(range(10, 20)))) == [10] # the rest of the slice
+    assert list(profile.sliced(iter(range(3)))) == []
+    assert profile.criteria['even'][:2] == [4, 2]
+
+def test_criteria_chain():
+    chain = CriteriaChain([('hundreds', lambda number: number % 100 != 0), ('odd', lambda number: number % 2 == 1)], last=('tag', lambda number, tag: tag))
+    numbers = random.Random(1).sample(range(10**6), SAMPLE_EVERY * REORDER_EVERY)
+    assert [number for number in numbers if chain(number)] == [number for number in numbers if number % 100 and number % 2]
+    assert chain.names() == ['odd', 'hundreds', 'tag'] # odd rejects half of the numbers, hundreds only one in a hundred
+    assert chain(101) and not chain(101, tag=False) and not chain(200)
+
+def test_read_ahead(tmp_path):
+    dump = tmp_path / 'RC_2010-01.zst'
+    dump.write_bytes(ZstdCompressor().compress(b''.join(b'{"body": "%d \xc3\xa4"}\n' % i for i in range(1000))))
+    inline = list(read_lines_zst(str(dump), chunk_size=100))
+    assert list(read_lines_zst(str(dump), chunk_size=100, read_ahead=2)) == inline
+    assert list(read_lines_zst(str(dump), chunk_size=100, start_offset=inline[500][1], read_ahead=1)) == inline[500:]
+    assert len(inline) == 1000 and inline[1] == (b'{"body": "1 \xc3\xa4"}', len(inline[0][0]) + 1)
+
+def test_update_counts(tmp_path):
+    (tmp_path / 'RC_2010-01.zst').write_bytes(ZstdCompressor().compress(b'{}\n' * 3))
+    (tmp_path / 'RC_2010-02').write_bytes(b'{}\n{}')
+    assert update_counts(str(tmp_path)) == {('2010', '01'): 3, ('2010', '02'): 2}
+    (tmp_path / 'RS_2010-01.zst').write_bytes(ZstdCompressor().compress(b'{}\n'))
+    with pytest.raises(ValueError):
+        update_counts(str(tmp_path))
+
+def test_id_set(tmp_path):
+    keys = random.Random(1).sample(range(1, 2**63), 100000)
+    others = random.Random(2).sample(range(1, 2**63), 10000)
+    ids = IdSet(memory_budget=1, spill_dir=str(tmp_path)) # every full table is moved to disk
+    for key in keys:
+        ids.add(key)
+    assert len(ids.spilled) == 2 and len(ids) == len(keys)
+    assert all(key in ids for key in keys) and not any(key in ids for key in others)
+    (tmp_path / 'checkpoint').mkdir()
+    meta = ids.save(str(tmp_path / 'checkpoint'), 1)
+    loaded = IdSet.load(str(tmp_path / 'checkpoint'), 1, meta, memory_budget=1, spill_dir=str(tmp_path))
+    assert len(loaded) == len(keys) and all(key in loaded for key in keys) and not any(key in loaded for key in others)
+
+def test_bloom_filter(tmp_path):
+    keys = random.Random(1).sample(range(1, 2**63), 10000)
+    others = random.Random(2).sample(range(1, 2**63), 20000)
+    bloom = BloomFilter(capacity=10000, error_rate=0.01)
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    assert sum(key in bloom for key in others) / len(others) < 0.015
+    loaded = BloomFilter.load(str(tmp_path), 1, bloom.save(str(tmp_path), 1))
+    assert loaded.bits == bloom.bits and len(loaded) == len(keys)
+
+# runs a search that dies after KILL_AFTER lines, as if the process was killed, with the rows written since the last checkpoint on disk
+KILLED_SEARCH = """
+import os, sys
+import otacon.main as search
+import otacon.writers as writers
+decode_if_relevant, lines = search.decode_if_relevant, [0]
+def killed(*args, **kwargs):
+    lines[0] += 1
+    if lines[0] > int(os.environ['KILL_AFTER']):
+        for writer in writers.open_writers.values():
+            writer.flush()
+        os._exit(9)
+    return decode_if_relevant(*args, **kwargs)
+search.decode_if_relevant = killed
+search.main()
+"""
+
+def run_search(arguments: list, output, kill_after: int = None) -> int:
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=package_dir, KILL_AFTER=str(kill_after))
+    command = [sys.executable, '-c', KILLED_SEARCH] if kill_after is not None else [sys.executable, '-m', 'otacon.main']
+    return subprocess.run(command + arguments + ['-O', str(output), '--progress_interval', '0'], cwd=package_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+
+def output_files(output) -> dict:
+    return {re.sub('_executed-at_[^.]*', '', name): (output / name).read_text() for name in os.listdir(output) if not name.startswith('.')}
+
+def test_resume(tmp_path):
+    data = synthesize(str(tmp_path), (2018, 1), months=3, lines=2000)[0]
+    # each search is killed halfway through the second month, of which it decodes all lines or a sample of half of them
+    searches = [(['-CR', r'\bthe\b'], 3000), (['-CR', r'\bthey\b', '--sample', '0.5'], 1500), (['-CR', r'\bit\b', '--sample', '0.5', '--sample_method', 'bernoulli'], 1500)]
+    for search, kill_after in searches:
+        complete, resumed = tmp_path / 'complete', tmp_path / 'resumed'
+        complete.mkdir(), resumed.mkdir()
+        assert run_search(['-I', data] + search, complete) == 0
+        assert run_search(['-I', data, '--checkpoint', '--checkpoint_interval', '0.0001'] + search, resumed, kill_after) == 9
+        assert os.listdir(resumed / '.otacon_checkpoint')
+        assert run_search(['-I', data, '--resume', '--checkpoint_interval', '0.0001'] + search, resumed) == 0
+        outputs = output_files(complete)
+        assert output_files(resumed) == outputs and sum(text.count('\n') for text in outputs.values()) > 100
+        shutil.rmtree(complete), shutil.rmtree(resumed)
+
+def test_queries(tmp_path):
+    data = synthesize(str(tmp_path), (2018, 1), months=2, lines=2000)[0]
+    # the searches match many of the same entries, so each one has to keep its own duplicate check, sample, reservoir and random state
+    queries = {'the': {'commentregex': r'\bthe\b'}, 'sampled': {'commentregex': r'\bthe\b|\bit\b', 'sample': 0.5}, 'reservoir': {'commentregex': r'\bit\b', 'reservoir_size': 50}}
+    searches = {'the': ['-CR', r'\bthe\b'], 'sampled': ['-CR', r'\bthe\b|\bit\b', '--sample', '0.5'], 'reservoir': ['-CR', r'\bit\b', '--reservoir_size', '50']}
+    (tmp_path / 'queries.json').write_text(json.dumps(queries))
+    (tmp_path / 'queries').mkdir()
+    assert run_search(['-I', data, '--queries', str(tmp_path / 'queries.json')], tmp_path / 'queries') == 0
+    for name, search in searches.items():
+        (tmp_path / name).mkdir()
+        assert run_search(['-I', data] + search, tmp_path / name) == 0
+        outputs = output_files(tmp_path / name)
+        assert sorted(output_files(tmp_path / 'queries' / name).values()) == sorted(outputs.values()) and len(outputs) >= 2
+
+def test_index_lookup(tmp_path):
+    dump = synthesize(str(tmp_path), (2018, 1), months=1, lines=2000)[0] + '/RC_2018-01.zst'
+    build_index(dump, str(tmp_path / 'RC_2018-01.zst.idx'))
+    entries = [(json.loads(line), offset) for line, offset in read_lines_with_offsets(dump)]
+    for field in ['subreddit', 'author']:
+        values = sorted({entry[field] for entry, _ in entries})
+        names = random.Random(1).sample(values, 3) + ['not a ' + field]
+        assert lookup_offsets(str(tmp_path), dump, field, names, case_sensitive=True) == [offset for entry, offset in entries if entry[field] in names]
+        names = {name.lower() for name in names}
+        assert lookup_offsets(str(tmp_path), dump, field, names, case_sensitive=False) == [offset for entry, offset in entries if entry[field].lower() in names]
+
+def test_result_cache(tmp_path):
+    data = synthesize(str(tmp_path), (2018, 1), months=2, lines=2000)[0]
+    cache = ['--cache_dir', str(tmp_path / 'cache')]
+    # a search answered by the cache, with its rows or only with its counts, writes the same files as one that is not
+    searches = [(['-CR', r'\bthe\b'], ['--cache']), (['-CR', r'\bit\b', '--count'], ['--cache']), (['-CR', r'\bthey\b'], ['--cache', '-W', '2']),
+                (['-CR', r'\bit\b', '--count'], ['--cache_counts_only'])]
+    for search, caching in searches:
+        for name in ['uncached', 'cold', 'warm']:
+            (tmp_path / name).mkdir()
+        assert run_search(['-I', data] + search, tmp_path / 'uncached') == 0
+        assert run_search(['-I', data] + search + caching + cache, tmp_path / 'cold') == 0
+        assert run_search(['-I', data] + search + caching + cache, tmp_path / 'warm') == 0
+        outputs = output_files(tmp_path / 'uncached')
+        assert output_files(tmp_path / 'cold') == outputs and output_files(tmp_path / 'warm') == outputs
+        for name in ['uncached', 'cold', 'warm']:
+            shutil.rmtree(tmp_path / name)
+    # the counts kept by an extracting search with --cache_counts_only answer a later counting search
+    shutil.rmtree(tmp_path / 'cache')
+    (tmp_path / 'extracted').mkdir(), (tmp_path / 'counted').mkdir(), (tmp_path / 'uncached').mkdir()
+    assert run_search(['-I', data, '-CR', r'\bthe\b', '--cache_counts_only'] + cache, tmp_path / 'extracted') == 0
+    assert all(not name.endswith('.zst') for name in os.listdir(tmp_path / 'cache'))
+    os.utime(data + '/RC_2018-01.zst', (0, 0)) # the dump changed, so only the other month is answered by the cache
+    assert run_search(['-I', data, '-CR', r'\bthe\b', '--count', '--cache'] + cache, tmp_path / 'counted') == 0
+    assert run_search(['-I', data, '-CR', r'\bthe\b', '--count'], tmp_path / 'uncached') == 0
+    assert output_files(tmp_path / 'counted') == output_files(tmp_path / 'uncached')